@@ -0,0 +1,201 @@
+# Standard imports
+import copy
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "giphy.json")
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeGiphy(object):
+    """
+    Local stand-in for GIPHY's search and gifs endpoints, serving responses
+    built from recorded ones with optional latency and error injection
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=None):
+        """
+        Initializer
+
+        :param latency: Seconds every response is delayed by
+        :type latency: float
+            :default: 0.0
+        :param error_rate: Fraction of requests answered with a 500
+        :type error_rate: float
+            :default: 0.0
+        :param seed: Seed of the error injection, for reproducible runs
+        :type seed: int
+        :returns: Nothing
+        :rtype: None
+        """
+        with open(FIXTURE) as _file:
+            self.recorded = json.load(_file)
+
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        """
+        Base URL of the running server
+
+        :returns: URL without a trailing slash
+        :rtype: str
+        """
+        host, port = self._server.server_address
+        return "http://{}:{}".format(host, port)
+
+    def start(self, host="127.0.0.1", port=0):
+        """
+        Starts serving on a background thread
+
+        :param host: Interface to listen on
+        :type host: str
+            :default: 127.0.0.1
+        :param port: Port to listen on, 0 picks a free one
+        :type port: int
+            :default: 0
+        :returns: Nothing
+        :rtype: None
+        """
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, like the real thing
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                fake.handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = _ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(
+            target=self._server.serve_forever, daemon=True
+        ).start()
+
+    def stop(self):
+        """
+        Stops the server
+
+        :returns: Nothing
+        :rtype: None
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_calls(self):
+        """
+        Resets the call counter and returns what it was
+
+        :returns: Requests served since the last reset
+        :rtype: int
+        """
+        with self._lock:
+            calls, self.calls = self.calls, 0
+        return calls
+
+    def gif(self, gifid):
+        """
+        Recorded gif with its id (and urls) swapped for `gifid`
+
+        :param gifid: Id the gif should have
+        :type gifid: str
+        :returns: GIPHY data for a single gif
+        :rtype: dict
+        """
+        recorded = self.recorded["search"]["data"]
+        template = recorded[sum(map(ord, gifid)) % len(recorded)]
+        return json.loads(json.dumps(template).replace(template["id"], gifid))
+
+    def search(self, query, limit, offset):
+        """
+        Search response for a page of results
+
+        :returns: GIPHY search response
+        :rtype: dict
+        """
+        response = copy.deepcopy(self.recorded["search"])
+        total = response["pagination"]["total_count"]
+        response["data"] = [
+            self.gif("{}{}".format(query, index))
+            for index in range(offset, min(offset + limit, total))
+        ]
+        response["pagination"] = {
+            "total_count": total,
+            "count": len(response["data"]),
+            "offset": offset,
+        }
+        return response
+
+    def handle(self, request):
+        """
+        Answers a single request
+
+        :param request: Request being handled
+        :type request: http.server.BaseHTTPRequestHandler
+        :returns: Nothing
+        :rtype: None
+        """
+        with self._lock:
+            self.calls += 1
+            failed = self._random.random() < self.error_rate
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        parsed = urlparse(request.path)
+        params = {
+            key: values[0] for key, values in parse_qs(parsed.query).items()
+        }
+        meta = self.recorded["get"]["meta"]
+
+        if failed:
+            status = 500
+            body = {"meta": {"status": 500, "msg": "Injected error"}}
+        elif parsed.path == "/v1/gifs/search":
+            status = 200
+            body = self.search(
+                params.get("q", ""),
+                int(params.get("limit", 25)),
+                int(params.get("offset", 0)),
+            )
+        elif parsed.path == "/v1/gifs":
+            status = 200
+            gifids = [
+                gifid for gifid in params.get("ids", "").split(",") if gifid
+            ]
+            body = {
+                "data": [self.gif(gifid) for gifid in gifids],
+                "meta": meta,
+            }
+        elif parsed.path.startswith("/v1/gifs/"):
+            status = 200
+            body = {
+                "data": self.gif(parsed.path.rsplit("/", 1)[1]),
+                "meta": meta,
+            }
+        else:
+            status = 404
+            body = {"meta": {"status": 404, "msg": "Not Found"}}
+
+        payload = json.dumps(body).encode("utf-8")
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(payload)))
+        request.end_headers()
+        request.wfile.write(payload)
@@ -0,0 +1,279 @@
+"""
+End-to-end load test of the application against a local GIPHY stand-in
+
+Starts :class:`bench.fake_giphy.FakeGiphy`, points the GIPHY client at it,
+seeds users and bookmarks, serves :func:`run.create_app` on a local port and
+drives each endpoint at a fixed concurrency. Run it from the repository root,
+preferably against a scratch database::
+
+    python -m bench.load_test --database-uri postgresql://.../giphy_load
+"""
+# Standard imports
+import argparse
+import collections
+import concurrent.futures
+import random
+import re
+import threading
+import time
+import uuid
+
+# Third party imports
+import requests
+import werkzeug.serving
+
+# Application imports
+import config
+from bench.fake_giphy import FakeGiphy
+
+
+SERVER_TIMING = re.compile(r'desc="(\d+) statements"')
+
+
+def parse_args():
+    """
+    Command line arguments of the load test
+
+    :returns: Parsed arguments
+    :rtype: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--database-uri", help="Overrides config.yaml's")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--bookmarks", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--requests", type=int, default=200, help="Requests per endpoint"
+    )
+    parser.add_argument(
+        "--latency-ms", type=float, default=50, help="Fake GIPHY latency"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="Fake GIPHY errors"
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--endpoints",
+        nargs="+",
+        default=["do_search", "view", "save", "favorite"],
+    )
+    return parser.parse_args()
+
+
+def seed(prefix, users, bookmarks):
+    """
+    Creates users with bookmarks to drive the load with
+
+    :param prefix: Prefix of every username and gif id, unique per run
+    :type prefix: str
+    :param users: Number of users to create
+    :type users: int
+    :param bookmarks: Number of bookmarks per user
+    :type bookmarks: int
+    :returns: Auth token of every user
+    :rtype: list
+    """
+    # Loaded after config has been pointed at the test database
+    import models.database
+    import models.bookmarks
+    import models.users
+
+    session = models.database.session
+    tokens = []
+    for index in range(users):
+        token = uuid.uuid4().hex
+        user = models.users.User(
+            username="{}-user-{}".format(prefix, index),
+            password=prefix,
+            token=token,
+        )
+        session.add(user)
+        session.flush()
+        session.bulk_insert_mappings(
+            models.bookmarks.Bookmark,
+            [
+                {
+                    "user_id": user.id,
+                    "giphy_id": "{}-gif-{}".format(prefix, gif),
+                    "favorite": gif % 3 == 0,
+                }
+                for gif in range(bookmarks)
+            ],
+        )
+        tokens.append(token)
+
+    session.commit()
+    session.remove()
+    return tokens
+
+
+def scenarios(prefix):
+    """
+    Paths requested by each endpoint's scenario
+
+    :param prefix: Prefix of the run's gif ids
+    :type prefix: str
+    :returns: Endpoint name to a function building the next path
+    :rtype: dict
+    """
+    queries = ["cats", "dogs", "happy", "thumbs up", "mic drop"]
+    return {
+        "do_search": lambda rng: "/do_search/{}?limit=25&offset={}".format(
+            rng.choice(queries), 25 * rng.randint(0, 3)
+        ),
+        "view": lambda rng: "/view",
+        "library": lambda rng: "/get_library",
+        "save": lambda rng: "/save_gif_by_id/{}-new-{}".format(
+            prefix, rng.randint(0, 999)
+        ),
+        "favorite": lambda rng: "/favorite_gif_by_id/{}-gif-{}".format(
+            prefix, rng.randint(0, 99)
+        ),
+    }
+
+
+def percentile(values, percent):
+    """
+    Nearest-rank percentile
+
+    :param values: Sorted values
+    :type values: list
+    :param percent: Percentile between 0 and 100
+    :type percent: float
+    :returns: The percentile, or 0 if there are no values
+    :rtype: float
+    """
+    if not values:
+        return 0.0
+    rank = max(int(round(percent / 100.0 * len(values))) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def drive(base_url, tokens, build_path, total, concurrency, seed_value):
+    """
+    Sends `total` requests at a fixed concurrency
+
+    :returns: Wall time, latencies, statuses and SQL statement counts
+    :rtype: tuple(float, list, collections.Counter, list)
+    """
+    local = threading.local()
+    rng_lock = threading.Lock()
+    rng = random.Random(seed_value)
+
+    def one(index):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        with rng_lock:
+            path = build_path(rng)
+            token = rng.choice(tokens)
+
+        start_time = time.perf_counter()
+        response = local.session.get(
+            base_url + path,
+            cookies={"X-Auth-Token": token},
+            allow_redirects=False,
+        )
+        latency = time.perf_counter() - start_time
+
+        statements = SERVER_TIMING.search(
+            response.headers.get("Server-Timing", "")
+        )
+        return (
+            latency,
+            response.status_code,
+            int(statements.group(1)) if statements else 0,
+        )
+
+    start_time = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(one, range(total)))
+    elapsed = time.perf_counter() - start_time
+
+    return (
+        elapsed,
+        sorted(result[0] for result in results),
+        collections.Counter(result[1] for result in results),
+        [result[2] for result in results],
+    )
+
+
+def main():
+    """
+    Runs the load test and prints a report
+
+    :returns: Nothing
+    :rtype: None
+    """
+    args = parse_args()
+
+    fake_giphy = FakeGiphy(
+        latency=args.latency_ms / 1000.0,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    fake_giphy.start()
+
+    # Must happen before the application (and its engine) is loaded
+    config.giphy["search_endpoint"] = fake_giphy.url + "/v1/gifs/search"
+    config.giphy["get_endpoint"] = fake_giphy.url + "/v1/gifs"
+    config.app.setdefault("sql_instrumentation", {})["server_timing"] = True
+    # Measure the application, not the GIPHY quota of the API keys
+    config.giphy.setdefault("scheduler", {})["enabled"] = False
+    if args.database_uri:
+        config.postgresql["sqlalchemy_uri"] = args.database_uri
+
+    import run
+
+    app = run.create_app()
+    prefix = "load-{}".format(uuid.uuid4().hex[:8])
+    tokens = seed(prefix, args.users, args.bookmarks)
+
+    server = werkzeug.serving.make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = "http://127.0.0.1:{}".format(server.server_port)
+
+    print(
+        "{:<10} {:>8} {:>9} {:>9} {:>9} {:>9} {:>9} {:>8}  {}".format(
+            "endpoint",
+            "requests",
+            "req/s",
+            "p50 ms",
+            "p95 ms",
+            "p99 ms",
+            "sql/req",
+            "giphy",
+            "statuses",
+        )
+    )
+    all_scenarios = scenarios(prefix)
+    for name in args.endpoints:
+        fake_giphy.reset_calls()
+        elapsed, latencies, statuses, statements = drive(
+            base_url,
+            tokens,
+            all_scenarios[name],
+            args.requests,
+            args.concurrency,
+            args.seed,
+        )
+        print(
+            "{:<10} {:>8} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f} "
+            "{:>8}  {}".format(
+                name,
+                len(latencies),
+                len(latencies) / elapsed,
+                percentile(latencies, 50) * 1000,
+                percentile(latencies, 95) * 1000,
+                percentile(latencies, 99) * 1000,
+                sum(statements) / float(len(statements)),
+                fake_giphy.reset_calls(),
+                dict(statuses),
+            )
+        )
+
+    server.shutdown()
+    fake_giphy.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,316 @@
+# Standard imports
+import collections
+import concurrent.futures
+import logging
+import threading
+import time
+
 # Third party imports
 import requests
+import requests.adapters
+from requests.packages.urllib3.util.retry import Retry
 
 # Application imports
+import clients.scheduler
 import config
+import lib.cache
+import lib.metrics
+import lib.singleflight
+
+
+LOGGER = logging.getLogger(__name__)
+RATING = "g"  # Forced G rating
+
+
+def build_session():
+    """
+    Builds the HTTP session shared by every :class:`Client`, so connections
+    to GIPHY are kept alive and reused across requests and threads
+
+    :returns: Session with pooled connections and retries configured from
+        `giphy.transport`
+    :rtype: requests.Session
+    """
+    transport = config.giphy.get("transport", {})
+    retries = Retry(
+        total=transport.get("retries", 3),
+        backoff_factor=transport.get("backoff_factor", 0.3),
+        status_forcelist=(500, 502, 503, 504),
+        # Return the last response instead of raising once retries run out
+        raise_on_status=False,
+    )
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=transport.get("pool_connections", 4),
+        pool_maxsize=transport.get("pool_size", 20),
+        max_retries=retries,
+    )
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Shared by every Client so connections are reused across requests
+SESSION = build_session()
+_transport_config = config.giphy.get("transport", {})
+TIMEOUT = (
+    _transport_config.get("connect_timeout", 3.05),
+    _transport_config.get("read_timeout", 10),
+)
+
+_search_cache_config = config.giphy.get("search_cache", {})
+SEARCH_CACHE = lib.cache.TTLCache(
+    max_size=(
+        _search_cache_config.get("max_size", 1024)
+        if _search_cache_config.get("enabled", True)
+        else 0
+    ),
+    ttl=_search_cache_config.get("ttl", 300),
+)
+
+# Every request takes a token from one of the API keys, see
+# clients.scheduler.Scheduler
+_scheduler_config = config.giphy.get("scheduler", {})
+SCHEDULER = (
+    clients.scheduler.Scheduler(
+        keys=config.giphy["api_keys"],
+        rate=_scheduler_config.get("requests_per_hour", 10000) / 3600.0,
+        burst=_scheduler_config.get("burst", 100),
+        selection=_scheduler_config.get("selection", "least_used"),
+        reserve=_scheduler_config.get("background_reserve", 0.25),
+        max_wait=_scheduler_config.get("max_wait"),
+    )
+    if _scheduler_config.get("enabled", True)
+    else None
+)
+
+
+def acquire_key(priority=clients.scheduler.INTERACTIVE):
+    """
+    API key to send the next request to GIPHY with
+
+    :param priority: INTERACTIVE or BACKGROUND
+    :type priority: str
+        :default: INTERACTIVE
+    :returns: The API key
+    :rtype: str
+    :raises clients.scheduler.QuotaExhausted: If no key had budget in time
+    """
+    if SCHEDULER is None:
+        return config.giphy["api_key"]
+
+    start_time = time.perf_counter()
+    try:
+        return SCHEDULER.acquire(priority)
+    except clients.scheduler.QuotaExhausted:
+        lib.metrics.GIPHY_QUOTA_REJECTIONS.inc(priority=priority)
+        raise
+    finally:
+        lib.metrics.GIPHY_SCHEDULER_WAIT.observe(
+            time.perf_counter() - start_time, priority=priority
+        )
+
+
+def throttled(key, retry_after):
+    """
+    Records a 429 from GIPHY so the key isn't used until it says to retry
+
+    :param key: The API key that got the 429
+    :type key: str
+    :param retry_after: Value of the Retry-After header
+    :type retry_after: str
+    :returns: Nothing
+    :rtype: None
+    """
+    seconds = clients.scheduler.parse_retry_after(
+        retry_after, _scheduler_config.get("default_retry_after", 60)
+    )
+    LOGGER.warning(
+        "GIPHY rate limited key ...%s for %.0f seconds", key[-4:], seconds
+    )
+    lib.metrics.GIPHY_THROTTLED.inc(key="..." + key[-4:])
+    if SCHEDULER is not None:
+        SCHEDULER.throttled(key, seconds)
+
+
+def _collect_budget():
+    """
+    Sets the remaining budget of each API key before /metrics renders
+
+    :returns: Nothing
+    :rtype: None
+    """
+    for label, tokens in SCHEDULER.budget().items():
+        lib.metrics.GIPHY_BUDGET.set(tokens, key=label)
+
+
+if SCHEDULER is not None:
+    lib.metrics.REGISTRY.add_collector(_collect_budget)
+
+# Identical searches and lookups running at the same time share one request
+_single_flight_config = config.giphy.get("single_flight", {})
+IN_FLIGHT = lib.singleflight.SingleFlight()
+
+
+def single_flight(name, key, function, priority):
+    """
+    Runs a GIPHY call, or waits on an identical one already in flight when
+    `giphy.single_flight` is enabled. Waiters give up after
+    `giphy.single_flight.wait_timeout` seconds
+
+    :param name: Name of the endpoint, used in metrics and the key
+    :type name: str
+    :param key: What identifies identical calls to the endpoint
+    :type key: tuple
+    :param function: Function taking no arguments making the call
+    :type function: function
+    :param priority: Priority the call waits on the scheduler with. Only
+        calls of the same priority are shared, a background call can wait
+        on the scheduler far longer than an interactive one should
+    :type priority: str
+    :returns: Result of the call
+    :rtype: object
+    :raises concurrent.futures.TimeoutError: If the call in flight took too
+        long
+    """
+    if not _single_flight_config.get("enabled", True):
+        return function()
+
+    ran = []
+
+    def call():
+        ran.append(True)
+        return function()
+
+    try:
+        return IN_FLIGHT.do(
+            (name, priority) + key,
+            call,
+            timeout=_single_flight_config.get("wait_timeout", 15),
+        )
+    finally:
+        if not ran:
+            lib.metrics.GIPHY_COALESCED.inc(endpoint=name)
+
+
+# Background searches warming SEARCH_CACHE with the page after the one just
+# served, see prefetch_search
+_prefetch_config = config.giphy.get("prefetch", {})
+_prefetch_executor = None
+_prefetch_in_flight = collections.Counter()
+_prefetch_started = collections.deque()
+_prefetch_lock = threading.Lock()
+
+
+def prefetch_search(query, limit=25, offset=0, lang="en", owner=None):
+    """
+    Runs a search in the background so it's already cached when asked for.
+    Skipped when it's cached already, when `owner` has
+    `giphy.prefetch.max_per_user` prefetches in flight, or when
+    `giphy.prefetch.max_per_minute` prefetches were started in the last
+    minute, so prefetching never eats much of the GIPHY quota
+
+    :param query: What to search for
+    :type query: str
+    :param limit: Amount of items to return per page
+    :type limit: int
+        :default: 25
+    :param offset: Where to start in the total results
+    :type offset: int
+        :default: 0
+    :param lang: What language to send back
+    :type lang: str
+        :default: en
+    :param owner: Who the prefetch is for, e.g. a user id
+    :type owner: hashable
+    :returns: True if the search was started
+    :rtype: bool
+    """
+    global _prefetch_executor
+
+    if (
+        not _prefetch_config.get("enabled", False)
+        or SEARCH_CACHE.max_size <= 0
+    ):
+        return False
+
+    if (query, limit, offset, lang, RATING) in SEARCH_CACHE:
+        lib.metrics.GIPHY_PREFETCHES.inc(outcome="cached")
+        return False
+
+    with _prefetch_lock:
+        if _prefetch_in_flight[owner] >= _prefetch_config.get(
+            "max_per_user", 1
+        ):
+            lib.metrics.GIPHY_PREFETCHES.inc(outcome="user_limit")
+            return False
+
+        now = time.monotonic()
+        while _prefetch_started and _prefetch_started[0] < now - 60:
+            _prefetch_started.popleft()
+        if len(_prefetch_started) >= _prefetch_config.get(
+            "max_per_minute", 60
+        ):
+            lib.metrics.GIPHY_PREFETCHES.inc(outcome="quota_limit")
+            return False
+
+        _prefetch_started.append(now)
+        _prefetch_in_flight[owner] += 1
+        if _prefetch_executor is None:
+            _prefetch_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=_prefetch_config.get("workers", 4),
+                thread_name_prefix="giphy-prefetch",
+            )
+
+    lib.metrics.GIPHY_PREFETCHES.inc(outcome="started")
+    _prefetch_executor.submit(_prefetch, query, limit, offset, lang, owner)
+    return True
+
+
+def _prefetch(query, limit, offset, lang, owner):
+    """
+    Body of a prefetch started by :func:`prefetch_search`. Never raises, a
+    failed prefetch only means the next page isn't cached
+
+    :returns: Nothing
+    :rtype: None
+    """
+    try:
+        Client(priority=clients.scheduler.BACKGROUND).search(
+            query=query, limit=limit, offset=offset, lang=lang
+        )
+    except Exception as error:
+        LOGGER.warning("Prefetching %r failed: %r", query, error)
+    finally:
+        with _prefetch_lock:
+            _prefetch_in_flight[owner] -= 1
+            if not _prefetch_in_flight[owner]:
+                del _prefetch_in_flight[owner]
 
 
 class Client(object):
+    def __init__(self, priority=clients.scheduler.INTERACTIVE):
+        """
+        Initializer
+
+        :param priority: Priority of the client's requests against the GIPHY
+            quota, INTERACTIVE or BACKGROUND
+        :type priority: str
+            :default: INTERACTIVE
+        :returns: Nothing
+        :rtype: None
+        """
+        self.priority = priority
+
     def make_request(
-        self, url, method="GET", payload=None, params=None, headers=None
+        self,
+        url,
+        method="GET",
+        payload=None,
+        params=None,
+        headers=None,
+        name=None,
     ):
         """
         Centralized handler of all requests to GIPHY
@@ -23,8 +326,13 @@ class Client(object):
         :type params: dict
         :param headers: Additional headers being sent
         :type headers: dict
+        :param name: Name of the endpoint used in metrics
+        :type name: str
+            :default: `url`
         :returns: Results from GIPHY
         :rtype: dict
+        :raises clients.scheduler.QuotaExhausted: If no API key had budget
+            for the request in time
         """
         if not params:
             params = {}
@@ -32,16 +340,35 @@ class Client(object):
         if not headers:
             headers = {}
 
-        headers["api_key"] = config.giphy["api_key"]
-        params["rating"] = "g"  # Forced G rating
+        params["rating"] = RATING
+        name = name or url
+
+        # A rate limited key is retried with another one, once per key
+        attempts = len(SCHEDULER) if SCHEDULER is not None else 1
+        for _ in range(attempts):
+            headers["api_key"] = acquire_key(self.priority)
+            status = "error"
+            start_time = time.perf_counter()
+            try:
+                response = SESSION.request(
+                    url=url,
+                    method=method,
+                    data=payload,
+                    params=params,
+                    headers=headers,
+                    timeout=TIMEOUT,
+                )
+                status = response.status_code
+            finally:
+                lib.metrics.GIPHY_LATENCY.observe(
+                    time.perf_counter() - start_time, endpoint=name
+                )
+                lib.metrics.GIPHY_REQUESTS.inc(endpoint=name, status=status)
+
+            if status != 429:
+                break
+            throttled(headers["api_key"], response.headers.get("Retry-After"))
 
-        response = requests.request(
-            url=url,
-            method=method,
-            data=payload,
-            params=params,
-            headers=headers,
-        )
         return response.json()
 
     def search(self, query, limit=25, offset=0, lang="en"):
@@ -62,15 +389,33 @@ class Client(object):
         :returns: Results from GIPHY
         :rtype: dict
         """
-        return self.make_request(
-            url=config.giphy["search_endpoint"],
-            params={
-                "q": query,
-                "limit": limit,
-                "offset": offset,
-                "lang": lang,
-            },
-        )
+        key = (query, limit, offset, lang, RATING)
+        results = SEARCH_CACHE.get(key)
+        if results is not None:
+            return results
+
+        def call():
+            # Cached by another call since, e.g. one that just finished
+            if key in SEARCH_CACHE:
+                return SEARCH_CACHE.get(key)
+
+            results = self.make_request(
+                url=config.giphy["search_endpoint"],
+                name="search",
+                params={
+                    "q": query,
+                    "limit": limit,
+                    "offset": offset,
+                    "lang": lang,
+                },
+            )
+            # Don't hold on to GIPHY's errors
+            if results.get("meta", {}).get("status", 200) == 200:
+                SEARCH_CACHE.set(key, results)
+
+            return results
+
+        return single_flight("search", key, call, self.priority)
 
     def get(self, gifid):
         """
@@ -82,6 +427,74 @@ class Client(object):
         :returns: Results from GIPHY
         :rtype: dict
         """
-        return self.make_request(
-            url="{}/{}".format(config.giphy["get_endpoint"], gifid)
+        return single_flight(
+            "get",
+            (gifid, RATING),
+            lambda: self.make_request(
+                url="{}/{}".format(config.giphy["get_endpoint"], gifid),
+                name="get",
+            ),
+            self.priority,
+        )
+
+    def get_many(self, gifids):
+        """
+        Gets many gifs from GIPHY using the multi-id endpoint. Ids are sent in
+        batches of `giphy.batch_size`, and the batches are requested
+        concurrently, bounded by `giphy.max_concurrency`
+
+        :param gifids: GIPHY ids to look up
+        :type gifids: list
+        :returns: Mapping of id to GIPHY data, and the ids GIPHY didn't return
+        :rtype: tuple(dict, list)
+        """
+        # Drop duplicates but keep the requested order
+        gifids = list(collections.OrderedDict.fromkeys(gifids))
+        if not gifids:
+            return {}, []
+
+        batch_size = config.giphy.get("batch_size", 100)
+        batches = [
+            gifids[index : index + batch_size]
+            for index in range(0, len(gifids), batch_size)
+        ]
+
+        found = {}
+        max_workers = min(
+            config.giphy.get("max_concurrency", 10), len(batches)
         )
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers
+        ) as executor:
+            for items in executor.map(self._get_batch, batches):
+                for item in items:
+                    found[item.get("id")] = item
+
+        missing = [gifid for gifid in gifids if gifid not in found]
+        return found, missing
+
+    def _get_batch(self, gifids):
+        """
+        Gets a single batch of gifs from GIPHY. Never raises, so one failed
+        batch doesn't lose the rest of a :meth:`get_many` call
+
+        :param gifids: GIPHY ids to look up, at most `giphy.batch_size`
+        :type gifids: list
+        :returns: GIPHY data for each gif found
+        :rtype: list
+        """
+        try:
+            results = single_flight(
+                "get_many",
+                (tuple(gifids), RATING),
+                lambda: self.make_request(
+                    url=config.giphy["get_endpoint"],
+                    name="get_many",
+                    params={"ids": ",".join(gifids)},
+                ),
+                self.priority,
+            )
+            return results.get("data", [])
+        except Exception as error:
+            LOGGER.exception(error)
+            return []
@@ -0,0 +1,319 @@
+# Standard imports
+import asyncio
+import collections
+import concurrent.futures
+import logging
+import threading
+import time
+
+# Third party imports
+import aiohttp
+
+# Application imports
+import clients.giphy
+import clients.scheduler
+import config
+import lib.metrics
+
+
+LOGGER = logging.getLogger(__name__)
+
+# Every AsyncClient shares one event loop running on a background thread, so
+# the connection pool and concurrency limit are shared by the whole process
+_loop = None
+_session = None
+_semaphore = None
+_key_executor = None
+_lock = threading.Lock()
+
+
+def _get_loop():
+    """
+    Starts the shared event loop on its first use
+
+    :returns: The running shared event loop
+    :rtype: asyncio.AbstractEventLoop
+    """
+    global _loop
+
+    with _lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=loop.run_forever, name="giphy-async", daemon=True
+            ).start()
+            _loop = loop
+
+    return _loop
+
+
+async def _get_session():
+    """
+    Creates the shared HTTP session, semaphore and key executor on their
+    first use. Must run on the shared event loop
+
+    :returns: Shared session, the semaphore bounding requests in flight and
+        the executor waiting on the API key scheduler
+    :rtype: tuple(aiohttp.ClientSession, asyncio.Semaphore,
+        concurrent.futures.ThreadPoolExecutor)
+    """
+    global _session, _semaphore, _key_executor
+
+    if _session is None:
+        settings = config.giphy.get("async_client", {})
+        transport = config.giphy.get("transport", {})
+        _semaphore = asyncio.Semaphore(settings.get("max_concurrency", 100))
+        # Waiting on the scheduler blocks a thread for up to its max_wait.
+        # These get their own threads, as many as requests allowed in flight,
+        # so they never hold up the loop's default executor
+        _key_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=settings.get("max_concurrency", 100),
+            thread_name_prefix="giphy-async-key",
+        )
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=settings.get("pool_size", 100)
+            ),
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=transport.get("connect_timeout", 3.05),
+                sock_read=transport.get("read_timeout", 10),
+            ),
+        )
+
+    return _session, _semaphore, _key_executor
+
+
+def run(coroutine, timeout=None):
+    """
+    Runs a coroutine on the shared event loop and waits for its result, this
+    is how synchronous code (e.g. Flask handlers) uses :class:`AsyncClient`
+
+    :param coroutine: Coroutine to run
+    :type coroutine: coroutine
+    :param timeout: Seconds to wait before the coroutine is cancelled
+    :type timeout: float
+    :returns: Result of the coroutine
+    :rtype: object
+    :raises concurrent.futures.TimeoutError: If it took over `timeout`
+    """
+    future = asyncio.run_coroutine_threadsafe(coroutine, _get_loop())
+    try:
+        return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        # Cancels the coroutine and whatever requests it has in flight
+        future.cancel()
+        raise
+
+
+def run_all(coroutines, timeout=None):
+    """
+    Runs many coroutines concurrently on the shared event loop
+
+    :param coroutines: Coroutines to run
+    :type coroutines: list
+    :param timeout: Seconds to wait before every coroutine is cancelled
+    :type timeout: float
+    :returns: Results in the same order as `coroutines`, a coroutine that
+        raised has its exception in its place
+    :rtype: list
+    """
+
+    async def gather():
+        return await asyncio.gather(*coroutines, return_exceptions=True)
+
+    return run(gather(), timeout)
+
+
+class AsyncClient(object):
+    """
+    asyncio sibling of :class:`clients.giphy.Client`, with the same methods
+    as coroutines. Shares the search cache and API key scheduler of the
+    synchronous client
+    """
+
+    def __init__(self, priority=clients.scheduler.INTERACTIVE):
+        """
+        Initializer
+
+        :param priority: Priority of the client's requests against the GIPHY
+            quota, INTERACTIVE or BACKGROUND
+        :type priority: str
+            :default: INTERACTIVE
+        :returns: Nothing
+        :rtype: None
+        """
+        self.priority = priority
+
+    async def make_request(
+        self,
+        url,
+        method="GET",
+        payload=None,
+        params=None,
+        headers=None,
+        name=None,
+    ):
+        """
+        Centralized handler of all async requests to GIPHY
+
+        :param url: URL being requested
+        :type url: str
+        :param method: GET/POST/PUT/DELETE
+        :type method: str
+            :default: GET
+        :param payload: Data or json being sent
+        :type payload: str
+        :param params: Dict of parameters being sent
+        :type params: dict
+        :param headers: Additional headers being sent
+        :type headers: dict
+        :param name: Name of the endpoint used in metrics
+        :type name: str
+            :default: `url`
+        :returns: Results from GIPHY
+        :rtype: dict
+        :raises clients.scheduler.QuotaExhausted: If no API key had budget
+            for the request in time
+        """
+        if not params:
+            params = {}
+
+        if not headers:
+            headers = {}
+
+        params["rating"] = clients.giphy.RATING
+        # aiohttp only accepts strings as parameters
+        params = {key: str(value) for key, value in params.items()}
+
+        session, semaphore, key_executor = await _get_session()
+        loop = asyncio.get_running_loop()
+        name = name or url
+
+        # A rate limited key is retried with another one, once per key
+        scheduler = clients.giphy.SCHEDULER
+        attempts = len(scheduler) if scheduler is not None else 1
+        for _ in range(attempts):
+            # Waiting on the scheduler blocks, keep it off the event loop
+            headers["api_key"] = await loop.run_in_executor(
+                key_executor, clients.giphy.acquire_key, self.priority
+            )
+            status = "error"
+            async with semaphore:
+                start_time = time.perf_counter()
+                try:
+                    async with session.request(
+                        method,
+                        url,
+                        data=payload,
+                        params=params,
+                        headers=headers,
+                    ) as response:
+                        status = response.status
+                        results = await response.json(content_type=None)
+                        retry_after = response.headers.get("Retry-After")
+                finally:
+                    lib.metrics.GIPHY_LATENCY.observe(
+                        time.perf_counter() - start_time, endpoint=name
+                    )
+                    lib.metrics.GIPHY_REQUESTS.inc(
+                        endpoint=name, status=status
+                    )
+
+            if status != 429:
+                break
+            clients.giphy.throttled(headers["api_key"], retry_after)
+
+        return results
+
+    async def search(self, query, limit=25, offset=0, lang="en"):
+        """
+        Search GIPHY's APIs
+
+        :param query: What to search for
+        :type query: str
+        :param limit: Amount of items to return per page
+        :type limit: int
+            :default: 25
+        :param offset: Where to start in the total results
+        :type offset: int
+            :default: 0
+        :param lang: What language to send back
+        :type lang: str
+            :default: en
+        :returns: Results from GIPHY
+        :rtype: dict
+        """
+        key = (query, limit, offset, lang, clients.giphy.RATING)
+        results = clients.giphy.SEARCH_CACHE.get(key)
+        if results is not None:
+            return results
+
+        results = await self.make_request(
+            url=config.giphy["search_endpoint"],
+            name="search",
+            params={
+                "q": query,
+                "limit": limit,
+                "offset": offset,
+                "lang": lang,
+            },
+        )
+        # Don't hold on to GIPHY's errors
+        if results.get("meta", {}).get("status", 200) == 200:
+            clients.giphy.SEARCH_CACHE.set(key, results)
+
+        return results
+
+    async def get(self, gifid):
+        """
+        Get a single gif from GIPHY
+
+        :param gifid: GIPHY id of the gif
+        :type gifid: str
+        :returns: Results from GIPHY
+        :rtype: dict
+        """
+        return await self.make_request(
+            url="{}/{}".format(config.giphy["get_endpoint"], gifid), name="get"
+        )
+
+    async def get_many(self, gifids):
+        """
+        Gets many gifs from GIPHY using the multi-id endpoint, see
+        :meth:`clients.giphy.Client.get_many`
+
+        :param gifids: GIPHY ids to look up
+        :type gifids: list
+        :returns: Mapping of id to GIPHY data, and the ids GIPHY didn't return
+        :rtype: tuple(dict, list)
+        """
+        # Drop duplicates but keep the requested order
+        gifids = list(collections.OrderedDict.fromkeys(gifids))
+        batch_size = config.giphy.get("batch_size", 100)
+        batches = [
+            gifids[index : index + batch_size]
+            for index in range(0, len(gifids), batch_size)
+        ]
+
+        results = await asyncio.gather(
+            *[
+                self.make_request(
+                    url=config.giphy["get_endpoint"],
+                    name="get_many",
+                    params={"ids": ",".join(batch)},
+                )
+                for batch in batches
+            ],
+            return_exceptions=True
+        )
+
+        found = {}
+        for result in results:
+            if isinstance(result, BaseException):
+                LOGGER.error("GIPHY batch failed: %r", result)
+                continue
+            for item in result.get("data", []):
+                found[item.get("id")] = item
+
+        missing = [gifid for gifid in gifids if gifid not in found]
+        return found, missing
@@ -0,0 +1,329 @@
+# Standard imports
+import collections
+import email.utils
+import threading
+import time
+
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+
+class QuotaExhausted(Exception):
+    """
+    Raised when no API key has budget left before the caller's deadline
+    """
+
+
+class ApiKey(object):
+    """
+    Token bucket of a single API key
+    """
+
+    def __init__(self, key, tokens):
+        """
+        Initializer
+
+        :param key: The API key
+        :type key: str
+        :param tokens: Tokens the bucket starts with
+        :type tokens: float
+        :returns: Nothing
+        :rtype: None
+        """
+        self.key = key
+        self.tokens = float(tokens)
+        self.used = 0
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+
+    def __repr__(self):
+        """
+        Custom String representation, never shows the whole key
+
+        :returns: String representation of the data
+        :rtype: str
+        """
+        return "<ApiKey(key='{}', tokens='{:.1f}')>".format(
+            self.label, self.tokens
+        )
+
+    @property
+    def label(self):
+        """
+        Identifies the key in logs and metrics without leaking it
+
+        :returns: The last 4 characters of the key
+        :rtype: str
+        """
+        return "..." + self.key[-4:]
+
+
+class Scheduler(object):
+    """
+    Hands out API keys so requests stay within each key's rate limit. Every
+    key has a token bucket refilled at `rate`. Interactive requests can use a
+    bucket down to empty, background requests leave `reserve` of it alone
+    and always give way to interactive requests waiting on a key
+    """
+
+    def __init__(
+        self,
+        keys,
+        rate,
+        burst,
+        selection="least_used",
+        reserve=0.2,
+        max_wait=None,
+    ):
+        """
+        Initializer
+
+        :param keys: API keys to spread requests over
+        :type keys: list
+        :param rate: Tokens added to each bucket per second, over 0
+        :type rate: float
+        :param burst: Size of each bucket, at least 1
+        :type burst: int
+        :param selection: "least_used" picks the key used the least,
+            "round_robin" takes turns
+        :type selection: str
+            :default: least_used
+        :param reserve: Fraction of each bucket background requests can't use
+        :type reserve: float
+            :default: 0.2
+        :param max_wait: Seconds each priority waits for a key by default
+        :type max_wait: dict
+        :returns: Nothing
+        :rtype: None
+        :raises ValueError: If there are no keys, `rate` or `burst` can't
+            refill a bucket, or `reserve` leaves background requests no token
+        """
+        if not keys:
+            raise ValueError("At least one API key is needed")
+        if rate <= 0 or burst < 1:
+            raise ValueError(
+                "rate must be over 0 and burst at least 1, got {} and "
+                "{}".format(rate, burst)
+            )
+        # Background requests need a whole token above the reserve
+        if reserve < 0 or reserve * burst > burst - 1:
+            raise ValueError(
+                "reserve must leave background requests a token out of a "
+                "burst of {}, got {}".format(burst, reserve)
+            )
+
+        self.rate = float(rate)
+        self.burst = burst
+        self.selection = selection
+        self.reserve = reserve
+        self.max_wait = max_wait or {INTERACTIVE: 2, BACKGROUND: 30}
+        self._keys = [ApiKey(key, burst) for key in keys]
+        self._next = 0
+        self._waiting = collections.Counter()
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        """
+        Number of API keys
+
+        :returns: Number of keys
+        :rtype: int
+        """
+        return len(self._keys)
+
+    def _refill(self, now):
+        """
+        Adds the tokens earned since the last refill. Must hold the condition
+
+        :param now: Current monotonic time
+        :type now: float
+        :returns: Nothing
+        :rtype: None
+        """
+        for key in self._keys:
+            key.tokens = min(
+                self.burst, key.tokens + (now - key.updated_at) * self.rate
+            )
+            key.updated_at = now
+
+    def _floor(self, priority):
+        """
+        Tokens a priority has to leave in a bucket
+
+        :param priority: INTERACTIVE or BACKGROUND
+        :type priority: str
+        :returns: Tokens left alone
+        :rtype: float
+        """
+        if priority == INTERACTIVE:
+            return 0.0
+        return self.reserve * self.burst
+
+    def _pick(self, priority, now):
+        """
+        Chooses a key with budget for the priority. Must hold the condition
+
+        :param priority: INTERACTIVE or BACKGROUND
+        :type priority: str
+        :param now: Current monotonic time
+        :type now: float
+        :returns: Chosen key, or None if none can be used right now
+        :rtype: ApiKey
+        """
+        if priority != INTERACTIVE and self._waiting[INTERACTIVE]:
+            return None
+
+        floor = self._floor(priority)
+        usable = [
+            key
+            for key in self._keys
+            if key.blocked_until <= now and key.tokens - 1 >= floor
+        ]
+        if not usable:
+            return None
+
+        if self.selection == "round_robin":
+            for offset in range(len(self._keys)):
+                key = self._keys[(self._next + offset) % len(self._keys)]
+                if key in usable:
+                    self._next = (self._keys.index(key) + 1) % len(self._keys)
+                    return key
+
+        return min(usable, key=lambda key: key.used)
+
+    def _wait_time(self, priority, now):
+        """
+        Seconds until a key could have budget for the priority. Must hold the
+        condition
+
+        :param priority: INTERACTIVE or BACKGROUND
+        :type priority: str
+        :param now: Current monotonic time
+        :type now: float
+        :returns: Seconds to wait
+        :rtype: float
+        """
+        floor = self._floor(priority)
+        return max(
+            min(
+                max(
+                    key.blocked_until - now,
+                    (floor + 1 - key.tokens) / self.rate,
+                )
+                for key in self._keys
+            ),
+            0.001,
+        )
+
+    def acquire(self, priority=INTERACTIVE, timeout=None):
+        """
+        Takes a token from one of the keys, waiting for one if needed
+
+        :param priority: INTERACTIVE or BACKGROUND
+        :type priority: str
+            :default: INTERACTIVE
+        :param timeout: Seconds to wait for a key
+        :type timeout: float
+            :default: `max_wait` of the priority
+        :returns: The API key to send the request with
+        :rtype: str
+        :raises QuotaExhausted: If no key had budget within `timeout`
+        """
+        if timeout is None:
+            timeout = self.max_wait.get(priority, 0)
+        deadline = time.monotonic() + timeout
+
+        with self._condition:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    key = self._pick(priority, now)
+                    if key is not None:
+                        key.tokens -= 1
+                        key.used += 1
+                        return key.key
+
+                    if now >= deadline:
+                        raise QuotaExhausted(
+                            "No GIPHY API key has budget for a {} "
+                            "request".format(priority)
+                        )
+                    if priority != INTERACTIVE and self._waiting[INTERACTIVE]:
+                        # Notified once the interactive requests stop waiting
+                        delay = deadline - now
+                    else:
+                        delay = min(
+                            deadline - now, self._wait_time(priority, now)
+                        )
+                    self._condition.wait(delay)
+            finally:
+                self._waiting[priority] -= 1
+                # Background requests may have been giving way to this one
+                self._condition.notify_all()
+
+    def throttled(self, key, retry_after):
+        """
+        Stops using a key GIPHY rate limited until it says to retry
+
+        :param key: The API key that got a 429
+        :type key: str
+        :param retry_after: Seconds until the key can be used again
+        :type retry_after: float
+        :returns: Nothing
+        :rtype: None
+        """
+        with self._condition:
+            now = time.monotonic()
+            for api_key in self._keys:
+                if api_key.key == key:
+                    api_key.tokens = 0.0
+                    api_key.updated_at = now
+                    api_key.blocked_until = max(
+                        api_key.blocked_until, now + retry_after
+                    )
+            self._condition.notify_all()
+
+    def budget(self):
+        """
+        Tokens left in each key's bucket
+
+        :returns: Label of each key to its tokens, 0 while a key is blocked
+        :rtype: dict
+        """
+        with self._condition:
+            now = time.monotonic()
+            self._refill(now)
+            return {
+                key.label: key.tokens if key.blocked_until <= now else 0.0
+                for key in self._keys
+            }
+
+
+def parse_retry_after(value, default=60):
+    """
+    Seconds to wait from a Retry-After header, which is either a number of
+    seconds or an HTTP date
+
+    :param value: Value of the header
+    :type value: str
+    :param default: Seconds used when the header is missing or invalid
+    :type default: float
+        :default: 60
+    :returns: Seconds to wait
+    :rtype: float
+    """
+    if not value:
+        return float(default)
+
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return float(default)
+    return max(email.utils.mktime_tz(parsed) - time.time(), 0.0)
@@ -4,16 +4,27 @@ import yaml
 
 def load_config():
     """
-    Loads the config from config.yaml and inserts the giphy api_key into config
+    Loads the config from config.yaml and inserts the giphy api keys and the
+    salt into config
 
     :returns: Dict of loaded config.yaml
     :rtype: dict
+    :raises ValueError: If the api key file doesn't list any key
     """
     with open("config.yaml", "r") as _file:
         config = yaml.load(_file, Loader=yaml.FullLoader)
 
+    # One key per line, requests are spread over every key listed
     with open(config["giphy"]["api_key_location"]) as _file:
-        config["giphy"]["api_key"] = _file.read()
+        config["giphy"]["api_keys"] = [
+            line.strip() for line in _file if line.strip()
+        ]
+    if not config["giphy"]["api_keys"]:
+        raise ValueError(
+            "No GIPHY api key in {}, giphy.api_key_location must list at "
+            "least one".format(config["giphy"]["api_key_location"])
+        )
+    config["giphy"]["api_key"] = config["giphy"]["api_keys"][0]
 
     with open(config["postgresql"]["salt_location"]) as _file:
         config["postgresql"]["salt"] = _file.read()
@@ -1,23 +1,46 @@
 # Standard imports
+import collections
 import json
 import logging
+import os
 import time
 import uuid
 
 # Third party imports
 import flask
 import sqlalchemy
+import sqlalchemy.dialects.postgresql
 
 # Application imports
-import clients
+import clients.giphy
+import clients.scheduler
 import config
-import lib
-import models
+import lib.funcs
+import lib.hashing
+import lib.media_cache
+import lib.metrics
+import lib.refresher
+import models.database  # Every model needs the database loaded first
+import models.bookmark_xref_categories
+import models.bookmarks
+import models.categories
+import models.gifs
+import models.users
 
 
 LOGGER = logging.getLogger(__name__)
 base = flask.Blueprint("base", __name__, template_folder="templates")
 
+# Actions accepted by /bulk_operations, see apply_operation
+BULK_ACTIONS = (
+    "save",
+    "remove",
+    "favorite",
+    "unfavorite",
+    "add_category",
+    "remove_category",
+)
+
 
 def generate_token():
     """
@@ -29,6 +52,538 @@ def generate_token():
     return uuid.uuid5(namespace=uuid.NAMESPACE_OID, name=time.time().hex()).hex
 
 
+def store_gifs(gifids):
+    """
+    Makes sure the gifs' metadata is stored before they get bookmarked
+
+    :param gifids: GIPHY ids being bookmarked
+    :type gifids: list
+    :returns: Nothing
+    :rtype: None
+    """
+    stored = {
+        gif.giphy_id: gif
+        for gif in models.database.session.query(models.gifs.Gif).filter(
+            models.gifs.Gif.giphy_id.in_(gifids)
+        )
+    }
+    outdated = [
+        gifid
+        for gifid in gifids
+        if stored.get(gifid) is None or stored[gifid].is_stale
+    ]
+    if outdated:
+        lib.refresher.refresh_gifs(outdated)
+
+
+def apply_operation(user_id, action, gifids, category_id=None):
+    """
+    Applies one action to many of a user's gifs, each action is a constant
+    number of statements no matter how many gifs there are. The caller is
+    responsible for committing the session
+
+    :param user_id: Id of the user whose bookmarks are changed
+    :type user_id: int
+    :param action: One of BULK_ACTIONS
+    :type action: str
+    :param gifids: GIPHY ids the action applies to
+    :type gifids: list
+    :param category_id: Category being added or removed, only used by the
+        category actions
+    :type category_id: int
+    :returns: Whether the action applied to each gif, it doesn't when the gif
+        isn't bookmarked or the category isn't the user's
+    :rtype: dict
+    """
+    Bookmark = models.bookmarks.Bookmark
+    BookmarkXrefCategory = models.bookmark_xref_categories.BookmarkXrefCategory
+    Category = models.categories.Category
+    session = models.database.session
+    gifids = list(collections.OrderedDict.fromkeys(gifids))
+    if not gifids:
+        return {}
+
+    if action in ("save", "favorite"):
+        store_gifs(gifids)
+        statement = sqlalchemy.dialects.postgresql.insert(
+            Bookmark.__table__
+        ).values(
+            [
+                {
+                    "user_id": user_id,
+                    "giphy_id": gifid,
+                    "favorite": action == "favorite",
+                }
+                for gifid in gifids
+            ]
+        )
+        if action == "favorite":
+            statement = statement.on_conflict_do_update(
+                index_elements=["user_id", "giphy_id"],
+                set_={"favorite": True},
+            )
+        else:
+            # Already bookmarked, keep it as it is
+            statement = statement.on_conflict_do_nothing(
+                index_elements=["user_id", "giphy_id"]
+            )
+        session.execute(statement)
+        applied = set(gifids)
+    elif action == "unfavorite":
+        applied = {
+            row.giphy_id
+            for row in session.execute(
+                Bookmark.__table__.update()
+                .where(Bookmark.user_id == user_id)
+                .where(Bookmark.giphy_id.in_(gifids))
+                .values(favorite=False)
+                .returning(Bookmark.giphy_id)
+            )
+        }
+    elif action == "remove":
+        bookmark_ids = (
+            sqlalchemy.select([Bookmark.id])
+            .where(Bookmark.user_id == user_id)
+            .where(Bookmark.giphy_id.in_(gifids))
+        )
+        session.execute(
+            BookmarkXrefCategory.__table__.delete().where(
+                BookmarkXrefCategory.bookmark_id.in_(bookmark_ids)
+            )
+        )
+        applied = {
+            row.giphy_id
+            for row in session.execute(
+                Bookmark.__table__.delete()
+                .where(Bookmark.user_id == user_id)
+                .where(Bookmark.giphy_id.in_(gifids))
+                .returning(Bookmark.giphy_id)
+            )
+        }
+    elif action in ("add_category", "remove_category"):
+        # Only the user's own categories can be put on their bookmarks
+        bookmarks = dict(
+            session.query(Bookmark.giphy_id, Bookmark.id)
+            .join(Category, Category.user_id == Bookmark.user_id)
+            .filter(Category.id == category_id)
+            .filter(Bookmark.user_id == user_id)
+            .filter(Bookmark.giphy_id.in_(gifids))
+            .all()
+        )
+        if bookmarks and action == "add_category":
+            session.execute(
+                sqlalchemy.dialects.postgresql.insert(
+                    BookmarkXrefCategory.__table__
+                )
+                .values(
+                    [
+                        {
+                            "bookmark_id": bookmark_id,
+                            "category_id": category_id,
+                        }
+                        for bookmark_id in bookmarks.values()
+                    ]
+                )
+                .on_conflict_do_nothing()
+            )
+        elif bookmarks:
+            session.execute(
+                BookmarkXrefCategory.__table__.delete()
+                .where(BookmarkXrefCategory.category_id == category_id)
+                .where(
+                    BookmarkXrefCategory.bookmark_id.in_(bookmarks.values())
+                )
+            )
+        applied = set(bookmarks)
+    else:
+        raise ValueError("Unknown action: {}".format(action))
+
+    if applied:
+        lib.funcs.bump_user_version(user_id)
+
+    return {gifid: gifid in applied for gifid in gifids}
+
+
+def parse_operations(body):
+    """
+    Checks the operations sent to /bulk_operations, so nothing is applied
+    unless all of them are valid
+
+    :param body: Decoded json of the request
+    :type body: dict
+    :returns: Operations with their action, gifids and category_id (None for
+        actions without one)
+    :rtype: list
+    :raises ValueError: If an operation is malformed or there are more than
+        `app.bulk_max_items` gifs in total
+    """
+    if not isinstance(body, dict) or not isinstance(
+        body.get("operations"), list
+    ):
+        raise ValueError("Expected a list of operations")
+
+    operations = []
+    for operation in body["operations"]:
+        if not isinstance(operation, dict):
+            raise ValueError("Expected operations to be objects")
+
+        action = operation.get("action")
+        gifids = operation.get("gifids")
+        if action not in BULK_ACTIONS:
+            raise ValueError("Unknown action: {}".format(action))
+        if not isinstance(gifids, list) or not all(
+            isinstance(gifid, str) for gifid in gifids
+        ):
+            raise ValueError("Expected a list of gifids for {}".format(action))
+
+        category_id = None
+        if action in ("add_category", "remove_category"):
+            try:
+                category_id = int(operation.get("category_id"))
+            except (TypeError, ValueError):
+                raise ValueError(
+                    "Expected a category_id for {}".format(action)
+                )
+
+        operations.append(
+            {"action": action, "gifids": gifids, "category_id": category_id}
+        )
+
+    max_items = config.app.get("bulk_max_items", 500)
+    if sum(len(operation["gifids"]) for operation in operations) > max_items:
+        raise ValueError("Over {} gifs in one batch".format(max_items))
+
+    return operations
+
+
+def change_bookmark(action, gifid, category_id=None):
+    """
+    Applies an action to one of the user's gifs and describes the result, so
+    pages can re-render the gif from the response alone
+
+    :param action: One of BULK_ACTIONS
+    :type action: str
+    :param gifid: GIPHY id the action applies to
+    :type gifid: str
+    :param category_id: Category being added or removed
+    :type category_id: int
+    :returns: The bookmark's new state and every category of the user
+    :rtype: json
+    """
+    user_id = lib.funcs.current_user_id()
+    output = {"data": {}, "categories": [], "error": ""}
+
+    try:
+        apply_operation(user_id, action, [gifid], category_id=category_id)
+
+        # Read back in the same transaction, before committing expires it
+        bookmark = (
+            models.database.session.query(models.bookmarks.Bookmark)
+            .options(
+                sqlalchemy.orm.joinedload(models.bookmarks.Bookmark.categories)
+            )
+            .filter(models.bookmarks.Bookmark.giphy_id == gifid)
+            .filter(models.bookmarks.Bookmark.user_id == user_id)
+            .first()
+        )
+        categories = (
+            models.database.session.query(models.categories.Category)
+            .filter(models.categories.Category.user_id == user_id)
+            .order_by(models.categories.Category.id)
+            .all()
+        )
+        output["data"] = {
+            "id": gifid,
+            "saved": bookmark is not None,
+            "favorited": bookmark.favorite if bookmark else False,
+            "categories": [
+                category.to_dict()
+                for category in (bookmark.categories if bookmark else [])
+            ],
+        }
+        output["categories"] = [category.to_dict() for category in categories]
+        models.database.session.commit()
+    except Exception as error:
+        LOGGER.exception(error)
+        models.database.session.rollback()
+        output["error"] = "Unexpected error occurred"
+
+    return json.dumps(output)
+
+
+def export_library(user_id):
+    """
+    Yields a user's categories, then their bookmarks with the names of their
+    categories, one json object per line. Bookmarks are read through a
+    server side cursor, so memory use doesn't grow with the library
+
+    :param user_id: Id of the user being exported
+    :type user_id: int
+    :returns: Lines of NDJSON
+    :rtype: generator
+    """
+    Bookmark = models.bookmarks.Bookmark
+    BookmarkXrefCategory = models.bookmark_xref_categories.BookmarkXrefCategory
+    Category = models.categories.Category
+
+    connection = models.database.replica_engine.connect().execution_options(
+        stream_results=True
+    )
+    try:
+        for category in connection.execute(
+            sqlalchemy.select([Category.name])
+            .where(Category.user_id == user_id)
+            .order_by(Category.id)
+        ):
+            yield json.dumps(
+                {"type": "category", "name": category.name}
+            ) + "\n"
+
+        # One row per bookmark and category, rows of a bookmark are together
+        rows = connection.execute(
+            sqlalchemy.select(
+                [
+                    Bookmark.id,
+                    Bookmark.giphy_id,
+                    Bookmark.favorite,
+                    Category.name,
+                ]
+            )
+            .select_from(
+                Bookmark.__table__.outerjoin(
+                    BookmarkXrefCategory.__table__,
+                    BookmarkXrefCategory.bookmark_id == Bookmark.id,
+                ).outerjoin(
+                    Category.__table__,
+                    Category.id == BookmarkXrefCategory.category_id,
+                )
+            )
+            .where(Bookmark.user_id == user_id)
+            .order_by(Bookmark.id)
+        )
+        bookmark_id, bookmark = None, None
+        for row in rows:
+            if row.id != bookmark_id:
+                if bookmark:
+                    yield json.dumps(bookmark) + "\n"
+                bookmark_id = row.id
+                bookmark = {
+                    "type": "bookmark",
+                    "giphy_id": row.giphy_id,
+                    "favorite": bool(row.favorite),
+                    "categories": [],
+                }
+            if row.name is not None:
+                bookmark["categories"].append(row.name)
+        if bookmark:
+            yield json.dumps(bookmark) + "\n"
+    finally:
+        connection.close()
+
+
+def parse_import_line(number, line):
+    """
+    Checks a line of an import, see :func:`export_library` for the format
+
+    :param number: Line number, used in errors
+    :type number: int
+    :param line: Line of NDJSON
+    :type line: bytes
+    :returns: Category or bookmark record
+    :rtype: dict
+    :raises ValueError: If the line isn't a valid record
+    """
+    try:
+        record = json.loads(line)
+    except ValueError:
+        raise ValueError("Line {}: invalid json".format(number))
+
+    if not isinstance(record, dict):
+        raise ValueError("Line {}: expected an object".format(number))
+
+    if record.get("type") == "category":
+        if not isinstance(record.get("name"), str) or not record["name"]:
+            raise ValueError("Line {}: expected a name".format(number))
+        return {"type": "category", "name": record["name"]}
+
+    if record.get("type") == "bookmark":
+        categories = record.get("categories", [])
+        if (
+            not isinstance(record.get("giphy_id"), str)
+            or not record["giphy_id"]
+        ):
+            raise ValueError("Line {}: expected a giphy_id".format(number))
+        if not isinstance(categories, list) or not all(
+            isinstance(name, str) and name for name in categories
+        ):
+            raise ValueError(
+                "Line {}: expected a list of category names".format(number)
+            )
+        return {
+            "type": "bookmark",
+            "giphy_id": record["giphy_id"],
+            "favorite": bool(record.get("favorite")),
+            "categories": categories,
+        }
+
+    raise ValueError("Line {}: unknown type".format(number))
+
+
+def import_batch(user_id, records, category_ids):
+    """
+    Loads a batch of records into a user's library with a few multi-row
+    inserts. Existing categories and bookmarks are merged with rather than
+    replaced, so importing the same file twice changes nothing. The caller is
+    responsible for committing the session
+
+    :param user_id: Id of the user being imported into
+    :type user_id: int
+    :param records: Records from :func:`parse_import_line`
+    :type records: list
+    :param category_ids: Category name to id of categories already seen by
+        the import, updated in place
+    :type category_ids: dict
+    :returns: Nothing
+    :rtype: None
+    """
+    Bookmark = models.bookmarks.Bookmark
+    BookmarkXrefCategory = models.bookmark_xref_categories.BookmarkXrefCategory
+    Category = models.categories.Category
+    session = models.database.session
+
+    # A statement can't upsert the same row twice, so merge duplicates first
+    bookmarks = collections.OrderedDict()
+    names = set()
+    for record in records:
+        if record["type"] == "category":
+            names.add(record["name"])
+            continue
+
+        bookmark = bookmarks.setdefault(
+            record["giphy_id"], {"favorite": False, "categories": set()}
+        )
+        bookmark["favorite"] = bookmark["favorite"] or record["favorite"]
+        bookmark["categories"].update(record["categories"])
+        names.update(record["categories"])
+
+    new_names = names.difference(category_ids)
+    if new_names:
+        session.execute(
+            sqlalchemy.dialects.postgresql.insert(Category.__table__)
+            .values([{"user_id": user_id, "name": name} for name in new_names])
+            .on_conflict_do_nothing(index_elements=["user_id", "name"])
+        )
+        category_ids.update(
+            session.execute(
+                sqlalchemy.select([Category.name, Category.id])
+                .where(Category.user_id == user_id)
+                .where(Category.name.in_(new_names))
+            ).fetchall()
+        )
+
+    if not bookmarks:
+        return
+
+    statement = sqlalchemy.dialects.postgresql.insert(
+        Bookmark.__table__
+    ).values(
+        [
+            {
+                "user_id": user_id,
+                "giphy_id": giphy_id,
+                "favorite": bookmark["favorite"],
+            }
+            for giphy_id, bookmark in bookmarks.items()
+        ]
+    )
+    bookmark_ids = dict(
+        session.execute(
+            statement.on_conflict_do_update(
+                index_elements=["user_id", "giphy_id"],
+                # Favorited in either place stays favorited
+                set_={
+                    "favorite": sqlalchemy.or_(
+                        Bookmark.__table__.c.favorite,
+                        statement.excluded.favorite,
+                    )
+                },
+            ).returning(Bookmark.giphy_id, Bookmark.id)
+        ).fetchall()
+    )
+
+    links = [
+        {
+            "bookmark_id": bookmark_ids[giphy_id],
+            "category_id": category_ids[name],
+        }
+        for giphy_id, bookmark in bookmarks.items()
+        for name in bookmark["categories"]
+    ]
+    if links:
+        session.execute(
+            sqlalchemy.dialects.postgresql.insert(
+                BookmarkXrefCategory.__table__
+            )
+            .values(links)
+            .on_conflict_do_nothing()
+        )
+
+
+def requested_projection():
+    """
+    Parts of each gif the requester asked for, through the comma separated
+    `fields` and `renditions` query parameters. Renditions default to
+    `giphy.default_renditions`, "all" sends every one of them
+
+    :returns: Fields to send (None for all of them), and renditions to send
+        (None for all of them)
+    :rtype: tuple(set, set)
+    """
+    fields = flask.request.args.get("fields") or None
+    renditions = flask.request.args.get("renditions") or ",".join(
+        config.giphy.get("default_renditions", ["preview_gif"])
+    )
+
+    if fields is not None:
+        # The id is needed to do anything with the gif
+        fields = set(fields.split(",")) | {"id"}
+    if renditions == "all":
+        renditions = None
+    else:
+        renditions = set(renditions.split(","))
+
+    return fields, renditions
+
+
+def project(item, fields, renditions):
+    """
+    Trims a gif down to the requested fields and renditions, see
+    :func:`requested_projection`
+
+    :param item: Gif as sent to the requester
+    :type item: dict
+    :param fields: Fields to keep, None keeps all of them
+    :type fields: set
+    :param renditions: Renditions of `images` to keep, None keeps all of them
+    :type renditions: set
+    :returns: Trimmed copy of the gif
+    :rtype: dict
+    """
+    if fields is not None:
+        item = {key: value for key, value in item.items() if key in fields}
+    else:
+        item = dict(item)
+
+    if renditions is not None and "images" in item:
+        item["images"] = {
+            name: rendition
+            for name, rendition in item["images"].items()
+            if name in renditions
+        }
+
+    return item
+
+
 @base.route("/")
 @lib.funcs.is_authenticated()
 def default():
@@ -41,37 +596,79 @@ def default():
     return flask.redirect("/search")
 
 
-@base.route("/view")
-@lib.funcs.is_authenticated()
-def view():
+def load_library(user_id, after=None, limit=None):
     """
-    Page for users to view their saved/favorited gifs
-
-    :returns: Rendered template
-    :rtype: str
+    Loads a page of a user's bookmarks along with their GIPHY metadata.
+    Pages are keyed on the bookmark id so every page costs the same no matter
+    how large the library is
+
+    :param user_id: Id of the user whose bookmarks are loaded
+    :type user_id: int
+    :param after: Cursor returned with the previous page
+    :type after: int
+    :param limit: Amount of bookmarks per page, capped to
+        `app.library_max_page_size`
+    :type limit: int
+    :returns: Bookmarks in the page, and the cursor of the next page or None
+        if this is the last one
+    :rtype: tuple(list, int)
+    :raises ValueError: If `limit` is below 1
     """
-    user = (
-        models.database.session.query(models.users.User)
-        .filter(
-            models.users.User.token == flask.request.cookies["X-Auth-Token"]
-        )
-        .one()
+    if limit is not None and limit < 1:
+        raise ValueError("limit must be at least 1, got {}".format(limit))
+
+    limit = min(
+        limit or config.app.get("library_page_size", 50),
+        config.app.get("library_max_page_size", 200),
     )
 
-    all_bookmarks = (
-        models.database.session.query(models.bookmarks.Bookmark)
-        .filter(models.bookmarks.Bookmark.user == user)
-        .all()
+    query = (
+        models.database.read_session.query(
+            models.bookmarks.Bookmark, models.gifs.Gif
+        )
+        .outerjoin(
+            models.gifs.Gif,
+            models.gifs.Gif.giphy_id == models.bookmarks.Bookmark.giphy_id,
+        )
+        .options(
+            sqlalchemy.orm.selectinload(models.bookmarks.Bookmark.categories)
+        )
+        .filter(models.bookmarks.Bookmark.user_id == user_id)
     )
+    if after is not None:
+        query = query.filter(models.bookmarks.Bookmark.id > after)
+
+    # One extra row tells us if there's another page
+    page = query.order_by(models.bookmarks.Bookmark.id).limit(limit + 1).all()
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = page[-1][0].id
+
+    # Only go to GIPHY for gifs we've never stored or that have gone stale,
+    # stale data is still used if GIPHY can't be reached. With the refresher
+    # enabled they're served as they are and refreshed in the background
+    gifs = {bookmark.giphy_id: gif for bookmark, gif in page}
+    outdated = [
+        gifid for gifid, gif in gifs.items() if gif is None or gif.is_stale
+    ]
+    if lib.refresher.enabled():
+        lib.refresher.request_refresh(outdated)
+        outdated = []
+    elif outdated:
+        gifs.update(lib.refresher.refresh_gifs(outdated))
+
     output = []
-    for bookmark in all_bookmarks:
-        giphy_results = (
-            clients.giphy.Client().get(bookmark.giphy_id).get("data", {})
-        )
+    for bookmark, _ in page:
+        gif = gifs[bookmark.giphy_id]
+        if gif is None:
+            # Shouldn't be cached until GIPHY sends the gif's data
+            lib.funcs.uncacheable()
+        giphy_results = gif.to_dict() if gif else {}
         output.append(
             {
                 "type": giphy_results.get("type", "Error Data Lost"),
-                "id": giphy_results.get("id", "Error Data Lost"),
+                "id": bookmark.giphy_id,
                 "url": giphy_results.get("url", "Error Data Lost"),
                 "title": giphy_results.get("title", "Error Data Lost"),
                 "images": giphy_results.get("images", {}),
@@ -82,18 +679,79 @@ def view():
                 ],
             }
         )
-    # Get items from GIPHY after grabbing the bookmarked items
-    number_of_items = len(output)
-    enumerated = enumerate(output)
+
+    if outdated:
+        models.database.session.commit()
+
+    return output, next_cursor
+
+
+@base.route("/view")
+@lib.funcs.is_authenticated()
+@lib.funcs.conditional()
+def view():
+    """
+    Page for users to view their saved/favorited gifs. Only the first page is
+    rendered here, the rest is loaded through :func:`get_library`
+
+    :returns: Rendered template
+    :rtype: str
+    """
+    user_id = lib.funcs.current_user_id()
+    bookmarks, next_cursor = load_library(user_id)
+    categories = (
+        models.database.read_session.query(models.categories.Category)
+        .filter(models.categories.Category.user_id == user_id)
+        .all()
+    )
 
     return flask.render_template(
         "view.html",
-        number_of_items=number_of_items,
-        enumerated=enumerated,
-        user=user,
+        bookmarks=bookmarks,
+        next_cursor=next_cursor,
+        categories=[category.to_dict() for category in categories],
     )
 
 
+@base.route("/get_library")
+@lib.funcs.is_authenticated()
+def get_library():
+    """
+    REST-like endpoint to page through the user's saved/favorited gifs
+
+    :returns: A page of bookmarks and the cursor of the next page
+    :rtype: json
+    """
+    output = {"count": 0, "data": [], "error": "", "next": None}
+
+    try:
+        # Not using get's default in case requester sends blank string
+        after = flask.request.args.get("after") or None
+        limit = flask.request.args.get("limit") or None
+
+        bookmarks, output["next"] = load_library(
+            lib.funcs.current_user_id(),
+            after=int(after) if after is not None else None,
+            limit=int(limit) if limit is not None else None,
+        )
+        fields, renditions = requested_projection()
+        output["data"] = [
+            project(bookmark, fields, renditions) for bookmark in bookmarks
+        ]
+        output["count"] = len(output["data"])
+    except ValueError:
+        message = "Invalid parameters: after={} and/or limit={}".format(
+            flask.escape(flask.request.args.get("after")),
+            flask.escape(flask.request.args.get("limit")),
+        )
+        output["error"] = message
+    except Exception as error:
+        LOGGER.exception(error)
+        output["error"] = "Unexpected error occurred"
+
+    return json.dumps(output)
+
+
 @base.route("/search")
 @lib.funcs.is_authenticated()
 def search():
@@ -131,21 +789,24 @@ def do_search(query):
         )
         output["pagination"] = results["pagination"]
 
-        user = (
-            models.database.session.query(models.users.User)
-            .filter(
-                models.users.User.token
-                == flask.request.cookies["X-Auth-Token"]
+        user_id = lib.funcs.current_user_id()
+        # Most searches are followed by a look at the next page
+        if offset + limit < results["pagination"].get("total_count", 0):
+            clients.giphy.prefetch_search(
+                query=query, limit=limit, offset=offset + limit, owner=user_id
             )
-            .one()
-        )
 
         # Grab existing bookmarks to render on the search page
         gifids = [item.get("id") for item in results.get("data", [])]
         found_bookmarks = (
-            models.database.session.query(models.bookmarks.Bookmark)
+            models.database.read_session.query(models.bookmarks.Bookmark)
+            .options(
+                sqlalchemy.orm.selectinload(
+                    models.bookmarks.Bookmark.categories
+                )
+            )
             .filter(models.bookmarks.Bookmark.giphy_id.in_(gifids))
-            .filter(models.bookmarks.Bookmark.user == user)
+            .filter(models.bookmarks.Bookmark.user_id == user_id)
             .all()
         )
 
@@ -159,23 +820,28 @@ def do_search(query):
             for bookmark in found_bookmarks
         }
 
+        fields, renditions = requested_projection()
         for item in results.get("data", []):
             # We only want specific information back from GIPHY
             output["data"].append(
-                {
-                    "type": item.get("type", "Error Data Lost"),
-                    "id": item.get("id", "Error Data Lost"),
-                    "url": item.get("url", "Error Data Lost"),
-                    "title": item.get("title", "Error Data Lost"),
-                    "images": item.get("images", {}),
-                    "favorited": models.user_models.bookmarks.get(
-                        item.get("id"), {}
-                    ).get("favorited", False),
-                    "saved": item.get("id") in user_bookmarks,
-                    "categories": models.user_models.bookmarks.get(
-                        item.get("id"), {}
-                    ).get("categories", []),
-                }
+                project(
+                    {
+                        "type": item.get("type", "Error Data Lost"),
+                        "id": item.get("id", "Error Data Lost"),
+                        "url": item.get("url", "Error Data Lost"),
+                        "title": item.get("title", "Error Data Lost"),
+                        "images": item.get("images", {}),
+                        "favorited": user_bookmarks.get(
+                            item.get("id"), {}
+                        ).get("favorited", False),
+                        "saved": item.get("id") in user_bookmarks,
+                        "categories": user_bookmarks.get(
+                            item.get("id"), {}
+                        ).get("categories", []),
+                    },
+                    fields,
+                    renditions,
+                )
             )
 
         if not output["data"]:
@@ -188,6 +854,8 @@ def do_search(query):
             flask.escape(flask.request.args.get("offset")),
         )
         output["error"] = message
+    except clients.scheduler.QuotaExhausted:
+        output["error"] = "Too many searches right now, try again shortly"
     except Exception as error:
         LOGGER.exception(error)
         output["error"] = "Unexpected error occurred"
@@ -197,6 +865,7 @@ def do_search(query):
 
 @base.route("/get_gif_by_id/<gifid>")
 @lib.funcs.is_authenticated()
+@lib.funcs.conditional()
 def get_gif_by_id(gifid):
     """
     REST-like endpoint to get a gif by id from GIPHY
@@ -222,19 +891,15 @@ def get_gif_by_id(gifid):
             "categories": [],
         }
 
-        user = (
-            models.database.session.query(models.users.User)
-            .filter(
-                models.users.User.token
-                == flask.request.cookies["X-Auth-Token"]
-            )
-            .one()
-        )
+        user_id = lib.funcs.current_user_id()
 
         bookmark = (
-            models.database.session.query(models.bookmarks.Bookmark)
+            models.database.read_session.query(models.bookmarks.Bookmark)
+            .options(
+                sqlalchemy.orm.joinedload(models.bookmarks.Bookmark.categories)
+            )
             .filter(models.bookmarks.Bookmark.giphy_id == gifid)
-            .filter(models.bookmarks.Bookmark.user == user)
+            .filter(models.bookmarks.Bookmark.user_id == user_id)
             .all()
         )
 
@@ -245,13 +910,21 @@ def get_gif_by_id(gifid):
                 category.to_dict() for category in bookmark[0].categories
             ]
 
+        fields, renditions = requested_projection()
+        output["data"] = project(output["data"], fields, renditions)
+
         if not output["data"]:
             output["error"] = "No results for {}".format(flask.escape(gifid))
 
+    except clients.scheduler.QuotaExhausted:
+        output["error"] = "Too many requests right now, try again shortly"
     except Exception as error:
         LOGGER.exception(error)
         output["error"] = "Unexpected error occurred"
 
+    if output["error"]:
+        lib.funcs.uncacheable()
+
     return json.dumps(output)
 
 
@@ -261,33 +934,10 @@ def save_gif_by_id(gifid):
     """
     REST-like endpoint to save gifs to the user's potato space
 
-    :returns: Customized output from GIPHY
+    :returns: New state of the bookmark, see :func:`change_bookmark`
     :rtype: json
     """
-    user = (
-        models.database.session.query(models.users.User)
-        .filter(
-            models.users.User.token == flask.request.cookies["X-Auth-Token"]
-        )
-        .one()
-    )
-
-    already_bookmarked = (
-        models.database.session.query(models.bookmarks.Bookmark)
-        .filter(models.bookmarks.Bookmark.giphy_id == gifid)
-        .filter(models.bookmarks.Bookmark.user == user)
-        .all()
-    )
-
-    if already_bookmarked:
-        return flask.make_response("")  # Already bookmarked
-    else:
-        models.database.session.add(
-            models.bookmarks.Bookmark(user=user, giphy_id=gifid)
-        )
-        models.database.session.commit()
-
-    return flask.make_response("")
+    return change_bookmark("save", gifid)
 
 
 @base.route("/favorite_gif_by_id/<gifid>")
@@ -296,34 +946,10 @@ def favorite_gif_by_id(gifid):
     """
     REST-like endpoint to favorite gifs
 
-    :returns: Customized output from GIPHY
+    :returns: New state of the bookmark, see :func:`change_bookmark`
     :rtype: json
     """
-    user = (
-        models.database.session.query(models.users.User)
-        .filter(
-            models.users.User.token == flask.request.cookies["X-Auth-Token"]
-        )
-        .one()
-    )
-
-    already_bookmarked = (
-        models.database.session.query(models.bookmarks.Bookmark)
-        .filter(models.bookmarks.Bookmark.giphy_id == gifid)
-        .filter(models.bookmarks.Bookmark.user == user)
-        .all()
-    )
-
-    if already_bookmarked:
-        already_bookmarked[0].favorite = True
-    else:
-        models.database.session.add(
-            models.bookmarks.Bookmark(user=user, giphy_id=gifid, favorite=True)
-        )
-
-    models.database.session.commit()
-
-    return flask.make_response("")
+    return change_bookmark("favorite", gifid)
 
 
 @base.route("/unfavorite_gif_by_id/<gifid>")
@@ -332,29 +958,10 @@ def unfavorite_gif_by_id(gifid):
     """
     REST-like endpoint to unfavorite gifs
 
-    :returns: Customized output from GIPHY
+    :returns: New state of the bookmark, see :func:`change_bookmark`
     :rtype: json
     """
-    user = (
-        models.database.session.query(models.users.User)
-        .filter(
-            models.users.User.token == flask.request.cookies["X-Auth-Token"]
-        )
-        .one()
-    )
-
-    already_bookmarked = (
-        models.database.session.query(models.bookmarks.Bookmark)
-        .filter(models.bookmarks.Bookmark.giphy_id == gifid)
-        .filter(models.bookmarks.Bookmark.user == user)
-        .all()
-    )
-
-    if already_bookmarked:
-        already_bookmarked[0].favorite = False
-        models.database.session.commit()
-
-    return flask.make_response("")
+    return change_bookmark("unfavorite", gifid)
 
 
 @base.route("/remove_gif_by_id/<gifid>")
@@ -363,39 +970,15 @@ def remove_gif_by_id(gifid):
     """
     REST-like endpoint to remove gifs from the user's potato space
 
-    :returns: Customized output from GIPHY
+    :returns: New state of the bookmark, see :func:`change_bookmark`
     :rtype: json
     """
-    user = (
-        models.database.session.query(models.users.User)
-        .filter(
-            models.users.User.token == flask.request.cookies["X-Auth-Token"]
-        )
-        .one()
-    )
-    bookmark = (
-        models.database.session.query(models.bookmarks.Bookmark)
-        .filter(models.bookmarks.Bookmark.giphy_id == gifid)
-        .filter(models.bookmarks.Bookmark.user == user)
-        .one()
-    )
-
-    BookmarkXrefCategory = (
-        models.bookmark_xref_models.categories.BookmarkXrefCategory
-    )
-    (
-        models.database.session.query(BookmarkXrefCategory)
-        .filter(BookmarkXrefCategory.bookmark_id == bookmark.id)
-        .delete()
-    )
-    models.database.session.delete(bookmark)
-    models.database.session.commit()
-
-    return flask.make_response("")
+    return change_bookmark("remove", gifid)
 
 
 @base.route("/get_categories")
 @lib.funcs.is_authenticated()
+@lib.funcs.conditional()
 def get_categories():
     """
     REST-like endpoint to remove gifs from the user's potato space
@@ -403,95 +986,40 @@ def get_categories():
     :returns: Customized output from GIPHY
     :rtype: json
     """
-    user = (
-        models.database.session.query(models.users.User)
-        .filter(
-            models.users.User.token == flask.request.cookies["X-Auth-Token"]
-        )
-        .one()
-    )
+    user_id = lib.funcs.current_user_id()
 
-    results = [category.to_dict() for category in user.categories]
+    categories = (
+        models.database.read_session.query(models.categories.Category)
+        .filter(models.categories.Category.user_id == user_id)
+        .all()
+    )
+    results = [category.to_dict() for category in categories]
 
     return json.dumps(results)
 
 
-@base.route("/add_categories/<gifid>/<category_id>")
+@base.route("/add_categories/<gifid>/<int:category_id>")
 @lib.funcs.is_authenticated()
 def add_categories_to(gifid, category_id):
     """
     REST-like endpoint to add a category to a bookmarked gif
 
-    :returns: Customized output from GIPHY
+    :returns: New state of the bookmark, see :func:`change_bookmark`
     :rtype: json
     """
-    user = (
-        models.database.session.query(models.users.User)
-        .filter(
-            models.users.User.token == flask.request.cookies["X-Auth-Token"]
-        )
-        .one()
-    )
+    return change_bookmark("add_category", gifid, category_id=category_id)
 
-    bookmark = (
-        models.database.session.query(models.bookmarks.Bookmark)
-        .filter(models.bookmarks.Bookmark.giphy_id == gifid)
-        .filter(models.bookmarks.Bookmark.user == user)
-        .one()
-    )
 
-    try:
-        models.database.session.add(
-            models.bookmark_xref_models.categories.BookmarkXrefCategory(
-                bookmark_id=bookmark.id, category_id=category_id
-            )
-        )
-
-        models.database.session.commit()
-    except sqlalchemy.exc.IntegrityError:
-        # This should return a non 200 for already being present
-        return flask.make_response("")
-
-    return flask.make_response("")
-
-
-@base.route("/remove_categories/<gifid>/<category_id>")
+@base.route("/remove_categories/<gifid>/<int:category_id>")
 @lib.funcs.is_authenticated()
 def remove_categories_to(gifid, category_id):
     """
     REST-like endpoint to remove a category from a bookmarked gif
 
-    :returns: Customized output from GIPHY
+    :returns: New state of the bookmark, see :func:`change_bookmark`
     :rtype: json
     """
-    user = (
-        models.database.session.query(models.users.User)
-        .filter(
-            models.users.User.token == flask.request.cookies["X-Auth-Token"]
-        )
-        .one()
-    )
-
-    bookmark = (
-        models.database.session.query(models.bookmarks.Bookmark)
-        .filter(models.bookmarks.Bookmark.giphy_id == gifid)
-        .filter(models.bookmarks.Bookmark.user == user)
-        .one()
-    )
-
-    BookmarkXrefCategory = (
-        models.bookmark_xref_models.categories.BookmarkXrefCategory
-    )
-    (
-        models.database.session.query(BookmarkXrefCategory)
-        .filter(BookmarkXrefCategory.bookmark_id == bookmark.id)
-        .filter(BookmarkXrefCategory.category_id == category_id)
-        .delete()
-    )
-
-    models.database.session.commit()
-
-    return flask.make_response("")
+    return change_bookmark("remove_category", gifid, category_id=category_id)
 
 
 @base.route("/categories")
@@ -503,18 +1031,14 @@ def view_categories():
     :returns: Rendered template
     :rtype: str
     """
-    user = (
-        models.database.session.query(models.users.User)
-        .filter(
-            models.users.User.token == flask.request.cookies["X-Auth-Token"]
-        )
-        .one()
-    )
+    user_id = lib.funcs.current_user_id()
 
-    categories = user.categories
-    return flask.render_template(
-        "models.categories.html", categories=categories
+    categories = (
+        models.database.session.query(models.categories.Category)
+        .filter(models.categories.Category.user_id == user_id)
+        .all()
     )
+    return flask.render_template("categories.html", categories=categories)
 
 
 @base.route("/add_category/<category_name>")
@@ -526,30 +1050,23 @@ def add_category(category_name):
     :returns: Customized output from GIPHY
     :rtype: json
     """
-    user = (
-        models.database.session.query(models.users.User)
-        .filter(
-            models.users.User.token == flask.request.cookies["X-Auth-Token"]
-        )
-        .one()
-    )
-
-    existing_category = (
-        models.database.session.query(models.categories.Category)
-        .filter(models.categories.Category.name == category_name)
-        .filter(models.categories.Category.user == user)
-        .all()
-    )
+    Category = models.categories.Category
+    user_id = lib.funcs.current_user_id()
+    new_category = models.database.session.execute(
+        sqlalchemy.dialects.postgresql.insert(Category.__table__)
+        .values(name=category_name, user_id=user_id)
+        .on_conflict_do_nothing(index_elements=["user_id", "name"])
+        .returning(Category.id, Category.name)
+    ).first()
+    if new_category:
+        lib.funcs.bump_user_version(user_id)
+    models.database.session.commit()
 
-    if existing_category:
+    if not new_category:
         # Already exists, move on
         return json.dumps({})
 
-    new_category = models.categories.Category(name=category_name, user=user)
-    models.database.session.add(new_category)
-    models.database.session.commit()
-
-    return json.dumps(new_category.to_dict())
+    return json.dumps({"id": new_category.id, "name": new_category.name})
 
 
 @base.route("/remove_category/<category_id>")
@@ -561,35 +1078,257 @@ def remove_category(category_id):
     :returns: Customized output from GIPHY
     :rtype: json
     """
-    user = (
-        models.database.session.query(models.users.User)
-        .filter(
-            models.users.User.token == flask.request.cookies["X-Auth-Token"]
-        )
-        .one()
-    )
+    user_id = lib.funcs.current_user_id()
 
-    BookmarkXrefCategory = (
-        models.bookmark_xref_models.categories.BookmarkXrefCategory
-    )
+    BookmarkXrefCategory = models.bookmark_xref_categories.BookmarkXrefCategory
+    # Only unlinks the category if it's the user's
     (
         models.database.session.query(BookmarkXrefCategory)
-        .filter(BookmarkXrefCategory.category_id == category_id)
-        .delete()
+        .filter(
+            BookmarkXrefCategory.category_id.in_(
+                models.database.session.query(models.categories.Category.id)
+                .filter(models.categories.Category.id == category_id)
+                .filter(models.categories.Category.user_id == user_id)
+                .subquery()
+            )
+        )
+        .delete(synchronize_session=False)
     )
 
     (
         models.database.session.query(models.categories.Category)
         .filter(models.categories.Category.id == category_id)
-        .filter(models.categories.Category.user_id == user.id)
+        .filter(models.categories.Category.user_id == user_id)
         .delete()
     )
+    lib.funcs.bump_user_version(user_id)
 
     models.database.session.commit()
 
     return flask.make_response("")
 
 
+@base.route("/bulk_operations", methods=("POST",))
+@lib.funcs.is_authenticated()
+def bulk_operations():
+    """
+    REST-like endpoint applying a batch of operations in one transaction,
+    either every operation is applied or none are. Expects json like::
+
+        {"operations": [
+            {"action": "favorite", "gifids": ["abc", "def"]},
+            {"action": "add_category", "category_id": 1, "gifids": ["abc"]}
+        ]}
+
+    :returns: Whether each operation applied to each of its gifs, in the same
+        order as the operations
+    :rtype: json
+    """
+    output = {"results": [], "error": ""}
+
+    try:
+        operations = parse_operations(flask.request.get_json(silent=True))
+    except ValueError as error:
+        output["error"] = "Invalid operations: {}".format(
+            flask.escape(str(error))
+        )
+        return json.dumps(output)
+
+    try:
+        user_id = lib.funcs.current_user_id()
+        for operation in operations:
+            output["results"].append(
+                {
+                    "action": operation["action"],
+                    "category_id": operation["category_id"],
+                    "results": apply_operation(
+                        user_id,
+                        operation["action"],
+                        operation["gifids"],
+                        category_id=operation["category_id"],
+                    ),
+                }
+            )
+        models.database.session.commit()
+    except Exception as error:
+        LOGGER.exception(error)
+        models.database.session.rollback()
+        output["results"] = []
+        output["error"] = "Unexpected error occurred"
+
+    return json.dumps(output)
+
+
+@base.route("/export")
+@lib.funcs.is_authenticated()
+def export():
+    """
+    Streams the user's categories and bookmarks as NDJSON, see
+    :func:`export_library`
+
+    :returns: Download of the user's library
+    :rtype: flask.Response
+    """
+    response = flask.Response(
+        flask.stream_with_context(export_library(lib.funcs.current_user_id())),
+        mimetype="application/x-ndjson",
+    )
+    response.headers["Content-Disposition"] = (
+        'attachment; filename="giphy_library.ndjson"'
+    )
+    return response
+
+
+@base.route("/import", methods=("POST",))
+@lib.funcs.is_authenticated()
+def import_library():
+    """
+    REST-like endpoint loading a file made by /export into the user's
+    library, in one transaction. The body is read a line at a time and
+    loaded in batches of `app.import_batch_size`
+
+    :returns: Number of categories and bookmarks read
+    :rtype: json
+    """
+    output = {"categories": 0, "bookmarks": 0, "error": ""}
+    user_id = lib.funcs.current_user_id()
+    batch_size = config.app.get("import_batch_size", 1000)
+    category_ids = {}
+    batch = []
+
+    try:
+        for number, line in enumerate(flask.request.stream, 1):
+            if not line.strip():
+                continue
+
+            record = parse_import_line(number, line)
+            if record["type"] == "category":
+                output["categories"] += 1
+            else:
+                output["bookmarks"] += 1
+            batch.append(record)
+            if len(batch) >= batch_size:
+                import_batch(user_id, batch, category_ids)
+                batch = []
+
+        if batch:
+            import_batch(user_id, batch, category_ids)
+        lib.funcs.bump_user_version(user_id)
+        models.database.session.commit()
+    except ValueError as error:
+        models.database.session.rollback()
+        output = {
+            "categories": 0,
+            "bookmarks": 0,
+            "error": "Invalid import: {}".format(flask.escape(str(error))),
+        }
+    except Exception as error:
+        LOGGER.exception(error)
+        models.database.session.rollback()
+        output = {
+            "categories": 0,
+            "bookmarks": 0,
+            "error": "Unexpected error occurred",
+        }
+
+    return json.dumps(output)
+
+
+@base.app_context_processor
+def media_proxy():
+    """
+    Tells the templates and their scripts whether to load previews through
+    /media
+
+    :returns: Variables for every template
+    :rtype: dict
+    """
+    return {"media_proxy": lib.media_cache.enabled()}
+
+
+@base.app_template_filter()
+def media_url(url):
+    """
+    Template filter pointing a GIPHY media URL at /media when the media
+    proxy is enabled
+
+    :param url: GIPHY media URL
+    :type url: str
+    :returns: URL to load the media from
+    :rtype: str
+    """
+    if not url or not lib.media_cache.enabled():
+        return url
+    return flask.url_for("base.media", url=url)
+
+
+@base.route("/media")
+@lib.funcs.is_authenticated()
+def media():
+    """
+    Serves GIPHY media from the on-disk media cache, filling it on a miss.
+    Handles Range and If-None-Match. If the media can't be cached, the
+    browser is sent to GIPHY for it instead
+
+    :returns: The media, or a redirect to it
+    :rtype: flask.Response
+    """
+    if not lib.media_cache.enabled():
+        flask.abort(404)
+
+    url = flask.request.args.get("url")
+    cache = lib.media_cache.get_cache()
+    try:
+        # Evicted by another worker between the lookup and the open, which
+        # refills it
+        for attempt in range(2):
+            path, digest, content_type = cache.get(url)
+            try:
+                _file = open(path, "rb")
+                break
+            except FileNotFoundError:
+                if attempt:
+                    raise
+    except lib.media_cache.NotAllowed:
+        flask.abort(400)
+    except Exception as error:
+        LOGGER.warning("Caching %s failed: %r", url, error)
+        lib.metrics.MEDIA_CACHE_REQUESTS.inc(outcome="error")
+        return flask.redirect(url)
+
+    response = flask.send_file(
+        _file,
+        mimetype=content_type,
+        add_etags=False,
+        cache_timeout=config.app.get("media_proxy", {}).get("max_age", 86400),
+    )
+    # Stored by content, so the digest is a strong validator. There's no
+    # Last-Modified, the file's mtime is bumped on every use to track LRU
+    stat = os.fstat(_file.fileno())
+    response.set_etag(digest)
+    # Only sent on range requests otherwise, browsers look for it on the first
+    response.headers["Accept-Ranges"] = "bytes"
+    return response.make_conditional(
+        flask.request, accept_ranges=True, complete_length=stat.st_size
+    )
+
+
+@base.route("/metrics")
+def metrics():
+    """
+    Prometheus scrape endpoint with route, GIPHY and database pool metrics
+
+    :returns: Metrics in Prometheus' text format
+    :rtype: str
+    """
+    if not config.app.get("metrics", {}).get("enabled", True):
+        flask.abort(404)
+
+    response = flask.make_response(lib.metrics.REGISTRY.render())
+    response.headers["Content-Type"] = "text/plain; version=0.0.4"
+    return response
+
+
 @base.route("/login", methods=("GET", "POST"))
 def login():
     """
@@ -614,10 +1353,19 @@ def login():
             user = found_user[0]
             LOGGER.debug(user.password)
 
-            if user.password != lib.funcs.encrypt(password):
-                # Invalid login
-                return flask.render_template("login.html")
+            try:
+                if not user.check_password(password):
+                    # Invalid login
+                    return flask.render_template("login.html")
 
+                if user.needs_rehash:
+                    # Upgrades the hash to the configured work factor
+                    user.password = password
+            except lib.hashing.HashingBusy:
+                return flask.render_template("login.html"), 503
+
+            # The old token is no longer valid once rotated
+            lib.funcs.forget_token(user.token)
             new_token = generate_token()
             user.token = new_token
             models.database.session.commit()
@@ -667,9 +1415,12 @@ def register():
             return flask.render_template("register.html")
         else:
             new_token = generate_token()
-            new_user = models.users.User(
-                username=username, password=password1, token=new_token
-            )
+            try:
+                new_user = models.users.User(
+                    username=username, password=password1, token=new_token
+                )
+            except lib.hashing.HashingBusy:
+                return flask.render_template("register.html"), 503
             models.database.session.add(new_user)
             models.database.session.commit()
 
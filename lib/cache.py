@@ -0,0 +1,142 @@
+# Standard imports
+import collections
+import threading
+import time
+
+
+class TTLCache(object):
+    """
+    Thread safe in-memory cache bounded by both size and age. When full, the
+    least recently used entry is evicted
+    """
+
+    def __init__(self, max_size=1024, ttl=300):
+        """
+        Initializer
+
+        :param max_size: Maximum number of entries kept, 0 disables the cache
+        :type max_size: int
+            :default: 1024
+        :param ttl: Seconds an entry is kept before it expires
+        :type ttl: int
+            :default: 300
+        :returns: Nothing
+        :rtype: None
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """
+        Number of entries currently cached, expired or not
+
+        :returns: Number of entries
+        :rtype: int
+        """
+        return len(self._entries)
+
+    def __contains__(self, key):
+        """
+        Whether a fresh entry exists, without counting as a hit or miss or
+        marking it as recently used
+
+        :param key: Key of the entry
+        :type key: hashable
+        :returns: True if the key is cached and hasn't expired
+        :rtype: bool
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[0] >= time.monotonic()
+
+    def get(self, key, default=None):
+        """
+        Gets an entry, marking it as recently used
+
+        :param key: Key of the entry
+        :type key: hashable
+        :param default: Returned if the key is missing or expired
+        :type default: object
+            :default: None
+        :returns: Cached value or `default`
+        :rtype: object
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.evictions += 1
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """
+        Adds or replaces an entry, evicting the least recently used entries
+        if the cache is full
+
+        :param key: Key of the entry
+        :type key: hashable
+        :param value: Value to cache
+        :type value: object
+        :returns: Nothing
+        :rtype: None
+        """
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        """
+        Removes an entry if it exists
+
+        :param key: Key of the entry
+        :type key: hashable
+        :returns: Nothing
+        :rtype: None
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        Removes every entry, counters are kept
+
+        :returns: Nothing
+        :rtype: None
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Current counters of the cache
+
+        :returns: hits, misses, evictions, and current size
+        :rtype: dict
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+        }
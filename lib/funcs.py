@@ -4,12 +4,187 @@ import hashlib
 
 # Third party imports
 import flask
+import sqlalchemy
 
 # Application imports
 import config
+import lib.cache
+import lib.hashing
+import lib.refresher
 import models
 
 
+# Maps auth tokens to user ids so most requests don't need to look them up
+_token_cache_config = config.app.get("token_cache", {})
+TOKEN_CACHE = lib.cache.TTLCache(
+    max_size=_token_cache_config.get("max_size", 4096),
+    ttl=_token_cache_config.get("ttl", 60),
+)
+
+
+def authenticate(token):
+    """
+    Finds the id of the user a token belongs to
+
+    :param token: Token from the X-Auth-Token cookie
+    :type token: str
+    :returns: Id of the user, or None if the token is unknown
+    :rtype: int
+    """
+    if not token:
+        return None
+
+    user_id = TOKEN_CACHE.get(token)
+    if user_id is None:
+        found_user = (
+            models.database.session.query(models.users.User.id)
+            .filter(models.users.User.token == token)
+            .first()
+        )
+        if not found_user:
+            return None
+
+        user_id = found_user.id
+        TOKEN_CACHE.set(token, user_id)
+
+    return user_id
+
+
+def forget_token(token):
+    """
+    Drops a token from the token cache, used when a user's token is rotated
+
+    :param token: Token that's no longer valid
+    :type token: str
+    :returns: Nothing
+    :rtype: None
+    """
+    if token:
+        TOKEN_CACHE.delete(token)
+
+
+def current_user_id():
+    """
+    Id of the user making the current request, set by
+    :func:`is_authenticated`
+
+    :returns: Id of the authenticated user
+    :rtype: int
+    """
+    return flask.g.user_id
+
+
+def current_user():
+    """
+    User making the current request, only loaded once per request
+
+    :returns: The authenticated user
+    :rtype: models.users.User
+    """
+    if "user" not in flask.g:
+        flask.g.user = models.database.session.query(models.users.User).get(
+            current_user_id()
+        )
+    return flask.g.user
+
+
+def user_version(user_id):
+    """
+    Current version of a user's bookmarks and categories, bumped when the
+    metadata of their gifs is refreshed too. A plain select on the primary
+    key, so it's cheap enough to run before every conditional request. Read
+    through `read_session`, the session the responses are built from, so a
+    lagging replica never gets its old data tagged with a newer version
+
+    :param user_id: Id of the user
+    :type user_id: int
+    :returns: Version of the user's data
+    :rtype: int
+    """
+    return models.database.read_session.execute(
+        sqlalchemy.select([models.users.User.version]).where(
+            models.users.User.id == user_id
+        )
+    ).scalar()
+
+
+def bump_user_version(user_id):
+    """
+    Invalidates every ETag handed out for the user's data. Must run in the
+    same transaction as the change to the data
+
+    :param user_id: Id of the user whose data changed
+    :type user_id: int
+    :returns: Nothing
+    :rtype: None
+    """
+    models.database.session.execute(
+        models.users.User.__table__.update()
+        .where(models.users.User.id == user_id)
+        .values(version=models.users.User.version + 1)
+    )
+
+
+def uncacheable():
+    """
+    Keeps the current response from getting an ETag, for responses built
+    from partial data (e.g. GIPHY couldn't be reached)
+
+    :returns: Nothing
+    :rtype: None
+    """
+    flask.g.uncacheable = True
+
+
+def conditional(max_age=0):
+    """
+    Handles If-None-Match for responses that only depend on the request and
+    the user's data. The ETag is made from the user's version, so a 304 is
+    sent without loading anything else. Must be applied after
+    :func:`is_authenticated`
+
+    :param max_age: Seconds browsers can reuse the response without asking,
+        0 makes them revalidate every time
+    :type max_age: int
+        :default: 0
+    """
+
+    def wrapper(function):
+        @functools.wraps(function)
+        def wrapped(*args, **kwargs):
+            if not config.app.get("http_cache", {}).get("enabled", True):
+                return function(*args, **kwargs)
+
+            user_id = current_user_id()
+            etag = "{}-{}-{}".format(
+                user_id,
+                user_version(user_id),
+                hashlib.sha1(
+                    flask.request.full_path.encode("utf-8")
+                ).hexdigest()[:16],
+            )
+            if max_age:
+                cache_control = "private, max-age={}".format(max_age)
+            else:
+                cache_control = "private, no-cache"
+
+            if flask.request.if_none_match.contains(etag):
+                response = flask.make_response("", 304)
+            else:
+                response = flask.make_response(function(*args, **kwargs))
+                if response.status_code != 200 or flask.g.get("uncacheable"):
+                    response.headers["Cache-Control"] = "no-store"
+                    return response
+
+            response.set_etag(etag)
+            response.headers["Cache-Control"] = cache_control
+            return response
+
+        return wrapped
+
+    return wrapper
+
+
 # This belongs in lib.funcs
 def is_authenticated():
     """
@@ -36,14 +211,11 @@ def is_authenticated():
             :returns: The called function.
             :rtype: the return type of `function` from :func:`wrapper`
             """
-            token = flask.request.cookies.get("X-Auth-Token")
-            found_user = (
-                models.database.session.query(models.users.User)
-                .filter(models.users.User.token == token)
-                .all()
-            )
-            if found_user:
+            user_id = authenticate(flask.request.cookies.get("X-Auth-Token"))
+            if user_id is not None:
                 # Very simple authentication
+                flask.g.user_id = user_id
+                lib.refresher.touch_user(user_id)
                 return function(*args, **kwargs)
             else:
                 response = flask.make_response(flask.redirect("/login"))
@@ -56,18 +228,17 @@ def is_authenticated():
     return wrapper
 
 
-def encrypt(value):
+def encrypt(value, iterations=None):
     """
-    Encrypts the input
+    Encrypts the input, on the password hashing workers
 
     :param value: Input to be encrypted
     :type value: str
+    :param iterations: PBKDF2 work factor
+    :type iterations: int
+        :default: `app.password_hashing.iterations`
     :returns: Returns the encrypted value
     :rtype: byte
+    :raises lib.hashing.HashingBusy: If too many passwords are being hashed
     """
-    return hashlib.pbkdf2_hmac(
-        hash_name="sha256",
-        password=value.encode("utf-8"),
-        salt=config.postgresql["salt"].encode("utf-8"),
-        iterations=100000,
-    )
+    return lib.hashing.hash_password(value, iterations)
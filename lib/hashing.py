@@ -0,0 +1,165 @@
+# Standard imports
+import concurrent.futures
+import hashlib
+import hmac
+import multiprocessing
+import threading
+
+# Application imports
+import config
+
+
+class HashingBusy(Exception):
+    """
+    Raised when too many passwords are already waiting to be hashed, or
+    when one waited too long
+    """
+
+
+# Passwords are hashed in worker processes so PBKDF2 doesn't hold the GIL,
+# and doesn't pin request threads, while a burst of logins comes in
+_executor = None
+_pending = None
+_lock = threading.Lock()
+
+
+def _settings():
+    """
+    Password hashing settings from `app.password_hashing`
+
+    :returns: Settings with their defaults filled in
+    :rtype: dict
+    """
+    settings = {
+        "iterations": 100000,
+        "workers": None,
+        "max_pending": 64,
+        "timeout": 10,
+    }
+    settings.update(config.app.get("password_hashing", {}))
+    return settings
+
+
+def _pbkdf2(value, salt, iterations):
+    """
+    Hashes a password, runs in the worker processes
+
+    :param value: Password to hash
+    :type value: str
+    :param salt: Salt of the hash
+    :type salt: str
+    :param iterations: PBKDF2 work factor
+    :type iterations: int
+    :returns: Hashed password
+    :rtype: byte
+    """
+    return hashlib.pbkdf2_hmac(
+        hash_name="sha256",
+        password=value.encode("utf-8"),
+        salt=salt.encode("utf-8"),
+        iterations=iterations,
+    )
+
+
+def _get_executor():
+    """
+    Starts the worker processes on their first use. They're started with
+    forkserver (spawn where it isn't available) rather than fork, as the web
+    worker already runs threads (refresher, prefetches, requests) and a
+    forked child could inherit a lock one of them held
+
+    :returns: Pool of the worker processes and the semaphore bounding how
+        many passwords can wait on them
+    :rtype: tuple(concurrent.futures.ProcessPoolExecutor,
+        threading.BoundedSemaphore)
+    """
+    global _executor, _pending
+
+    with _lock:
+        if _executor is None:
+            settings = _settings()
+            _pending = threading.BoundedSemaphore(settings["max_pending"])
+            method = (
+                "forkserver"
+                if "forkserver" in multiprocessing.get_all_start_methods()
+                else "spawn"
+            )
+            _executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=settings["workers"],
+                mp_context=multiprocessing.get_context(method),
+            )
+
+    return _executor, _pending
+
+
+def work_factor():
+    """
+    PBKDF2 iterations new password hashes are made with
+
+    :returns: Configured iterations
+    :rtype: int
+    """
+    return _settings()["iterations"]
+
+
+def hash_password(value, iterations=None):
+    """
+    Hashes a password on the worker processes, or inline when
+    `app.password_hashing.workers` is 0
+
+    :param value: Password to hash
+    :type value: str
+    :param iterations: PBKDF2 work factor
+    :type iterations: int
+        :default: :func:`work_factor`
+    :returns: Hashed password
+    :rtype: byte
+    :raises HashingBusy: If `max_pending` passwords are already queued, or
+        hashing took over `timeout` seconds
+    """
+    settings = _settings()
+    iterations = iterations or settings["iterations"]
+    salt = config.postgresql["salt"]
+
+    if settings["workers"] == 0:
+        return _pbkdf2(value, salt, iterations)
+
+    executor, pending = _get_executor()
+    if not pending.acquire(blocking=False):
+        raise HashingBusy("Too many passwords waiting to be hashed")
+
+    try:
+        future = executor.submit(_pbkdf2, value, salt, iterations)
+        try:
+            return future.result(settings["timeout"])
+        except concurrent.futures.TimeoutError:
+            # Drops it if it hasn't started, a running hash can't be stopped
+            future.cancel()
+            raise HashingBusy(
+                "Password wasn't hashed within {} seconds".format(
+                    settings["timeout"]
+                )
+            )
+    finally:
+        pending.release()
+
+
+def verify_password(value, expected, iterations=None):
+    """
+    Checks a password against its hash in constant time
+
+    :param value: Password to check
+    :type value: str
+    :param expected: Stored hash of the password
+    :type expected: byte
+    :param iterations: PBKDF2 work factor `expected` was made with
+    :type iterations: int
+        :default: :func:`work_factor`
+    :returns: True if the password matches
+    :rtype: bool
+    :raises HashingBusy: If `max_pending` passwords are already queued, or
+        hashing took over `timeout` seconds
+    """
+    return hmac.compare_digest(
+        hash_password(value, iterations), bytes(expected)
+    )
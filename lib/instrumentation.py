@@ -0,0 +1,148 @@
+# Standard imports
+import json
+import logging
+import re
+import time
+
+# Third party imports
+import flask
+import sqlalchemy
+
+# Application imports
+import config
+
+
+LOGGER = logging.getLogger(__name__)
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = r"(?:\?|%s|%\(\w+\)s)"
+_IN_LIST = re.compile(r"\(\s*{0}(?:\s*,\s*{0})+\s*\)".format(_PLACEHOLDER))
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_sql(statement):
+    """
+    Strips literals and formatting from a statement so the same query always
+    normalizes to the same text, no matter its parameters
+
+    :param statement: SQL statement as sent to the database
+    :type statement: str
+    :returns: Normalized SQL
+    :rtype: str
+    """
+    statement = _STRING_LITERAL.sub("?", statement)
+    statement = _NUMBER_LITERAL.sub("?", statement)
+    statement = _IN_LIST.sub("(?, ...)", statement)
+    return _WHITESPACE.sub(" ", statement).strip()
+
+
+def _before_cursor_execute(
+    conn, cursor, statement, parameters, context, executemany
+):
+    """
+    Engine hook, records when a statement started. Kept on the statement's
+    execution context rather than the connection, so a statement that fails
+    (and never reaches :func:`_after_cursor_execute`) leaves nothing behind
+
+    :returns: Nothing
+    :rtype: None
+    """
+    context._query_start_time = time.perf_counter()
+
+
+def _after_cursor_execute(
+    conn, cursor, statement, parameters, context, executemany
+):
+    """
+    Engine hook, adds a finished statement to the current request's stats and
+    logs it if it was slow
+
+    :returns: Nothing
+    :rtype: None
+    """
+    elapsed = time.perf_counter() - context._query_start_time
+
+    settings = config.app.get("sql_instrumentation", {})
+    if elapsed * 1000 >= settings.get("slow_query_ms", 250):
+        LOGGER.warning(
+            "Slow query (%.1fms): %s", elapsed * 1000, normalize_sql(statement)
+        )
+
+    if not flask.has_request_context():
+        return
+
+    stats = flask.g.setdefault(
+        "sql_stats",
+        {"count": 0, "total": 0.0, "slowest": 0.0, "slowest_sql": None},
+    )
+    stats["count"] += 1
+    stats["total"] += elapsed
+    if elapsed >= stats["slowest"]:
+        stats["slowest"] = elapsed
+        stats["slowest_sql"] = statement
+
+
+def _report_request(response):
+    """
+    Flask hook, logs the request's SQL stats as a single JSON line and adds
+    them to the `Server-Timing` header when enabled
+
+    :param response: Response being sent
+    :type response: flask.Response
+    :returns: The same response
+    :rtype: flask.Response
+    """
+    stats = flask.g.get("sql_stats")
+    if not stats:
+        return response
+
+    LOGGER.info(
+        json.dumps(
+            {
+                "event": "sql_stats",
+                "method": flask.request.method,
+                "endpoint": flask.request.endpoint,
+                "status": response.status_code,
+                "statements": stats["count"],
+                "db_ms": round(stats["total"] * 1000, 3),
+                "slowest_ms": round(stats["slowest"] * 1000, 3),
+                "slowest_sql": normalize_sql(stats["slowest_sql"]),
+            }
+        )
+    )
+
+    if config.app.get("sql_instrumentation", {}).get("server_timing"):
+        response.headers.add(
+            "Server-Timing",
+            'db;dur={:.3f};desc="{} statements"'.format(
+                stats["total"] * 1000, stats["count"]
+            ),
+        )
+
+    return response
+
+
+def init_app(app, *engines):
+    """
+    Starts recording per request SQL stats, if `app.sql_instrumentation` is
+    enabled
+
+    :param app: Application being created
+    :type app: flask.Flask
+    :param engines: Engines whose statements are recorded
+    :type engines: sqlalchemy.engine.Engine
+    :returns: Nothing
+    :rtype: None
+    """
+    if not config.app.get("sql_instrumentation", {}).get("enabled", True):
+        return
+
+    for engine in set(engines):
+        sqlalchemy.event.listen(
+            engine, "before_cursor_execute", _before_cursor_execute
+        )
+        sqlalchemy.event.listen(
+            engine, "after_cursor_execute", _after_cursor_execute
+        )
+    app.after_request(_report_request)
@@ -0,0 +1,348 @@
+# Standard imports
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import urllib.parse
+
+# Application imports
+import clients.giphy
+import config
+import lib.metrics
+import lib.singleflight
+
+
+LOGGER = logging.getLogger(__name__)
+# Redirects followed when filling the cache, each one checked by check_url
+MAX_REDIRECTS = 5
+
+
+class NotAllowed(Exception):
+    """
+    Raised for URLs the media proxy won't fetch
+    """
+
+
+class TooLarge(Exception):
+    """
+    Raised when a file is over the size the media proxy stores
+    """
+
+
+class MediaCache(object):
+    """
+    On-disk cache of GIPHY media shared by every worker using the same
+    directory. Files are stored under the sha256 of their content in
+    `blobs`, and `refs` maps the sha256 of each source URL to its file.
+    A file's mtime is its last use, the least recently used files are
+    evicted once the cache is over `max_bytes`
+    """
+
+    def __init__(self, directory, max_bytes, max_object_bytes, session):
+        """
+        Initializer
+
+        :param directory: Where the cache is stored, created if needed
+        :type directory: str
+        :param max_bytes: Size the cache is evicted down from
+        :type max_bytes: int
+        :param max_object_bytes: Largest file stored
+        :type max_object_bytes: int
+        :param session: HTTP session files are fetched with
+        :type session: requests.Session
+        :returns: Nothing
+        :rtype: None
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_object_bytes = max_object_bytes
+        self.session = session
+        self._fills = lib.singleflight.SingleFlight()
+        self._lock = threading.Lock()
+
+        for name in ("blobs", "refs", "tmp"):
+            os.makedirs(os.path.join(directory, name), exist_ok=True)
+        self._size = self._scan()[0]
+
+    def _ref_path(self, url):
+        """
+        Path of the ref of a source URL
+
+        :param url: Source URL
+        :type url: str
+        :returns: Path of the ref
+        :rtype: str
+        """
+        digest = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, "refs", digest)
+
+    def _blob_path(self, digest):
+        """
+        Path of a stored file
+
+        :param digest: sha256 of the file's content
+        :type digest: str
+        :returns: Path of the file
+        :rtype: str
+        """
+        return os.path.join(self.directory, "blobs", digest)
+
+    def _scan(self):
+        """
+        Sizes and last uses of every stored file
+
+        :returns: Total size, and (mtime, size, path) of each file
+        :rtype: tuple(int, list)
+        """
+        entries = []
+        for entry in os.scandir(os.path.join(self.directory, "blobs")):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # Evicted by another worker
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return sum(size for _, size, _ in entries), entries
+
+    def _evict(self):
+        """
+        Deletes the least recently used files until the cache is at 90% of
+        `max_bytes`, then the refs left pointing at deleted files. Sizes are
+        read from disk, so files added or evicted by other workers are
+        accounted for
+
+        :returns: Nothing
+        :rtype: None
+        """
+        size, entries = self._scan()
+        target = self.max_bytes * 0.9
+        for _, file_size, path in sorted(entries):
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= file_size
+            lib.metrics.MEDIA_CACHE_EVICTIONS.inc()
+        self._size = size
+
+        # Refs of evicted files would pile up otherwise
+        for entry in os.scandir(os.path.join(self.directory, "refs")):
+            try:
+                with open(entry.path) as _file:
+                    digest = _file.read().split(" ", 1)[0]
+                if not os.path.exists(self._blob_path(digest)):
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                # Removed by another worker
+                continue
+
+    def check_url(self, url):
+        """
+        Makes sure a URL is https and on one of `app.media_proxy.allowed_hosts`
+        (or their subdomains), so the proxy can't be pointed anywhere else
+
+        :param url: Source URL
+        :type url: str
+        :returns: Nothing
+        :rtype: None
+        :raises NotAllowed: If the URL can't be proxied
+        """
+        parsed = urllib.parse.urlsplit(url or "")
+        host = (parsed.hostname or "").lower()
+        allowed_hosts = config.app.get("media_proxy", {}).get(
+            "allowed_hosts", ["giphy.com"]
+        )
+        if parsed.scheme != "https" or not any(
+            host == allowed or host.endswith("." + allowed)
+            for allowed in allowed_hosts
+        ):
+            raise NotAllowed("Not a GIPHY media URL: {}".format(url))
+
+    def lookup(self, url):
+        """
+        Stored file of a source URL, marking it as just used
+
+        :param url: Source URL
+        :type url: str
+        :returns: Path, sha256 and content type of the file, or None if it
+            isn't stored
+        :rtype: tuple(str, str, str)
+        """
+        try:
+            with open(self._ref_path(url)) as _file:
+                digest, content_type = _file.read().split(" ", 1)
+            path = self._blob_path(digest)
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        return path, digest, content_type
+
+    def get(self, url):
+        """
+        Stored file of a source URL, fetching it first if needed. Concurrent
+        fetches of the same URL share one request
+
+        :param url: Source URL
+        :type url: str
+        :returns: Path, sha256 and content type of the file
+        :rtype: tuple(str, str, str)
+        :raises NotAllowed: If the URL can't be proxied
+        :raises TooLarge: If the file is over `max_object_bytes`
+        :raises requests.RequestException: If the file couldn't be fetched
+        """
+        self.check_url(url)
+
+        found = self.lookup(url)
+        if found is not None:
+            lib.metrics.MEDIA_CACHE_REQUESTS.inc(outcome="hit")
+            return found
+
+        def fill():
+            # Stored by another call since, e.g. one that just finished
+            found = self.lookup(url)
+            if found is not None:
+                return found
+            return self._fill(url)
+
+        lib.metrics.MEDIA_CACHE_REQUESTS.inc(outcome="miss")
+        return self._fills.do(url, fill)
+
+    def _fill(self, url):
+        """
+        Fetches a file into the cache. It's streamed to a temporary file
+        while being hashed, then moved in place, so a partial file is never
+        served
+
+        :param url: Source URL
+        :type url: str
+        :returns: Path, sha256 and content type of the file
+        :rtype: tuple(str, str, str)
+        :raises NotAllowed: If it redirects to a URL that can't be proxied,
+            or too many times
+        """
+        transport = config.giphy.get("transport", {})
+        location = url
+        # Redirects are followed by hand, every hop has to pass check_url
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self.session.get(
+                location,
+                stream=True,
+                allow_redirects=False,
+                timeout=(
+                    transport.get("connect_timeout", 3.05),
+                    transport.get("read_timeout", 10),
+                ),
+            )
+            if not response.is_redirect:
+                break
+            response.close()
+            location = urllib.parse.urljoin(
+                location, response.headers["Location"]
+            )
+            self.check_url(location)
+        else:
+            raise NotAllowed(
+                "{} redirected over {} times".format(url, MAX_REDIRECTS)
+            )
+
+        with response:
+            response.raise_for_status()
+            content_type = response.headers.get(
+                "Content-Type", "application/octet-stream"
+            )
+
+            hasher = hashlib.sha256()
+            size = 0
+            handle, temporary = tempfile.mkstemp(
+                dir=os.path.join(self.directory, "tmp")
+            )
+            try:
+                with os.fdopen(handle, "wb") as _file:
+                    for chunk in response.iter_content(64 * 1024):
+                        size += len(chunk)
+                        if size > self.max_object_bytes:
+                            raise TooLarge(
+                                "{} is over {} bytes".format(
+                                    url, self.max_object_bytes
+                                )
+                            )
+                        hasher.update(chunk)
+                        _file.write(chunk)
+
+                digest = hasher.hexdigest()
+                path = self._blob_path(digest)
+                os.replace(temporary, path)
+            except BaseException:
+                os.remove(temporary)
+                raise
+
+        # Written to a temporary file first too, a ref always names a whole
+        # line
+        handle, temporary = tempfile.mkstemp(
+            dir=os.path.join(self.directory, "tmp")
+        )
+        with os.fdopen(handle, "w") as _file:
+            _file.write("{} {}".format(digest, content_type))
+        os.replace(temporary, self._ref_path(url))
+
+        with self._lock:
+            self._size += size
+            if self._size > self.max_bytes:
+                self._evict()
+
+        return path, digest, content_type
+
+    def size(self):
+        """
+        Bytes this worker believes are stored, corrected on each eviction
+
+        :returns: Size of the cache
+        :rtype: int
+        """
+        return self._size
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def enabled():
+    """
+    Whether gif previews are served through /media
+
+    :returns: True if `app.media_proxy.enabled`
+    :rtype: bool
+    """
+    return config.app.get("media_proxy", {}).get("enabled", False)
+
+
+def get_cache():
+    """
+    The media cache of this worker, created on its first use
+
+    :returns: The media cache
+    :rtype: MediaCache
+    """
+    global _cache
+
+    with _cache_lock:
+        if _cache is None:
+            settings = config.app.get("media_proxy", {})
+            _cache = MediaCache(
+                directory=settings.get("directory", "media_cache"),
+                max_bytes=settings.get("max_bytes", 512 * 1024 * 1024),
+                max_object_bytes=settings.get(
+                    "max_object_bytes", 10 * 1024 * 1024
+                ),
+                # Media comes from GIPHY too, share the API's connections
+                session=clients.giphy.SESSION,
+            )
+            lib.metrics.REGISTRY.add_collector(
+                lambda: lib.metrics.MEDIA_CACHE_BYTES.set(_cache.size())
+            )
+
+    return _cache
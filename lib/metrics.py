@@ -0,0 +1,509 @@
+# Standard imports
+import threading
+import time
+
+# Third party imports
+import flask
+import sqlalchemy.pool
+
+# Application imports
+import config
+
+
+# Default latency buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(names, values, extra=None):
+    """
+    Formats label names and values the way Prometheus expects them
+
+    :param names: Label names
+    :type names: tuple
+    :param values: Label values, in the same order as `names`
+    :type values: tuple
+    :param extra: Additional label as a (name, value) pair
+    :type extra: tuple
+    :returns: Formatted labels, empty if there are none
+    :rtype: str
+    """
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+
+    return "{{{}}}".format(
+        ",".join(
+            '{}="{}"'.format(
+                name,
+                str(value)
+                .replace("\\", "\\\\")
+                .replace("\n", "\\n")
+                .replace('"', '\\"'),
+            )
+            for name, value in pairs
+        )
+    )
+
+
+class Metric(object):
+    """
+    Base of every metric, keeps one value per combination of label values
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        """
+        Initializer
+
+        :param name: Name of the metric
+        :type name: str
+        :param documentation: Help text of the metric
+        :type documentation: str
+        :param labels: Names of the labels every sample must provide
+        :type labels: tuple
+        :returns: Nothing
+        :rtype: None
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        """
+        Label values in the metric's label order
+
+        :param labels: Label name to value
+        :type labels: dict
+        :returns: Label values, as strings
+        :rtype: tuple
+        """
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self):
+        """
+        Current samples of the metric
+
+        :returns: List of (suffix, labels, value)
+        :rtype: list
+        """
+        with self._lock:
+            return [
+                ("", _format_labels(self.labels, key), value)
+                for key, value in sorted(self._values.items())
+            ]
+
+    def render(self):
+        """
+        Prometheus text representation of the metric
+
+        :returns: HELP, TYPE and sample lines
+        :rtype: str
+        """
+        lines = [
+            "# HELP {} {}".format(self.name, self.documentation),
+            "# TYPE {} {}".format(self.name, self.type),
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append(
+                "{}{}{} {}".format(self.name, suffix, labels, repr(value))
+            )
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        """
+        Increments the counter
+
+        :param amount: Amount to add
+        :type amount: float
+            :default: 1
+        :param labels: Label values of the sample
+        :returns: Nothing
+        :rtype: None
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        """
+        Sets the gauge
+
+        :param value: New value
+        :type value: float
+        :param labels: Label values of the sample
+        :returns: Nothing
+        :rtype: None
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=BUCKETS):
+        """
+        Initializer, see :class:`Metric` for the other parameters
+
+        :param buckets: Upper bounds of the buckets
+        :type buckets: tuple
+            :default: BUCKETS
+        :returns: Nothing
+        :rtype: None
+        """
+        super(Histogram, self).__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        """
+        Records an observation
+
+        :param value: Observed value
+        :type value: float
+        :param labels: Label values of the sample
+        :returns: Nothing
+        :rtype: None
+        """
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(
+                key, ([0] * len(self.buckets), 0.0, 0)
+            )
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def samples(self):
+        """
+        Current samples of the histogram, buckets are cumulative
+
+        :returns: List of (suffix, labels, value)
+        :rtype: list
+        """
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    samples.append(
+                        (
+                            "_bucket",
+                            _format_labels(self.labels, key, ("le", bound)),
+                            float(bucket_count),
+                        )
+                    )
+                samples.append(
+                    (
+                        "_bucket",
+                        _format_labels(self.labels, key, ("le", "+Inf")),
+                        float(count),
+                    )
+                )
+                labels = _format_labels(self.labels, key)
+                samples.append(("_sum", labels, total))
+                samples.append(("_count", labels, float(count)))
+        return samples
+
+
+class Registry(object):
+    """
+    Collection of metrics rendered together on /metrics
+    """
+
+    def __init__(self):
+        """
+        Initializer
+
+        :returns: Nothing
+        :rtype: None
+        """
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        """
+        Adds a metric to the registry
+
+        :param metric: Metric to add
+        :type metric: Metric
+        :returns: The same metric
+        :rtype: Metric
+        """
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """
+        Adds a function called before every render, used for gauges that are
+        read from somewhere else rather than updated as things happen
+
+        :param collector: Function taking no arguments
+        :type collector: function
+        :returns: Nothing
+        :rtype: None
+        """
+        self._collectors.append(collector)
+
+    def render(self):
+        """
+        Prometheus text representation of every metric
+
+        :returns: Text exposition format
+        :rtype: str
+        """
+        for collector in self._collectors:
+            collector()
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(
+    Counter(
+        "http_requests_total",
+        "Requests handled, by route",
+        labels=("endpoint", "method", "status"),
+    )
+)
+HTTP_LATENCY = REGISTRY.register(
+    Histogram(
+        "http_request_duration_seconds",
+        "Time spent handling requests, by route",
+        labels=("endpoint", "method"),
+    )
+)
+GIPHY_REQUESTS = REGISTRY.register(
+    Counter(
+        "giphy_requests_total",
+        "Requests sent to GIPHY, by endpoint and response status",
+        labels=("endpoint", "status"),
+    )
+)
+GIPHY_LATENCY = REGISTRY.register(
+    Histogram(
+        "giphy_request_duration_seconds",
+        "Time spent waiting on GIPHY, by endpoint",
+        labels=("endpoint",),
+    )
+)
+GIPHY_COALESCED = REGISTRY.register(
+    Counter(
+        "giphy_requests_coalesced_total",
+        "Calls to GIPHY answered by an identical call already in flight",
+        labels=("endpoint",),
+    )
+)
+GIPHY_PREFETCHES = REGISTRY.register(
+    Counter(
+        "giphy_search_prefetches_total",
+        "Next search pages considered for prefetching, by outcome",
+        labels=("outcome",),
+    )
+)
+GIPHY_BUDGET = REGISTRY.register(
+    Gauge(
+        "giphy_api_key_budget",
+        "Requests each GIPHY API key can send right now, by key",
+        labels=("key",),
+    )
+)
+GIPHY_SCHEDULER_WAIT = REGISTRY.register(
+    Histogram(
+        "giphy_scheduler_wait_seconds",
+        "Time spent waiting for a GIPHY API key with budget, by priority",
+        labels=("priority",),
+    )
+)
+GIPHY_THROTTLED = REGISTRY.register(
+    Counter(
+        "giphy_rate_limited_total",
+        "429 responses from GIPHY, by API key",
+        labels=("key",),
+    )
+)
+GIPHY_QUOTA_REJECTIONS = REGISTRY.register(
+    Counter(
+        "giphy_quota_rejections_total",
+        "Requests to GIPHY dropped because no API key had budget, by priority",
+        labels=("priority",),
+    )
+)
+GIFS_SERVED_STALE = REGISTRY.register(
+    Counter(
+        "gifs_served_stale_total",
+        "Gifs served with stale or no metadata, left to the refresher",
+    )
+)
+GIFS_REFRESHED = REGISTRY.register(
+    Counter(
+        "gifs_refreshed_total",
+        "Gifs refreshed in the background, by outcome",
+        labels=("outcome",),
+    )
+)
+MEDIA_CACHE_REQUESTS = REGISTRY.register(
+    Counter(
+        "media_cache_requests_total",
+        "Media requested through /media, by outcome",
+        labels=("outcome",),
+    )
+)
+MEDIA_CACHE_EVICTIONS = REGISTRY.register(
+    Counter(
+        "media_cache_evictions_total",
+        "Files evicted from the media cache",
+    )
+)
+MEDIA_CACHE_BYTES = REGISTRY.register(
+    Gauge("media_cache_bytes", "Size of the media cache on disk")
+)
+DB_POOL_WAIT = REGISTRY.register(
+    Histogram(
+        "db_pool_checkout_wait_seconds",
+        "Time spent waiting for a connection from the database pool",
+    )
+)
+DB_POOL_CONNECTIONS = REGISTRY.register(
+    Gauge(
+        "db_pool_connections",
+        "Connections of the database pool, by state",
+        labels=("state",),
+    )
+)
+
+
+def _before_request():
+    """
+    Flask hook, records when the request started
+
+    :returns: Nothing
+    :rtype: None
+    """
+    flask.g.metrics_start_time = time.perf_counter()
+
+
+def _after_request(response):
+    """
+    Flask hook, records the request's route, status and latency
+
+    :param response: Response being sent
+    :type response: flask.Response
+    :returns: The same response
+    :rtype: flask.Response
+    """
+    start_time = flask.g.get("metrics_start_time")
+    if start_time is None:
+        return response
+
+    endpoint = flask.request.endpoint or "unknown"
+    HTTP_REQUESTS.inc(
+        endpoint=endpoint,
+        method=flask.request.method,
+        status=response.status_code,
+    )
+    HTTP_LATENCY.observe(
+        time.perf_counter() - start_time,
+        endpoint=endpoint,
+        method=flask.request.method,
+    )
+    return response
+
+
+class TimedQueuePool(sqlalchemy.pool.QueuePool):
+    """
+    QueuePool recording in DB_POOL_WAIT how long each checkout waited for a
+    free connection. Opening a new connection isn't waiting and isn't
+    counted, nor is pre-pinging one, which happens after. Pools have no event
+    fired before a checkout starts, so the pool's wait is timed here instead.
+    An engine recreates its pool with the same class, so this survives
+    `dispose`
+    """
+
+    _timing = threading.local()
+
+    def _do_get(self):
+        """
+        Takes a connection from the pool, waiting for one if needed
+
+        :returns: Record of the connection
+        :rtype: sqlalchemy.pool.base._ConnectionRecord
+        """
+        # QueuePool retries by calling itself, only the outer call is timed
+        if getattr(self._timing, "active", False):
+            return super(TimedQueuePool, self)._do_get()
+
+        self._timing.active = True
+        start_time = time.perf_counter()
+        started_at = time.time()
+        try:
+            record = super(TimedQueuePool, self)._do_get()
+        finally:
+            self._timing.active = False
+
+        waited = time.perf_counter() - start_time
+        # Opened for this checkout, which is the last thing it did
+        if record.starttime >= started_at:
+            waited -= time.time() - record.starttime
+        DB_POOL_WAIT.observe(max(waited, 0.0))
+        return record
+
+
+def _instrument_pool(engine):
+    """
+    Reports the connections of an engine's pool before /metrics renders.
+    Looked up on every render, as `dispose` replaces the pool
+
+    :param engine: Engine whose pool is reported
+    :type engine: sqlalchemy.engine.Engine
+    :returns: Nothing
+    :rtype: None
+    """
+
+    def collect():
+        # Not every pool class keeps track of its size (e.g. NullPool)
+        for state, method in (
+            ("size", "size"),
+            ("checked_in", "checkedin"),
+            ("checked_out", "checkedout"),
+            ("overflow", "overflow"),
+        ):
+            if hasattr(engine.pool, method):
+                DB_POOL_CONNECTIONS.set(
+                    getattr(engine.pool, method)(), state=state
+                )
+
+    REGISTRY.add_collector(collect)
+
+
+def init_app(app, engine):
+    """
+    Starts recording route and database pool metrics, if `app.metrics` is
+    enabled
+
+    :param app: Application being created
+    :type app: flask.Flask
+    :param engine: Engine whose pool is measured
+    :type engine: sqlalchemy.engine.Engine
+    :returns: Nothing
+    :rtype: None
+    """
+    if not config.app.get("metrics", {}).get("enabled", True):
+        return
+
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    _instrument_pool(engine)
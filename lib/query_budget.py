@@ -0,0 +1,56 @@
+# Standard imports
+import contextlib
+
+# Third party imports
+import sqlalchemy
+
+# Application imports
+import models
+
+
+class QueryBudgetExceeded(AssertionError):
+    """
+    Raised when more SQL statements ran than a :func:`query_budget` allowed
+    """
+
+
+@contextlib.contextmanager
+def query_budget(limit, engine=None):
+    """
+    Fails when the wrapped code issues more than `limit` SQL statements, so
+    N+1 query patterns get caught by tests instead of in production. Every
+    statement on the engine is counted, so only use it where nothing else is
+    querying at the same time. Works as a decorator as well::
+
+        with lib.query_budget.query_budget(4):
+            client.get("/view")
+
+    :param limit: Maximum number of statements allowed
+    :type limit: int
+    :param engine: Engine to watch
+    :type engine: sqlalchemy.engine.Engine
+        :default: models.database.engine
+    :returns: The statements issued so far, updated as they run
+    :rtype: list
+    :raises QueryBudgetExceeded: If more than `limit` statements ran
+    """
+    if engine is None:
+        engine = models.database.engine
+
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    sqlalchemy.event.listen(engine, "before_cursor_execute", count)
+    try:
+        yield statements
+    finally:
+        sqlalchemy.event.remove(engine, "before_cursor_execute", count)
+
+    if len(statements) > limit:
+        raise QueryBudgetExceeded(
+            "{} statements issued, budget was {}:\n{}".format(
+                len(statements), limit, "\n".join(statements)
+            )
+        )
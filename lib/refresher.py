@@ -0,0 +1,407 @@
+"""
+Keeps the GIPHY metadata in the gifs table fresh in the background, so pages
+serve whatever is stored right away and never wait on GIPHY for it.
+
+Runs on a thread of each web worker when `giphy.refresher.run_in_app` is set,
+or on its own::
+
+    python -m lib.refresher [--once]
+"""
+# Standard imports
+import argparse
+import collections
+import concurrent.futures
+import datetime
+import logging
+import logging.config
+import random
+import threading
+import time
+
+# Third party imports
+import sqlalchemy
+import sqlalchemy.dialects.postgresql
+
+# Application imports
+import clients.giphy
+import clients.giphy_async
+import clients.scheduler
+import config
+import lib.cache
+import lib.metrics
+import models.database  # Every model needs the database loaded first
+import models.bookmarks
+import models.gifs
+import models.users
+
+
+LOGGER = logging.getLogger(__name__)
+
+_refresher_config = config.giphy.get("refresher", {})
+
+# Gifs pages served stale, refreshed before anything the scan finds
+_pending = collections.OrderedDict()
+_pending_lock = threading.Lock()
+_wakeup = threading.Event()
+_thread = None
+
+# Users whose last_active_at was written recently, so it's written at most
+# once per `giphy.refresher.activity_interval` per worker
+ACTIVE_USERS = lib.cache.TTLCache(
+    max_size=4096, ttl=_refresher_config.get("activity_interval", 300)
+)
+
+
+def enabled():
+    """
+    Whether stale metadata is refreshed in the background instead of while
+    the page waits
+
+    :returns: True if `giphy.refresher.enabled`
+    :rtype: bool
+    """
+    return _refresher_config.get("enabled", False)
+
+
+def refresh_gifs(gifids, priority=clients.scheduler.INTERACTIVE):
+    """
+    Fetches gifs from GIPHY and stores their metadata in the gifs table,
+    see :func:`bump_versions`. The caller is responsible for committing the
+    session
+
+    :param gifids: GIPHY ids to refresh
+    :type gifids: list
+    :param priority: Priority of the requests against the GIPHY quota
+    :type priority: str
+        :default: INTERACTIVE
+    :returns: Refreshed gifs keyed by GIPHY id, detached from the session.
+        Ids GIPHY didn't return, or that couldn't be fetched, are left out
+    :rtype: dict
+    """
+    if config.giphy.get("async_client", {}).get("enabled"):
+        # One hung request would otherwise hold up the caller for good. The
+        # requests may first wait on the scheduler for a key
+        transport = config.giphy.get("transport", {})
+        timeout = transport.get("connect_timeout", 3.05) + transport.get(
+            "read_timeout", 10
+        )
+        if clients.giphy.SCHEDULER is not None:
+            timeout += clients.giphy.SCHEDULER.max_wait.get(priority, 0)
+        try:
+            found, missing = clients.giphy_async.run(
+                clients.giphy_async.AsyncClient(priority=priority).get_many(
+                    gifids
+                ),
+                timeout=timeout,
+            )
+        except Exception as error:
+            # Like Client.get_many, a failure only leaves the gifs as stored
+            LOGGER.exception(error)
+            found, missing = {}, list(gifids)
+    else:
+        found, missing = clients.giphy.Client(priority=priority).get_many(
+            gifids
+        )
+    if missing:
+        LOGGER.warning("GIPHY returned no data for %s", missing)
+
+    rows = [models.gifs.Gif.row_from_giphy(data) for data in found.values()]
+    if rows:
+        statement = sqlalchemy.dialects.postgresql.insert(
+            models.gifs.Gif.__table__
+        ).values(rows)
+        models.database.session.execute(
+            statement.on_conflict_do_update(
+                index_elements=["giphy_id"],
+                set_={
+                    column: statement.excluded[column]
+                    for column in rows[0]
+                    if column != "giphy_id"
+                },
+            )
+        )
+        bump_versions(list(found))
+
+    return {row["giphy_id"]: models.gifs.Gif(**row) for row in rows}
+
+
+def bump_versions(gifids):
+    """
+    Invalidates the ETags of every user who bookmarked one of the gifs, as
+    their pages show the gifs' metadata. Must run in the same transaction as
+    the change to the metadata
+
+    :param gifids: GIPHY ids whose metadata changed
+    :type gifids: list
+    :returns: Nothing
+    :rtype: None
+    """
+    Bookmark = models.bookmarks.Bookmark
+    User = models.users.User
+
+    # Locked in id order first, so concurrent refreshes of gifs with users
+    # in common don't deadlock
+    user_ids = [
+        row.id
+        for row in models.database.session.execute(
+            sqlalchemy.select([User.id])
+            .where(
+                User.id.in_(
+                    sqlalchemy.select([Bookmark.user_id]).where(
+                        Bookmark.giphy_id.in_(gifids)
+                    )
+                )
+            )
+            .order_by(User.id)
+            .with_for_update()
+        )
+    ]
+    if user_ids:
+        models.database.session.execute(
+            User.__table__.update()
+            .where(User.id.in_(user_ids))
+            .values(version=User.version + 1)
+        )
+
+
+def touch_user(user_id):
+    """
+    Records that a user is active, their gifs are refreshed first. Written
+    in its own transaction so it sticks even if the request's is rolled back.
+    Never raises
+
+    :param user_id: Id of the user making a request
+    :type user_id: int
+    :returns: Nothing
+    :rtype: None
+    """
+    if not enabled() or user_id in ACTIVE_USERS:
+        return
+
+    ACTIVE_USERS.set(user_id, True)
+    try:
+        with models.database.engine.begin() as connection:
+            connection.execute(
+                models.users.User.__table__.update()
+                .where(models.users.User.id == user_id)
+                .values(last_active_at=datetime.datetime.utcnow())
+            )
+    except Exception as error:
+        # Only costs the user's place in the refresh order
+        LOGGER.warning(
+            "Recording user %s as active failed: %r", user_id, error
+        )
+
+
+def request_refresh(gifids):
+    """
+    Queues gifs that were just served stale (or not at all, having never
+    been stored) so the background thread refreshes them next
+
+    :param gifids: GIPHY ids to refresh
+    :type gifids: list
+    :returns: Nothing
+    :rtype: None
+    """
+    if not gifids:
+        return
+
+    lib.metrics.GIFS_SERVED_STALE.inc(len(gifids))
+    # Without a thread in this worker, the next scan picks them up
+    if _thread is None:
+        return
+
+    with _pending_lock:
+        for gifid in gifids:
+            _pending[gifid] = True
+            if len(_pending) > _refresher_config.get("max_pending", 10000):
+                _pending.popitem(last=False)
+    _wakeup.set()
+
+
+def stale_gifids(limit):
+    """
+    Bookmarked gifs that have no metadata stored or that will go stale soon.
+    Gifs bookmarked by the most recently active users come first, then the
+    oldest ones. The TTL is cut short by a random part of
+    `giphy.refresher.jitter`, so gifs stored together drift apart instead of
+    all expiring at once
+
+    :param limit: Maximum amount of ids to return
+    :type limit: int
+    :returns: GIPHY ids to refresh
+    :rtype: list
+    """
+    Bookmark = models.bookmarks.Bookmark
+    Gif = models.gifs.Gif
+    User = models.users.User
+
+    ttl = config.giphy.get("metadata_ttl", 86400)
+    ttl *= 1 - random.uniform(0, _refresher_config.get("jitter", 0.1))
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=ttl)
+
+    rows = models.database.read_session.execute(
+        sqlalchemy.select([Bookmark.giphy_id])
+        .select_from(
+            Bookmark.__table__.join(
+                User.__table__, User.id == Bookmark.user_id
+            ).outerjoin(Gif.__table__, Gif.giphy_id == Bookmark.giphy_id)
+        )
+        .where(
+            sqlalchemy.or_(Gif.giphy_id.is_(None), Gif.refreshed_at < cutoff)
+        )
+        .group_by(Bookmark.giphy_id)
+        .order_by(
+            sqlalchemy.func.max(User.last_active_at).desc().nullslast(),
+            sqlalchemy.func.min(Gif.refreshed_at).nullsfirst(),
+        )
+        .limit(limit)
+    )
+    return [row.giphy_id for row in rows]
+
+
+def refresh_batch(gifids):
+    """
+    Refreshes one batch of gifs on its own transaction. Never raises, a
+    failed batch is picked up again by a later pass
+
+    :param gifids: GIPHY ids to refresh, at most `giphy.batch_size`
+    :type gifids: list
+    :returns: Amount of gifs refreshed
+    :rtype: int
+    """
+    try:
+        refreshed = refresh_gifs(gifids, priority=clients.scheduler.BACKGROUND)
+        models.database.session.commit()
+    except Exception as error:
+        LOGGER.warning("Refreshing %s gifs failed: %r", len(gifids), error)
+        models.database.session.rollback()
+        lib.metrics.GIFS_REFRESHED.inc(len(gifids), outcome="failed")
+        return 0
+    finally:
+        models.database.session.remove()
+        models.database.read_session.remove()
+
+    lib.metrics.GIFS_REFRESHED.inc(len(refreshed), outcome="refreshed")
+    lib.metrics.GIFS_REFRESHED.inc(
+        len(gifids) - len(refreshed), outcome="missing"
+    )
+    return len(refreshed)
+
+
+def run_pass(scan=True):
+    """
+    Refreshes the queued gifs, then the stale ones the scan finds, at most
+    `giphy.refresher.max_per_pass` in all. Batches of `giphy.batch_size` run
+    `giphy.refresher.max_concurrency` at a time
+
+    :param scan: Whether to look for stale gifs in the database
+    :type scan: bool
+        :default: True
+    :returns: Amount of gifs refreshed
+    :rtype: int
+    """
+    max_per_pass = _refresher_config.get("max_per_pass", 1000)
+
+    with _pending_lock:
+        gifids = list(_pending)[:max_per_pass]
+        for gifid in gifids:
+            del _pending[gifid]
+
+    if scan and len(gifids) < max_per_pass:
+        try:
+            gifids.extend(stale_gifids(max_per_pass))
+        finally:
+            models.database.read_session.remove()
+        gifids = list(collections.OrderedDict.fromkeys(gifids))
+        gifids = gifids[:max_per_pass]
+
+    if not gifids:
+        return 0
+
+    batch_size = config.giphy.get("batch_size", 100)
+    batches = [
+        gifids[index : index + batch_size]
+        for index in range(0, len(gifids), batch_size)
+    ]
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=_refresher_config.get("max_concurrency", 2),
+        thread_name_prefix="gif-refresher",
+    ) as executor:
+        refreshed = sum(executor.map(refresh_batch, batches))
+
+    LOGGER.info("Refreshed %s of %s gifs", refreshed, len(gifids))
+    return refreshed
+
+
+def run_forever():
+    """
+    Runs a pass whenever gifs are queued, and scans for stale gifs every
+    `giphy.refresher.interval` seconds, give or take
+    `giphy.refresher.jitter` of it so workers don't scan in lockstep
+
+    :returns: Nothing, runs until the process exits
+    :rtype: None
+    """
+    next_scan = 0.0
+    while True:
+        now = time.monotonic()
+        scan = now >= next_scan
+        if scan:
+            jitter = _refresher_config.get("jitter", 0.1)
+            next_scan = now + _refresher_config.get(
+                "interval", 300
+            ) * random.uniform(1 - jitter, 1 + jitter)
+
+        try:
+            run_pass(scan=scan)
+        except Exception as error:
+            LOGGER.exception(error)
+
+        _wakeup.wait(max(next_scan - time.monotonic(), 0))
+        _wakeup.clear()
+
+
+def start():
+    """
+    Starts the background thread of this worker, only once
+
+    :returns: True if the thread was started
+    :rtype: bool
+    """
+    global _thread
+
+    if _thread is not None:
+        return False
+
+    _thread = threading.Thread(
+        target=run_forever, name="gif-refresher", daemon=True
+    )
+    _thread.start()
+    return True
+
+
+def main():
+    """
+    Runs the refresher on its own, outside of the web workers
+
+    :returns: Nothing
+    :rtype: None
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "--once", action="store_true", help="Run a single pass and exit"
+    )
+    args = parser.parse_args()
+
+    logging.config.dictConfig(config.logging)
+    models.database.init_db()
+
+    if args.once:
+        run_pass()
+    else:
+        run_forever()
+
+
+if __name__ == "__main__":
+    main()
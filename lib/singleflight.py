@@ -0,0 +1,81 @@
+# Standard imports
+import concurrent.futures
+import threading
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls for the same key: the first caller runs the
+    call, everyone asking for the key while it's in flight waits for it and
+    gets the same result, or the same exception
+    """
+
+    def __init__(self):
+        """
+        Initializer
+
+        :returns: Nothing
+        :rtype: None
+        """
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """
+        Number of calls currently in flight
+
+        :returns: Number of calls
+        :rtype: int
+        """
+        return len(self._calls)
+
+    def do(self, key, function, timeout=None):
+        """
+        Runs `function`, unless a call for `key` is already in flight, in
+        which case its outcome is waited for instead
+
+        :param key: Key of the call
+        :type key: hashable
+        :param function: Function taking no arguments making the call
+        :type function: function
+        :param timeout: Seconds to wait on a call already in flight, None
+            waits as long as it takes. Doesn't apply to the caller running
+            the call
+        :type timeout: float
+        :returns: Result of the call
+        :rtype: object
+        :raises concurrent.futures.TimeoutError: If the call in flight took
+            over `timeout`
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = concurrent.futures.Future()
+                self._calls[key] = future
+
+        if not leader:
+            return future.result(timeout)
+
+        try:
+            result = function()
+        except BaseException as error:
+            self._finish(key)
+            future.set_exception(error)
+            raise
+
+        self._finish(key)
+        future.set_result(result)
+        return result
+
+    def _finish(self, key):
+        """
+        Lets the next call for `key` run again instead of waiting
+
+        :param key: Key of the call
+        :type key: hashable
+        :returns: Nothing
+        :rtype: None
+        """
+        with self._lock:
+            self._calls.pop(key, None)
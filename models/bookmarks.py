@@ -7,6 +7,14 @@ import models
 
 class Bookmark(models.database.Base):
     __tablename__ = "bookmarks"
+    __table_args__ = (
+        # Target of the upserts when saving/favoriting, see models.migrations
+        sqlalchemy.Index(
+            "uq_bookmarks_user_id_giphy_id", "user_id", "giphy_id", unique=True
+        ),
+        # Keyset pagination of a user's library, see controllers.load_library
+        sqlalchemy.Index("ix_bookmarks_user_id_id", "user_id", "id"),
+    )
 
     # Due to the complexities of Composite Foreign keys in SQLAlchemy a
     # traditional single id primary_key column will be used
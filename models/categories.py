@@ -7,6 +7,12 @@ import models
 
 class Category(models.database.Base):
     __tablename__ = "categories"
+    __table_args__ = (
+        # Target of the upsert when adding categories, see models.migrations
+        sqlalchemy.Index(
+            "uq_categories_user_id_name", "user_id", "name", unique=True
+        ),
+    )
 
     # Due to the complexities of Composite Foreign keys in SQLAlchemy a
     # traditional single id primary_key column will be used
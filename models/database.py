@@ -5,27 +5,51 @@ from sqlalchemy.ext.declarative import declarative_base
 
 # Application imports
 import config
+import lib.metrics
 
 
-def load_db(config):
+def build_engine(uri, poolclass=None):
     """
-    Creates a SQLAlchemy session to be used by the controllers
+    Creates an engine with the pool settings from `postgresql.pool`, only the
+    settings present are passed on so SQLAlchemy's defaults apply otherwise
 
-    :param config: Configuration information provided by :meth:load_config
-    :type config: dict
-    :returns: SQLAlchemy Session
-    :rtype: sqlalchemy.orm.session.Session
+    :param uri: URI of the database, formatted with the `postgresql` section
+    :type uri: str
+    :param poolclass: Class of the engine's pool
+    :type poolclass: type
+        :default: The dialect's default
+    :returns: SQLAlchemy Engine
+    :rtype: sqlalchemy.engine.Engine
     """
-    engine = sqlalchemy.create_engine(
-        config["postgresql"]["sqlalchemy_uri"].format(**config["postgresql"])
-    )
-    Session = sqlalchemy.orm.sessionmaker(bind=engine)
-    return Session()
+    settings = config.postgresql.get("pool") or {}
+    options = {
+        option: settings[setting]
+        for setting, option in (
+            ("size", "pool_size"),
+            ("max_overflow", "max_overflow"),
+            ("timeout", "pool_timeout"),
+            ("pre_ping", "pool_pre_ping"),
+            ("recycle", "pool_recycle"),
+        )
+        if settings.get(setting) is not None
+    }
+    if poolclass is not None:
+        options["poolclass"] = poolclass
+    if settings.get("statement_timeout_ms"):
+        # Set on every new connection, the server cancels slower statements
+        options["connect_args"] = {
+            "options": "-c statement_timeout={}".format(
+                settings["statement_timeout_ms"]
+            )
+        }
+
+    return sqlalchemy.create_engine(uri.format(**config.postgresql), **options)
 
 
 def init_db():
     """
-    Creates the tables in the database if they don't exist.
+    Creates the tables in the database if they don't exist, then applies
+    any pending migrations from :mod:`models.migrations`.
     Currently requires each model to be imported to ensure they're loaded
     before the tables are created
 
@@ -38,15 +62,47 @@ def init_db():
     from models import bookmarks  # noqa: F401
     from models import users  # noqa: F401
     from models import bookmark_xref_categories  # noqa: F401
+    from models import gifs  # noqa: F401
+    from models import schema_migrations  # noqa: F401
+    from models import migrations
 
     Base.metadata.create_all(bind=engine)
+    migrations.migrate(engine)
+
+
+def remove_sessions(exception=None):
+    """
+    Flask teardown hook, ends the request's transactions and returns their
+    connections to the pools
+
+    :param exception: Exception that ended the request, if any
+    :type exception: Exception
+    :returns: Nothing
+    :rtype: None
+    """
+    session.remove()
+    read_session.remove()
 
 
-engine = sqlalchemy.create_engine(
-    config.postgresql["sqlalchemy_uri"].format(**config.postgresql)
+# Checkouts of the primary's pool are timed for /metrics
+engine = build_engine(
+    config.postgresql["sqlalchemy_uri"],
+    poolclass=lib.metrics.TimedQueuePool,
 )
 session = scoped_session(
     sessionmaker(autocommit=False, autoflush=False, bind=engine)
 )
+
+# Read-only lookups use read_session, which is bound to the replica when
+# `postgresql.replica_uri` is set and to the primary otherwise. The replica
+# can lag behind, so anything that writes or must see its own writes stays on
+# session
+if config.postgresql.get("replica_uri"):
+    replica_engine = build_engine(config.postgresql["replica_uri"])
+else:
+    replica_engine = engine
+read_session = scoped_session(
+    sessionmaker(autocommit=False, autoflush=False, bind=replica_engine)
+)
 Base = declarative_base()
 Base.query = session.query_property()
@@ -0,0 +1,96 @@
+# Standard imports
+import datetime
+
+# Third party imports
+import sqlalchemy
+
+# Application imports
+import config
+import models
+
+
+class Gif(models.database.Base):
+    __tablename__ = "gifs"
+
+    # Normalized copy of GIPHY's metadata so pages can render without asking
+    # GIPHY every time
+    giphy_id = sqlalchemy.Column(sqlalchemy.String, primary_key=True)
+    type = sqlalchemy.Column(sqlalchemy.String)
+    url = sqlalchemy.Column(sqlalchemy.String)
+    title = sqlalchemy.Column(sqlalchemy.String)
+    images = sqlalchemy.Column(sqlalchemy.JSON)
+    refreshed_at = sqlalchemy.Column(
+        sqlalchemy.DateTime, default=datetime.datetime.utcnow, nullable=False
+    )
+
+    def __init__(self, **kwargs):
+        """
+        Initializer
+
+        :returns: Nothing
+        :rtype: None
+        """
+        super(Gif, self).__init__()
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+    def __repr__(self):
+        """
+        Custom String representation
+
+        :returns: String representation of the data
+        :rtype: str
+        """
+        message = (
+            "<Gif(giphy_id='{giphy_id}', title='{title}', "
+            + "refreshed_at='{refreshed_at}')>"
+        )
+        return message.format(**self.__dict__)
+
+    @staticmethod
+    def row_from_giphy(data):
+        """
+        Column values for a single item of GIPHY's response
+
+        :param data: GIPHY's data for a single gif
+        :type data: dict
+        :returns: Column name to value, ready to be inserted
+        :rtype: dict
+        """
+        return {
+            "giphy_id": data["id"],
+            "type": data.get("type"),
+            "url": data.get("url"),
+            "title": data.get("title"),
+            "images": data.get("images", {}),
+            "refreshed_at": datetime.datetime.utcnow(),
+        }
+
+    @property
+    def is_stale(self):
+        """
+        Whether the metadata is older than `giphy.metadata_ttl` seconds
+
+        :returns: True if the gif should be refreshed from GIPHY
+        :rtype: bool
+        """
+        ttl = datetime.timedelta(
+            seconds=config.giphy.get("metadata_ttl", 86400)
+        )
+        return self.refreshed_at + ttl < datetime.datetime.utcnow()
+
+    def to_dict(self):
+        """
+        Custom Dictionary/Json-able representation, keyed the same as GIPHY's
+        response
+
+        :returns: Dict representation of the data
+        :rtype: dict
+        """
+        return {
+            "type": self.type,
+            "id": self.giphy_id,
+            "url": self.url,
+            "title": self.title,
+            "images": self.images or {},
+        }
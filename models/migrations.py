@@ -0,0 +1,209 @@
+# Standard imports
+import logging
+
+# Third party imports
+import sqlalchemy
+
+# Application imports
+import models
+
+
+LOGGER = logging.getLogger(__name__)
+
+# Arbitrary key for the postgres advisory lock held while migrating, so
+# workers starting at the same time don't apply the same migration twice
+LOCK_KEY = 7306216
+
+# Ordered list of (version, description, statements). Statements must be safe
+# to run against a database where create_all already built the latest schema,
+# and versions must never be reused or reordered once released
+MIGRATIONS = [
+    (
+        1,
+        "Index users.token",
+        ["CREATE INDEX IF NOT EXISTS ix_users_token ON users (token)"],
+    ),
+    (
+        2,
+        "Unique bookmark per user and gif",
+        [
+            # Merge duplicates left behind by racing saves into the oldest,
+            # which keeps every category and the favorite of any of them
+            """
+            INSERT INTO bookmark_xref_categories (bookmark_id, category_id)
+            SELECT DISTINCT kept.id, xref.category_id
+            FROM bookmark_xref_categories xref
+            JOIN bookmarks newer ON newer.id = xref.bookmark_id
+            JOIN (
+                SELECT user_id, giphy_id, MIN(id) AS id
+                FROM bookmarks
+                GROUP BY user_id, giphy_id
+            ) kept
+                ON kept.user_id = newer.user_id
+                AND kept.giphy_id = newer.giphy_id
+                AND kept.id < newer.id
+            ON CONFLICT DO NOTHING
+            """,
+            """
+            UPDATE bookmarks older
+            SET favorite = TRUE
+            FROM bookmarks newer
+            WHERE older.user_id = newer.user_id
+                AND older.giphy_id = newer.giphy_id
+                AND older.id < newer.id
+                AND newer.favorite
+            """,
+            """
+            DELETE FROM bookmark_xref_categories
+            WHERE bookmark_id IN (
+                SELECT newer.id
+                FROM bookmarks newer
+                JOIN bookmarks older
+                    ON older.user_id = newer.user_id
+                    AND older.giphy_id = newer.giphy_id
+                    AND older.id < newer.id
+            )
+            """,
+            """
+            DELETE FROM bookmarks newer
+            USING bookmarks older
+            WHERE older.user_id = newer.user_id
+                AND older.giphy_id = newer.giphy_id
+                AND older.id < newer.id
+            """,
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS uq_bookmarks_user_id_giphy_id
+            ON bookmarks (user_id, giphy_id)
+            """,
+        ],
+    ),
+    (
+        3,
+        "Unique category name per user",
+        [
+            # Merge duplicates into the oldest, keeping their bookmarks
+            """
+            INSERT INTO bookmark_xref_categories (bookmark_id, category_id)
+            SELECT DISTINCT xref.bookmark_id, kept.id
+            FROM bookmark_xref_categories xref
+            JOIN categories newer ON newer.id = xref.category_id
+            JOIN (
+                SELECT user_id, name, MIN(id) AS id
+                FROM categories
+                GROUP BY user_id, name
+            ) kept
+                ON kept.user_id = newer.user_id
+                AND kept.name = newer.name
+                AND kept.id < newer.id
+            ON CONFLICT DO NOTHING
+            """,
+            """
+            DELETE FROM bookmark_xref_categories
+            WHERE category_id IN (
+                SELECT newer.id
+                FROM categories newer
+                JOIN categories older
+                    ON older.user_id = newer.user_id
+                    AND older.name = newer.name
+                    AND older.id < newer.id
+            )
+            """,
+            """
+            DELETE FROM categories newer
+            USING categories older
+            WHERE older.user_id = newer.user_id
+                AND older.name = newer.name
+                AND older.id < newer.id
+            """,
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS uq_categories_user_id_name
+            ON categories (user_id, name)
+            """,
+        ],
+    ),
+    (
+        4,
+        "Index bookmarks for paging through a user's library",
+        [
+            """
+            CREATE INDEX IF NOT EXISTS ix_bookmarks_user_id_id
+            ON bookmarks (user_id, id)
+            """,
+        ],
+    ),
+    (
+        5,
+        "Store the work factor of each password hash",
+        [
+            """
+            ALTER TABLE users
+            ADD COLUMN IF NOT EXISTS password_iterations INTEGER
+            """,
+        ],
+    ),
+    (
+        6,
+        "Version users' data for ETags",
+        [
+            """
+            ALTER TABLE users
+            ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 0
+            """,
+        ],
+    ),
+    (
+        7,
+        "Track user activity and gif age for the background refresher",
+        [
+            """
+            ALTER TABLE users
+            ADD COLUMN IF NOT EXISTS last_active_at TIMESTAMP WITHOUT TIME ZONE
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS ix_gifs_refreshed_at
+            ON gifs (refreshed_at)
+            """,
+        ],
+    ),
+]
+
+
+def migrate(engine):
+    """
+    Applies every migration that hasn't been applied yet, in order. Each
+    migration runs in its own transaction
+
+    :param engine: Engine of the database being migrated
+    :type engine: sqlalchemy.engine.Engine
+    :returns: Versions that were applied
+    :rtype: list
+    """
+    SchemaMigration = models.schema_migrations.SchemaMigration
+
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        with engine.begin() as connection:
+            connection.execute(
+                sqlalchemy.text("SELECT pg_advisory_xact_lock(:key)"),
+                key=LOCK_KEY,
+            )
+            already_applied = connection.execute(
+                sqlalchemy.select([SchemaMigration.version]).where(
+                    SchemaMigration.version == version
+                )
+            ).first()
+            if already_applied:
+                continue
+
+            LOGGER.info("Applying migration %s: %s", version, description)
+            for statement in statements:
+                connection.execute(sqlalchemy.text(statement))
+
+            connection.execute(
+                SchemaMigration.__table__.insert().values(
+                    version=version, description=description
+                )
+            )
+            applied.append(version)
+
+    return applied
@@ -0,0 +1,57 @@
+# Standard imports
+import datetime
+
+# Third party imports
+import sqlalchemy
+
+# Application imports
+import models
+
+
+class SchemaMigration(models.database.Base):
+    __tablename__ = "schema_migrations"
+
+    # One row per migration from models.migrations that has been applied
+    version = sqlalchemy.Column(
+        sqlalchemy.Integer, primary_key=True, autoincrement=False
+    )
+    description = sqlalchemy.Column(sqlalchemy.String, nullable=False)
+    applied_at = sqlalchemy.Column(
+        sqlalchemy.DateTime, default=datetime.datetime.utcnow, nullable=False
+    )
+
+    def __init__(self, **kwargs):
+        """
+        Initializer
+
+        :returns: Nothing
+        :rtype: None
+        """
+        super(SchemaMigration, self).__init__()
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+    def __repr__(self):
+        """
+        Custom String representation
+
+        :returns: String representation of the data
+        :rtype: str
+        """
+        return (
+            "<SchemaMigration(version='{version}', "
+            + "description='{description}')>"
+        ).format(**self.__dict__)
+
+    def to_dict(self):
+        """
+        Custom Dictionary/Json-able representation
+
+        :returns: Dict representation of the data
+        :rtype: dict
+        """
+        return {
+            "version": self.version,
+            "description": self.description,
+            "applied_at": self.applied_at.isoformat(),
+        }
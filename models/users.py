@@ -8,6 +8,11 @@ import sqlalchemy
 import config
 import models
 import lib
+import lib.hashing
+
+
+# Work factor of every hash made before password_iterations was stored
+LEGACY_ITERATIONS = 100000
 
 
 class User(models.database.Base):
@@ -21,11 +26,24 @@ class User(models.database.Base):
     )
     # Needs to be encrypted
     enc_password = sqlalchemy.Column(sqlalchemy.LargeBinary, nullable=False)
+    # PBKDF2 work factor of enc_password, NULL for hashes made before it was
+    # configurable
+    password_iterations = sqlalchemy.Column(sqlalchemy.Integer)
 
     # For simplicity sake, the users token will be saved to their user record
     # In Enterprise software, this belongs in memcached, Redis, or some other
     # Cache system
-    token = sqlalchemy.Column(sqlalchemy.String)
+    token = sqlalchemy.Column(sqlalchemy.String, index=True)
+
+    # Bumped by every change to the user's bookmarks or categories, the ETags
+    # of their pages are made from it, see lib.funcs.conditional
+    version = sqlalchemy.Column(
+        sqlalchemy.Integer, nullable=False, default=0, server_default="0"
+    )
+
+    # Written at most every `giphy.refresher.activity_interval` seconds, the
+    # refresher keeps the gifs of recently active users fresh first
+    last_active_at = sqlalchemy.Column(sqlalchemy.DateTime)
 
     # Relationships
     categories = sqlalchemy.orm.relationship("Category", back_populates="user")
@@ -73,7 +91,36 @@ class User(models.database.Base):
         :returns: Nothing
         :rtype: None
         """
-        self.enc_password = lib.funcs.encrypt(value)
+        iterations = lib.hashing.work_factor()
+        self.enc_password = lib.funcs.encrypt(value, iterations)
+        self.password_iterations = iterations
+
+    @property
+    def needs_rehash(self):
+        """
+        Whether the password was hashed with a different work factor than the
+        configured one
+
+        :returns: True if the password should be hashed again
+        :rtype: bool
+        """
+        return self.password_iterations != lib.hashing.work_factor()
+
+    def check_password(self, value):
+        """
+        Checks a password against the stored hash in constant time
+
+        :param value: Password to check
+        :type value: str
+        :returns: True if the password matches
+        :rtype: bool
+        :raises lib.hashing.HashingBusy: If too many passwords are being hashed
+        """
+        return lib.hashing.verify_password(
+            value,
+            self.enc_password,
+            self.password_iterations or LEGACY_ITERATIONS,
+        )
 
     def to_dict(self):
         """
@@ -6,6 +6,9 @@ import logging.config
 import flask
 
 # Application imports
+from lib import instrumentation
+from lib import metrics
+from lib import refresher
 from models import database
 import config
 from controllers.controllers import base
@@ -33,6 +36,15 @@ def create_app():
 
     # Load database
     database.init_db()
+    app.teardown_appcontext(database.remove_sessions)
+    instrumentation.init_app(app, database.engine, database.replica_engine)
+    metrics.init_app(app, database.engine)
+
+    # Otherwise `python -m lib.refresher` is expected to be running
+    if refresher.enabled() and config.giphy.get("refresher", {}).get(
+        "run_in_app", True
+    ):
+        refresher.start()
 
     return app
 
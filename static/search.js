@@ -9,6 +9,24 @@ function buildUX() {
   });
 }
 
+function mediaUrl(url) {
+  // Previews load through our media cache when the proxy is enabled
+  if (media_proxy && url) {
+    return "/media?url=" + encodeURIComponent(url);
+  }
+  return url;
+}
+
+
+function renderPreview(images) {
+  // Gifs GIPHY lost, or requested without preview_gif, have no preview
+  if (images && images["preview_gif"] && images["preview_gif"]["url"]) {
+    return "<img src=\"" + mediaUrl(images["preview_gif"]["url"]) + "\"/>";
+  }
+  return "Preview unavailable";
+}
+
+
 function renderResults(data) {
   var table = "";
 
@@ -50,8 +68,10 @@ function renderResults(data) {
 
       table += (
         "<td align=\"center\">"
-        + "<img src=\"" + data["data"][x]["images"]["preview_gif"]["url"]
-        + "\"/>" + "<br>" + "Title: " + data["data"][x]["title"] + "<br>"
+        + "<input type=\"checkbox\" class=\"select_gif\" value=\"" + gifid
+        + "\"><br>"
+        + renderPreview(data["data"][x]["images"]) + "<br>" + "Title: "
+        + data["data"][x]["title"] + "<br>"
         + "<input type=\"hidden\" id=\"saved_" + gifid + "\" value="
         + saved + ">" + "<input type=\"hidden\" id=\"favorited_" + gifid
         + "\" value=" + favorited + ">" + save_button + "&nbsp;&nbsp;&nbsp;"
@@ -156,140 +176,154 @@ function executeSearch(offset=0) {
 }
 
 
-function addCategory(gifid) {
-  var xhttp = new XMLHttpRequest();
-  // When the Add button is clicked, add the category to the bookmark
-  var category = document.getElementById("categories_for_" + gifid);
+function renderState(data) {
+  // Re-renders a gif from the state a change returned, no need to fetch the
+  // categories again
+  if (data["error"]) {
+    return;
+  }
 
-  xhttp.onreadystatechange = function() {
-    if (this.readyState == 4 && this.status == 200) {
-      // Add the new category to the div
-    }
-  };
+  var gifid = data["data"]["id"];
+  var bookmark_button = document.getElementById("bookmark_" + gifid);
+  var favorite_button = document.getElementById("favorite_" + gifid);
 
-  xhttp.open(
-    "GET",
-    (
-      "/add_categories/" + gifid + "/"
-      + category.options[category.selectedIndex].value
-    )
+  document.getElementById("saved_" + gifid).value = data["data"]["saved"];
+  document.getElementById("favorited_" + gifid).value = (
+    data["data"]["favorited"]
   );
-  xhttp.send();
+  bookmark_button.innerHTML = data["data"]["saved"] ? "Remove" : "Save";
+  favorite_button.innerHTML = (
+    data["data"]["favorited"] ? "Unfavorite" : "Favorite"
+  );
+
+  var output = "";
+  if (data["data"]["saved"]) {
+    for (var x in data["data"]["categories"]) {
+      var category = data["data"]["categories"][x];
+      output += (
+        "<div align=\"left\"><button type=\"button\" onclick=\""
+        + "removeCategory('" + gifid + "', " + category["id"]
+        + ")\">Remove</button>&nbsp;&nbsp;&nbsp; " + category["name"]
+        + "</div>"
+      );
+    }
+
+    // Give a drop down to add categories
+    output += "<select id=\"categories_for_" + gifid + "\">";
+    for (var x in data["categories"]) {
+      output += (
+        "<option value=\"" + data["categories"][x]["id"] + "\">"
+        + data["categories"][x]["name"] + "</option>"
+      );
+    }
+    output += "</select>";
+    output += (
+      "<button type=\"button\" onclick=\"addCategory('" + gifid
+      + "')\">Add</button>"
+    );
+  }
+  document.getElementById("categories_" + gifid).innerHTML = output;
 }
 
 
-function removeCategory(gifid) {
+function changeBookmark(path) {
   var xhttp = new XMLHttpRequest();
-  // When the Add button is clicked, add the category to the bookmark
-  var category = document.getElementById("categories_for_" + gifid);
 
   xhttp.onreadystatechange = function() {
     if (this.readyState == 4 && this.status == 200) {
-      // Remove the category from the div
+      renderState(JSON.parse(this.responseText));
     }
   };
 
-  xhttp.open(
-    "GET",
-    (
-      "/remove_categories/" + gifid + "/"
-      + category.options[category.selectedIndex].value
-    )
-  );
+  xhttp.open("GET", path, true);
   xhttp.send();
 }
 
 
-function loadAndRenderCategories(gifid) {
-  var xhttp = new XMLHttpRequest();
-  var categories = document.getElementById("categories_" + gifid);
+function addCategory(gifid) {
+  // When the Add button is clicked, add the category to the bookmark
+  var category = document.getElementById("categories_for_" + gifid);
 
-  xhttp.onreadystatechange = function() {
-    var output = "";
-    if (this.readyState == 4 && this.status == 200) {
-      var data = JSON.parse(this.responseText);
-      // Give a drop down to add categories
-      output = "<select id=\"categories_for_" + gifid + "\">";
-
-      for (var x in data) {
-        output += (
-          "<option value=\"" + data[x]["id"] + "\">" + data[x]["name"]
-          + "</option>"
-        );
-      }
+  changeBookmark(
+    "/add_categories/" + escape(gifid) + "/"
+    + category.options[category.selectedIndex].value
+  );
+}
 
-      output += "</select>";
-      output += (
-        "<button type=\"button\" onclick=\"addCategory('" + gifid
-        + "')\">Add</button>"
-      );
-    }
-    categories.innerHTML = output;
-  };
 
-  xhttp.open("GET", "/get_categories");
-  xhttp.send();
+function removeCategory(gifid, category_id) {
+  changeBookmark("/remove_categories/" + escape(gifid) + "/" + category_id);
 }
 
 
 function toggleBookmark(gifid) {
-  var xhttp = new XMLHttpRequest();
-  var already_saved = document.getElementById("saved_" + gifid);
-  var bookmark_button = document.getElementById("bookmark_" + gifid);
-  var favorite_button = document.getElementById("favorite_" + gifid);
+  if (document.getElementById("saved_" + gifid).value == "false") {
+    changeBookmark("/save_gif_by_id/" + escape(gifid));
+  }
+  else {
+    changeBookmark("/remove_gif_by_id/" + escape(gifid));
+  }
+}
 
-  xhttp.onreadystatechange = function() {
-    if (this.readyState == 4 && this.status == 200) {
-      if (already_saved.value == "false") {
-        bookmark_button.innerHTML = "Remove";
-        already_saved.value = true;
-        loadAndRenderCategories(gifid);
-      }
-      else {
-        bookmark_button.innerHTML = "Save";
-        favorite_button.innerHTML = "Favorite";
-        already_saved.value = false;
-        document.getElementById("favorited_" + gifid).value = false;
-      }
-    }
-  };
 
-  if (already_saved.value == "false") {
-    xhttp.open("GET", "/save_gif_by_id/" + escape(gifid), true);
+function toggleFavorite(gifid) {
+  if (document.getElementById("favorited_" + gifid).value == "false") {
+    changeBookmark("/favorite_gif_by_id/" + escape(gifid));
   }
   else {
-    xhttp.open("GET", "/remove_gif_by_id/" + escape(gifid), true);
+    changeBookmark("/unfavorite_gif_by_id/" + escape(gifid));
   }
-  xhttp.send();
 }
 
 
-function toggleFavorite(gifid) {
+function selectedGifs() {
+  var gifids = [];
+  var checkboxes = document.getElementsByClassName("select_gif");
+  for (var x = 0; x < checkboxes.length; x++) {
+    if (checkboxes[x].checked) {
+      gifids.push(checkboxes[x].value);
+    }
+  }
+  return gifids;
+}
+
+
+function bulkAction(action) {
+  // Saves or favorites every selected gif with a single request
   var xhttp = new XMLHttpRequest();
-  var already_saved = document.getElementById("favorited_" + gifid);
-  var bookmark_button = document.getElementById("bookmark_" + gifid);
-  var favorite_button = document.getElementById("favorite_" + gifid);
+  var gifids = selectedGifs();
+
+  if (gifids.length == 0) {
+    return;
+  }
 
   xhttp.onreadystatechange = function() {
     if (this.readyState == 4 && this.status == 200) {
-      if (already_saved.value == "false") {
-        bookmark_button.innerHTML = "Remove";
-        favorite_button.innerHTML = "Unfavorite";
-        already_saved.value = true;
-        loadAndRenderCategories(gifid);
+      var data = JSON.parse(this.responseText);
+      if (data["error"]) {
+        return;
       }
-      else {
-        favorite_button.innerHTML = "Favorite";
-        already_saved.value = false;
+
+      var results = data["results"][0]["results"];
+      for (var gifid in results) {
+        if (!results[gifid]) {
+          continue;
+        }
+        document.getElementById("bookmark_" + gifid).innerHTML = "Remove";
+        document.getElementById("saved_" + gifid).value = true;
+        if (action == "favorite") {
+          document.getElementById("favorite_" + gifid).innerHTML = (
+            "Unfavorite"
+          );
+          document.getElementById("favorited_" + gifid).value = true;
+        }
       }
     }
   };
 
-  if (already_saved.value == "false") {
-    xhttp.open("GET", "/favorite_gif_by_id/" + escape(gifid), true);
-  }
-  else {
-    xhttp.open("GET", "/unfavorite_gif_by_id/" + escape(gifid), true);
-  }
-  xhttp.send();
-}
\ No newline at end of file
+  xhttp.open("POST", "/bulk_operations", true);
+  xhttp.setRequestHeader("Content-Type", "application/json");
+  xhttp.send(
+    JSON.stringify({"operations": [{"action": action, "gifids": gifids}]})
+  );
+}
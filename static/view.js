@@ -1,136 +1,304 @@
 
 
-function addCategory(gifid) {
+function mediaUrl(url) {
+  // Previews load through our media cache when the proxy is enabled
+  if (media_proxy && url) {
+    return "/media?url=" + encodeURIComponent(url);
+  }
+  return url;
+}
+
+
+function renderPreview(images) {
+  // Gifs GIPHY lost, or requested without preview_gif, have no preview
+  if (images && images["preview_gif"] && images["preview_gif"]["url"]) {
+    return "<img src=\"" + mediaUrl(images["preview_gif"]["url"]) + "\"/>";
+  }
+  return "Preview unavailable";
+}
+
+
+function renderCategory(gifid, category_id, category_name) {
+  return (
+    "<div id=\"cat_" + gifid + "_" + category_id + "\" align=\"left\">"
+    + "<button type=\"button\" onclick=\"removeCategory('" + gifid + "', "
+    + category_id + ")\">Remove</button>" + "&nbsp;&nbsp;&nbsp; "
+    + category_name + "</div>"
+  );
+}
+
+
+function renderState(data) {
+  // Re-renders a gif from the state a change returned, no need to fetch the
+  // categories again
+  if (data["error"]) {
+    return;
+  }
+
+  var gifid = data["data"]["id"];
+  var bookmark_button = document.getElementById("bookmark_" + gifid);
+  var favorite_button = document.getElementById("favorite_" + gifid);
+  var category_select = document.getElementById("categories_for_" + gifid);
+
+  document.getElementById("saved_" + gifid).value = data["data"]["saved"];
+  document.getElementById("favorited_" + gifid).value = (
+    data["data"]["favorited"]
+  );
+  bookmark_button.innerHTML = data["data"]["saved"] ? "Remove" : "Save";
+  favorite_button.innerHTML = (
+    data["data"]["favorited"] ? "Unfavorite" : "Favorite"
+  );
+
+  var categories = "";
+  for (var x in data["data"]["categories"]) {
+    categories += renderCategory(
+      gifid,
+      data["data"]["categories"][x]["id"],
+      data["data"]["categories"][x]["name"]
+    );
+  }
+  document.getElementById("categories_" + gifid).innerHTML = categories;
+
+  user_categories = data["categories"];
+  var options = "";
+  for (var x in user_categories) {
+    options += (
+      "<option value=\"" + user_categories[x]["id"] + "\">"
+      + user_categories[x]["name"] + "</option>"
+    );
+  }
+  category_select.innerHTML = options;
+}
+
+
+function changeBookmark(path) {
   var xhttp = new XMLHttpRequest();
-  // When the Add button is clicked, add the category to the bookmark
-  var categories = document.getElementById("categories_" + gifid);
-  var new_category = document.getElementById("categories_for_" + gifid);
-  var category_id = new_category.options[new_category.selectedIndex].value;
-  var category_name = new_category.options[new_category.selectedIndex].text;
 
   xhttp.onreadystatechange = function() {
     if (this.readyState == 4 && this.status == 200) {
-      categories.innerHTML += (
-        "<div id=\"cat_" + gifid + "_" + category_id + "\" align=\"left\">"
-        + "<button type=\"button\" onclick=\"removeCategory('" + gifid + "', "
-        + category_id + ")\">Remove</button>" + "&nbsp;&nbsp;&nbsp; "
-        + category_name + "</div>"
-      );
+      renderState(JSON.parse(this.responseText));
     }
   };
 
-  xhttp.open("GET", "/add_categories/" + gifid + "/" + category_id);
+  xhttp.open("GET", path, true);
   xhttp.send();
 }
 
 
-function removeCategory(gifid, category_id) {
-  var xhttp = new XMLHttpRequest();
+function addCategory(gifid) {
   // When the Add button is clicked, add the category to the bookmark
-  var category = document.getElementById("cat_" + gifid + "_" + category_id);
+  var new_category = document.getElementById("categories_for_" + gifid);
+  var category_id = new_category.options[new_category.selectedIndex].value;
 
-  xhttp.onreadystatechange = function() {
-    if (this.readyState == 4 && this.status == 200) {
-      // Remove the category from the div
-      category.innerHTML = "";
-    }
-  };
+  changeBookmark("/add_categories/" + escape(gifid) + "/" + category_id);
+}
 
-  xhttp.open("GET", "/remove_categories/" + gifid + "/" + category_id);
-  xhttp.send();
+
+function removeCategory(gifid, category_id) {
+  changeBookmark("/remove_categories/" + escape(gifid) + "/" + category_id);
+}
+
+
+function toggleBookmark(gifid) {
+  if (document.getElementById("saved_" + gifid).value == "false") {
+    changeBookmark("/save_gif_by_id/" + escape(gifid));
+  }
+  else {
+    changeBookmark("/remove_gif_by_id/" + escape(gifid));
+  }
+}
+
+
+function toggleFavorite(gifid) {
+  if (document.getElementById("favorited_" + gifid).value == "false") {
+    changeBookmark("/favorite_gif_by_id/" + escape(gifid));
+  }
+  else {
+    changeBookmark("/unfavorite_gif_by_id/" + escape(gifid));
+  }
 }
 
+function renderBookmark(data) {
+  var gifid = data["id"];
+  var favorite_button = (
+    "<button type=\"button\" id=\"favorite_" + gifid
+    + "\" onclick=\"toggleFavorite('" + gifid + "')\">"
+  );
 
-function loadAndRenderCategories(gifid) {
+  if (data["favorited"]) {
+    favorite_button += "Unfavorite</button>";
+  }
+  else {
+    favorite_button += "Favorite</button>";
+  }
+
+  var categories = "";
+  for (var x in data["categories"]) {
+    categories += renderCategory(
+      gifid, data["categories"][x]["id"], data["categories"][x]["name"]
+    );
+  }
+
+  var options = "";
+  for (var x in user_categories) {
+    options += (
+      "<option value=\"" + user_categories[x]["id"] + "\">"
+      + user_categories[x]["name"] + "</option>"
+    );
+  }
+
+  return (
+    "<input type=\"checkbox\" class=\"select_gif\" value=\"" + gifid
+    + "\"><br>"
+    + renderPreview(data["images"]) + "<br>"
+    + "Title: " + data["title"] + "<br>"
+    + "<input type=\"hidden\" id=\"saved_" + gifid + "\" value=\"true\">"
+    + "<input type=\"hidden\" id=\"favorited_" + gifid + "\" value=\""
+    + data["favorited"] + "\">"
+    + "<button type=\"button\" id=\"bookmark_" + gifid
+    + "\" onclick=\"toggleBookmark('" + gifid + "')\">Remove</button>"
+    + "&nbsp;&nbsp;&nbsp;" + favorite_button + "<br><br>"
+    + "<div id=\"categories_" + gifid + "\">" + categories + "</div><br>"
+    + "<div><select id=\"categories_for_" + gifid + "\">" + options
+    + "</select><button type=\"button\" onclick=\"addCategory('" + gifid
+    + "')\">Add</button></div>"
+  );
+}
+
+
+function loadMore() {
   var xhttp = new XMLHttpRequest();
-  var categories = document.getElementById("categories_" + gifid);
+  var next_cursor = document.getElementById("next_cursor");
+  var load_more_button = document.getElementById("load_more_button");
+  var number_of_items = document.getElementById("number_of_items");
+  var table = document.getElementById("library_table");
 
   xhttp.onreadystatechange = function() {
-    var output = "";
     if (this.readyState == 4 && this.status == 200) {
       var data = JSON.parse(this.responseText);
-      // Give a drop down to add categories
-      output = "<select id=\"categories_for_" + gifid + "\">";
-
-      for (var x in data) {
-        output += (
-          "<option value=\"" + data[x]["id"] + "\">" + data[x]["name"]
-          + "</option>"
-        );
+      if (data["error"]) {
+        load_more_button.innerHTML = "Load More";
+        return;
       }
 
-      output += "</select>";
-      output += (
-        "<button type=\"button\" onclick=\"addCategory('" + gifid
-        + "')\">Add</button>"
+      // Bunch of images 5 to a row
+      var row = null;
+      for (var x in data["data"]) {
+        if (x % 5 == 0) {
+          row = table.insertRow(-1);
+        }
+        var cell = row.insertCell(-1);
+        cell.align = "center";
+        cell.innerHTML = renderBookmark(data["data"][x]);
+      }
+
+      number_of_items.innerHTML = (
+        parseInt(number_of_items.innerHTML) + data["count"]
       );
+      if (data["next"]) {
+        next_cursor.value = data["next"];
+        load_more_button.innerHTML = "Load More";
+      }
+      else {
+        next_cursor.value = "";
+        load_more_button.style.display = "none";
+      }
     }
-    categories.innerHTML = output;
   };
 
-  xhttp.open("GET", "/get_categories");
+  load_more_button.innerHTML = "Loading...";
+  xhttp.open("GET", "/get_library?after=" + escape(next_cursor.value), true);
   xhttp.send();
 }
 
 
-function toggleBookmark(gifid) {
-  var xhttp = new XMLHttpRequest();
-  var already_saved = document.getElementById("saved_" + gifid);
-  var bookmark_button = document.getElementById("bookmark_" + gifid);
+function selectedGifs() {
+  var gifids = [];
+  var checkboxes = document.getElementsByClassName("select_gif");
+  for (var x = 0; x < checkboxes.length; x++) {
+    if (checkboxes[x].checked) {
+      gifids.push(checkboxes[x].value);
+    }
+  }
+  return gifids;
+}
+
+
+function renderOperation(action, gifid, category_id, category_name) {
+  var favorited = document.getElementById("favorited_" + gifid);
   var favorite_button = document.getElementById("favorite_" + gifid);
+  var number_of_items = document.getElementById("number_of_items");
 
-  xhttp.onreadystatechange = function() {
-    if (this.readyState == 4 && this.status == 200) {
-      if (already_saved.value == "false") {
-        bookmark_button.innerHTML = "Remove";
-        already_saved.value = true;
-        loadAndRenderCategories(gifid);
-      }
-      else {
-        bookmark_button.innerHTML = "Save";
-        favorite_button.innerHTML = "Favorite";
-        already_saved.value = false;
-        document.getElementById("favorited_" + gifid).value = false;
-      }
+  if (action == "favorite") {
+    favorite_button.innerHTML = "Unfavorite";
+    favorited.value = true;
+  }
+  else if (action == "unfavorite") {
+    favorite_button.innerHTML = "Favorite";
+    favorited.value = false;
+  }
+  else if (action == "remove") {
+    // Empty the gif's cell, the same way removing one at a time does
+    favorited.parentNode.innerHTML = "";
+    number_of_items.innerHTML = parseInt(number_of_items.innerHTML) - 1;
+  }
+  else if (action == "add_category") {
+    if (!document.getElementById("cat_" + gifid + "_" + category_id)) {
+      document.getElementById("categories_" + gifid).innerHTML += (
+        renderCategory(gifid, category_id, category_name)
+      );
     }
-  };
-
-  if (already_saved.value == "false") {
-    xhttp.open("GET", "/save_gif_by_id/" + escape(gifid), true);
   }
-  else {
-    xhttp.open("GET", "/remove_gif_by_id/" + escape(gifid), true);
+  else if (action == "remove_category") {
+    var category = document.getElementById("cat_" + gifid + "_" + category_id);
+    if (category) {
+      category.parentNode.removeChild(category);
+    }
   }
-  xhttp.send();
 }
 
 
-function toggleFavorite(gifid) {
+function bulkAction(action) {
+  // Applies an action to every selected gif with a single request
   var xhttp = new XMLHttpRequest();
-  var already_saved = document.getElementById("favorited_" + gifid);
-  var bookmark_button = document.getElementById("bookmark_" + gifid);
-  var favorite_button = document.getElementById("favorite_" + gifid);
+  var gifids = selectedGifs();
+  var category = document.getElementById("bulk_category");
+  var operation = {"action": action, "gifids": gifids};
+  var category_name = "";
+
+  if (gifids.length == 0) {
+    return;
+  }
+
+  if (action == "add_category" || action == "remove_category") {
+    if (category.selectedIndex < 0) {
+      return;
+    }
+    operation["category_id"] = parseInt(
+      category.options[category.selectedIndex].value
+    );
+    category_name = category.options[category.selectedIndex].text;
+  }
 
   xhttp.onreadystatechange = function() {
     if (this.readyState == 4 && this.status == 200) {
-      if (already_saved.value == "false") {
-        bookmark_button.innerHTML = "Remove";
-        favorite_button.innerHTML = "Unfavorite";
-        already_saved.value = true;
-        loadAndRenderCategories(gifid);
+      var data = JSON.parse(this.responseText);
+      if (data["error"]) {
+        return;
       }
-      else {
-        favorite_button.innerHTML = "Favorite";
-        already_saved.value = false;
+
+      var results = data["results"][0]["results"];
+      for (var gifid in results) {
+        if (results[gifid]) {
+          renderOperation(
+            action, gifid, operation["category_id"], category_name
+          );
+        }
       }
     }
   };
 
-  if (already_saved.value == "false") {
-    xhttp.open("GET", "/favorite_gif_by_id/" + escape(gifid), true);
-  }
-  else {
-    xhttp.open("GET", "/unfavorite_gif_by_id/" + escape(gifid), true);
-  }
-  xhttp.send();
-}
\ No newline at end of file
+  xhttp.open("POST", "/bulk_operations", true);
+  xhttp.setRequestHeader("Content-Type", "application/json");
+  xhttp.send(JSON.stringify({"operations": [operation]}));
+}
@@ -0,0 +1,160 @@
+# Standard imports
+import datetime
+import os
+import shutil
+import sys
+import uuid
+
+# Third party imports
+import pytest
+import sqlalchemy
+
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    """
+    Application pointed at $TEST_DATABASE_URI and a local stand-in for
+    GIPHY. The database must be a scratch Postgres database, every table in
+    it is dropped first so each run starts from the migrated schema. Tests
+    using the application are skipped when it isn't set
+
+    :returns: Flask app object
+    :rtype: flask.Flask
+    """
+    database_uri = os.environ.get("TEST_DATABASE_URI")
+    if not database_uri:
+        pytest.skip(
+            "TEST_DATABASE_URI isn't set to a scratch Postgres database"
+        )
+
+    # config.py loads config.yaml and the key files from the working
+    # directory when it's first imported
+    workdir = tmp_path_factory.mktemp("config")
+    shutil.copy(os.path.join(REPO, "config.yaml"), str(workdir))
+    (workdir / "api_key.txt").write_text("test-api-key\n")
+    (workdir / "salt.txt").write_text("test-salt")
+    os.chdir(str(workdir))
+
+    import config
+    from bench.fake_giphy import FakeGiphy
+
+    engine = sqlalchemy.create_engine(database_uri)
+    metadata = sqlalchemy.MetaData()
+    metadata.reflect(bind=engine)
+    metadata.drop_all(bind=engine)
+    engine.dispose()
+
+    fake_giphy = FakeGiphy()
+    fake_giphy.start()
+
+    # Must happen before the application (and its engine) is loaded
+    config.giphy["search_endpoint"] = fake_giphy.url + "/v1/gifs/search"
+    config.giphy["get_endpoint"] = fake_giphy.url + "/v1/gifs"
+    config.app["password_hashing"]["workers"] = 0
+    config.postgresql["sqlalchemy_uri"] = database_uri
+
+    import run
+
+    app = run.create_app()
+    app.testing = True
+    yield app
+    fake_giphy.stop()
+
+
+@pytest.fixture(scope="session")
+def user(app):
+    """
+    User with a library of bookmarks, each with stored metadata and two
+    categories. The gif ids match what the stand-in's "cats" search returns
+
+    :returns: Auth token and gif ids of the user
+    :rtype: tuple(str, list)
+    """
+    import models.database
+    import models.bookmark_xref_categories
+    import models.bookmarks
+    import models.categories
+    import models.gifs
+    import models.users
+
+    session = models.database.session
+    token = uuid.uuid4().hex
+    user = models.users.User(
+        username="budget-{}".format(token), password="budget", token=token
+    )
+    session.add(user)
+    session.flush()
+
+    categories = [
+        models.categories.Category(name=name, user_id=user.id)
+        for name in ("funny", "reactions")
+    ]
+    session.add_all(categories)
+
+    gifids = ["cats{}".format(index) for index in range(20)]
+    for gifid in gifids:
+        # Other tests may have stored it already
+        session.merge(
+            models.gifs.Gif(
+                giphy_id=gifid,
+                title=gifid,
+                images={"preview_gif": {"url": "https://giphy.com/p.gif"}},
+                refreshed_at=datetime.datetime.utcnow(),
+            )
+        )
+        bookmark = models.bookmarks.Bookmark(user_id=user.id, giphy_id=gifid)
+        session.add(bookmark)
+        session.flush()
+        for category in categories:
+            session.add(
+                models.bookmark_xref_categories.BookmarkXrefCategory(
+                    bookmark_id=bookmark.id, category_id=category.id
+                )
+            )
+
+    session.commit()
+    session.remove()
+    return token, gifids
+
+
+@pytest.fixture
+def client(app, user):
+    """
+    Test client authenticated as :func:`user`
+
+    :returns: Flask test client
+    :rtype: flask.testing.FlaskClient
+    """
+    client = app.test_client()
+    client.set_cookie("localhost", "X-Auth-Token", user[0])
+    return client
+
+
+@pytest.fixture
+def empty_client(app):
+    """
+    Test client authenticated as a new user with an empty library, for tests
+    that change it
+
+    :returns: Flask test client
+    :rtype: flask.testing.FlaskClient
+    """
+    import models.database
+    import models.users
+
+    token = uuid.uuid4().hex
+    models.database.session.add(
+        models.users.User(
+            username="empty-{}".format(token), password="empty", token=token
+        )
+    )
+    models.database.session.commit()
+    models.database.session.remove()
+
+    client = app.test_client()
+    client.set_cookie("localhost", "X-Auth-Token", token)
+    return client
@@ -0,0 +1,178 @@
+# Standard imports
+import json
+
+
+def get_json(client, path, **kwargs):
+    response = client.get(path, **kwargs)
+    assert response.status_code == 200
+    return json.loads(response.data)
+
+
+def add_category(client, name):
+    return get_json(client, "/add_category/{}".format(name))["id"]
+
+
+def library(client):
+    output = get_json(client, "/get_library")
+    assert not output["error"]
+    return {
+        gif["id"]: (
+            gif["favorited"],
+            sorted(category["name"] for category in gif["categories"]),
+        )
+        for gif in output["data"]
+    }
+
+
+def test_change_bookmark_returns_the_new_state(empty_client):
+    client = empty_client
+    funny = add_category(client, "funny")
+
+    output = get_json(client, "/save_gif_by_id/cats1")
+    assert not output["error"]
+    assert output["data"] == {
+        "id": "cats1",
+        "saved": True,
+        "favorited": False,
+        "categories": [],
+    }
+
+    output = get_json(client, "/favorite_gif_by_id/cats1")
+    assert output["data"]["favorited"] is True
+
+    output = get_json(client, "/add_categories/cats1/{}".format(funny))
+    assert [c["name"] for c in output["data"]["categories"]] == ["funny"]
+    assert [c["name"] for c in output["categories"]] == ["funny"]
+
+    output = get_json(client, "/remove_categories/cats1/{}".format(funny))
+    assert output["data"]["categories"] == []
+
+    output = get_json(client, "/unfavorite_gif_by_id/cats1")
+    assert output["data"]["favorited"] is False
+
+    output = get_json(client, "/remove_gif_by_id/cats1")
+    assert output["data"]["saved"] is False
+    assert library(client) == {}
+
+
+def test_saving_twice_keeps_one_bookmark(empty_client):
+    get_json(empty_client, "/favorite_gif_by_id/cats1")
+    output = get_json(empty_client, "/save_gif_by_id/cats1")
+
+    # Saving again doesn't unfavorite it
+    assert output["data"]["favorited"] is True
+    assert library(empty_client) == {"cats1": (True, [])}
+
+
+def test_bulk_operations(empty_client):
+    client = empty_client
+    funny = add_category(client, "funny")
+
+    response = client.post(
+        "/bulk_operations",
+        json={
+            "operations": [
+                {"action": "save", "gifids": ["cats1", "cats2", "cats3"]},
+                {"action": "favorite", "gifids": ["cats2"]},
+                {
+                    "action": "add_category",
+                    "category_id": funny,
+                    "gifids": ["cats1", "cats2", "cats9"],
+                },
+                {"action": "remove", "gifids": ["cats3"]},
+            ]
+        },
+    )
+    output = json.loads(response.data)
+
+    assert not output["error"]
+    assert [result["results"] for result in output["results"]] == [
+        {"cats1": True, "cats2": True, "cats3": True},
+        {"cats2": True},
+        {"cats1": True, "cats2": True, "cats9": False},
+        {"cats3": True},
+    ]
+    assert library(client) == {
+        "cats1": (False, ["funny"]),
+        "cats2": (True, ["funny"]),
+    }
+
+
+def test_bulk_operations_apply_nothing_if_one_is_invalid(empty_client):
+    response = empty_client.post(
+        "/bulk_operations",
+        json={
+            "operations": [
+                {"action": "save", "gifids": ["cats1"]},
+                {"action": "add_category", "gifids": ["cats1"]},
+            ]
+        },
+    )
+
+    assert json.loads(response.data)["error"].startswith("Invalid operations")
+    assert library(empty_client) == {}
+
+
+def test_bulk_operations_skip_other_users_categories(client, empty_client):
+    other = get_json(client, "/get_categories")[0]["id"]
+    get_json(empty_client, "/save_gif_by_id/cats1")
+
+    response = empty_client.post(
+        "/bulk_operations",
+        json={
+            "operations": [
+                {
+                    "action": "add_category",
+                    "category_id": other,
+                    "gifids": ["cats1"],
+                }
+            ]
+        },
+    )
+
+    assert json.loads(response.data)["results"][0]["results"] == {
+        "cats1": False
+    }
+    assert library(empty_client) == {"cats1": (False, [])}
+
+
+def test_export_then_import_into_another_library(client, empty_client):
+    exported = client.get("/export").data
+
+    for _ in range(2):
+        # A second import merges into what the first one loaded
+        output = json.loads(empty_client.post("/import", data=exported).data)
+        assert not output["error"]
+        assert output["bookmarks"] == 20
+
+    assert library(empty_client) == library(client)
+    assert len(library(empty_client)) == 20
+
+
+def test_import_merges_favorites(empty_client):
+    get_json(empty_client, "/favorite_gif_by_id/cats1")
+    lines = [
+        {"type": "bookmark", "giphy_id": "cats1", "favorite": False},
+        {"type": "bookmark", "giphy_id": "cats2", "categories": ["new"]},
+    ]
+
+    output = json.loads(
+        empty_client.post(
+            "/import", data="\n".join(json.dumps(line) for line in lines)
+        ).data
+    )
+
+    assert not output["error"]
+    assert library(empty_client) == {
+        "cats1": (True, []),
+        "cats2": (False, ["new"]),
+    }
+
+
+def test_invalid_import_loads_nothing(empty_client):
+    data = '{"type": "category", "name": "funny"}\nnot json\n'
+
+    output = json.loads(empty_client.post("/import", data=data).data)
+
+    assert output["error"] == "Invalid import: Line 2: invalid json"
+    assert get_json(empty_client, "/get_categories") == []
@@ -0,0 +1,55 @@
+# Standard imports
+import threading
+
+
+def test_interactive_call_does_not_join_background_flight(app):
+    import clients.giphy
+    import clients.scheduler
+
+    started = threading.Event()
+    release = threading.Event()
+
+    def background():
+        started.set()
+        release.wait(5)
+        return "background"
+
+    thread = threading.Thread(
+        target=clients.giphy.single_flight,
+        args=(
+            "search",
+            ("cats",),
+            background,
+            clients.scheduler.BACKGROUND,
+        ),
+    )
+    thread.start()
+    started.wait(5)
+    try:
+        result = clients.giphy.single_flight(
+            "search",
+            ("cats",),
+            lambda: "interactive",
+            clients.scheduler.INTERACTIVE,
+        )
+    finally:
+        release.set()
+        thread.join()
+
+    assert result == "interactive"
+
+
+def test_async_client_waits_for_keys_off_the_default_executor(app):
+    import clients.giphy_async
+
+    found, missing = clients.giphy_async.run(
+        clients.giphy_async.AsyncClient().get_many(["cats0", "cats1"]),
+        timeout=10,
+    )
+
+    assert sorted(found) == ["cats0", "cats1"]
+    assert not missing
+    assert any(
+        thread.name.startswith("giphy-async-key")
+        for thread in threading.enumerate()
+    )
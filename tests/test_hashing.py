@@ -0,0 +1,21 @@
+def test_worker_processes_hash_like_inline(app, monkeypatch):
+    import config
+    import lib.hashing
+
+    monkeypatch.setitem(
+        config.app, "password_hashing", {"workers": 1, "iterations": 1000}
+    )
+    monkeypatch.setattr(lib.hashing, "_executor", None)
+    try:
+        hashed = lib.hashing.hash_password("hunter2")
+        assert lib.hashing._executor._mp_context.get_start_method() in (
+            "forkserver",
+            "spawn",
+        )
+    finally:
+        if lib.hashing._executor is not None:
+            lib.hashing._executor.shutdown()
+
+    assert hashed == lib.hashing._pbkdf2(
+        "hunter2", config.postgresql["salt"], 1000
+    )
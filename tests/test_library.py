@@ -0,0 +1,21 @@
+# Standard imports
+import json
+
+# Third party imports
+import pytest
+
+
+@pytest.mark.parametrize("limit", ["0", "-1"])
+def test_get_library_rejects_limit_below_one(client, limit):
+    response = client.get("/get_library?limit={}".format(limit))
+
+    output = json.loads(response.data)
+    assert output["error"].startswith("Invalid parameters")
+    assert output["data"] == []
+
+
+@pytest.mark.parametrize("action", ["add_categories", "remove_categories"])
+def test_category_routes_reject_non_numeric_ids(client, action):
+    response = client.get("/{}/cats0/funny".format(action))
+
+    assert response.status_code == 404
@@ -0,0 +1,149 @@
+# Standard imports
+import os
+
+# Third party imports
+import pytest
+
+
+class FakeResponse(object):
+    """
+    Just enough of a streamed requests.Response for MediaCache
+    """
+
+    def __init__(self, body=b"", location=None):
+        self.body = body
+        self.headers = {"Content-Type": "image/gif"}
+        if location:
+            self.headers["Location"] = location
+        self.is_redirect = location is not None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        yield self.body
+
+
+class FakeSession(object):
+    """
+    Answers each URL with a canned response and records what was fetched
+    """
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.fetched = []
+
+    def get(self, url, **kwargs):
+        assert kwargs["allow_redirects"] is False
+        self.fetched.append(url)
+        return self.responses[url]
+
+
+@pytest.fixture
+def cache(app, tmp_path):
+    import lib.media_cache
+
+    def make(responses, max_bytes=10000):
+        return lib.media_cache.MediaCache(
+            str(tmp_path / "media"),
+            max_bytes=max_bytes,
+            max_object_bytes=1000,
+            session=FakeSession(responses),
+        )
+
+    return make
+
+
+def test_follows_redirects_on_allowed_hosts(cache):
+    media = cache(
+        {
+            "https://media.giphy.com/a.gif": FakeResponse(location="/b.gif"),
+            "https://media.giphy.com/b.gif": FakeResponse(b"gif"),
+        }
+    )
+
+    path, _, content_type = media.get("https://media.giphy.com/a.gif")
+
+    with open(path, "rb") as _file:
+        assert _file.read() == b"gif"
+    assert content_type == "image/gif"
+
+
+@pytest.mark.parametrize(
+    "location",
+    ["http://169.254.169.254/", "https://example.com/a.gif"],
+)
+def test_rejects_redirects_it_cant_proxy(cache, location):
+    import lib.media_cache
+
+    media = cache(
+        {"https://media.giphy.com/a.gif": FakeResponse(location=location)}
+    )
+
+    with pytest.raises(lib.media_cache.NotAllowed):
+        media.get("https://media.giphy.com/a.gif")
+    assert media.session.fetched == ["https://media.giphy.com/a.gif"]
+
+
+def test_stops_following_redirect_loops(cache):
+    import lib.media_cache
+
+    media = cache(
+        {"https://media.giphy.com/a.gif": FakeResponse(location="/a.gif")}
+    )
+
+    with pytest.raises(lib.media_cache.NotAllowed):
+        media.get("https://media.giphy.com/a.gif")
+    assert len(media.session.fetched) == lib.media_cache.MAX_REDIRECTS + 1
+
+
+def test_evicts_refs_of_evicted_files(cache):
+    urls = [
+        "https://media.giphy.com/{}.gif".format(index) for index in range(5)
+    ]
+    media = cache(
+        {
+            url: FakeResponse(bytes([index]) * 600)
+            for index, url in enumerate(urls)
+        },
+        max_bytes=2000,
+    )
+
+    for url in urls:
+        media.get(url)
+
+    blobs = os.listdir(os.path.join(media.directory, "blobs"))
+    refs = os.listdir(os.path.join(media.directory, "refs"))
+    assert len(refs) == len(blobs) < len(urls)
+    assert media.lookup(urls[-1]) is not None
+
+
+def test_media_revalidates_with_the_etag(client, cache, monkeypatch):
+    import config
+    import lib.media_cache
+
+    url = "https://media.giphy.com/a.gif"
+    media = cache({url: FakeResponse(b"gif")})
+    monkeypatch.setitem(config.app, "media_proxy", {"enabled": True})
+    monkeypatch.setattr(lib.media_cache, "_cache", media)
+
+    response = client.get("/media", query_string={"url": url})
+    assert response.data == b"gif"
+    assert "Last-Modified" not in response.headers
+
+    response = client.get(
+        "/media",
+        query_string={"url": url},
+        headers={"If-None-Match": response.headers["ETag"]},
+    )
+    assert response.status_code == 304
+    assert media.session.fetched == [url]
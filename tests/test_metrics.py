@@ -0,0 +1,67 @@
+# Standard imports
+import os
+import threading
+import time
+
+# Third party imports
+import pytest
+import sqlalchemy
+
+
+@pytest.fixture
+def timed_engine(app):
+    """
+    Engine on the test database with a single connection, timed by
+    :class:`lib.metrics.TimedQueuePool`
+
+    :returns: SQLAlchemy Engine
+    :rtype: sqlalchemy.engine.Engine
+    """
+    import lib.metrics
+
+    engine = sqlalchemy.create_engine(
+        os.environ["TEST_DATABASE_URI"],
+        poolclass=lib.metrics.TimedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_pre_ping=True,
+    )
+    yield engine
+    engine.dispose()
+
+
+def waits():
+    import lib.metrics
+
+    _, total, count = lib.metrics.DB_POOL_WAIT._values.get((), (0, 0.0, 0))
+    return total, count
+
+
+def test_checkout_wait_leaves_out_connecting(timed_engine):
+    total, count = waits()
+
+    with timed_engine.connect() as connection:
+        # Takes a while to connect, but nothing was waited on
+        connection.execute("SELECT 1")
+
+    assert waits()[1] == count + 1
+    assert waits()[0] - total < 0.05
+
+
+def test_checkout_wait_is_timed_after_dispose(timed_engine):
+    timed_engine.dispose()
+    held = timed_engine.connect()
+    total, count = waits()
+
+    def release():
+        time.sleep(0.2)
+        held.close()
+
+    thread = threading.Thread(target=release)
+    thread.start()
+    with timed_engine.connect() as connection:
+        connection.execute("SELECT 1")
+    thread.join()
+
+    assert waits()[1] == count + 1
+    assert waits()[0] - total >= 0.15
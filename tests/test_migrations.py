@@ -0,0 +1,97 @@
+# Standard imports
+import os
+
+# Third party imports
+import pytest
+import sqlalchemy
+
+
+# Tables as they were before the unique indexes, only the columns the
+# migrations touch
+LEGACY_SCHEMA = [
+    """
+    CREATE TABLE bookmarks (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        giphy_id VARCHAR NOT NULL,
+        favorite BOOLEAN NOT NULL DEFAULT FALSE
+    )
+    """,
+    """
+    CREATE TABLE categories (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        name VARCHAR NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE bookmark_xref_categories (
+        bookmark_id INTEGER REFERENCES bookmarks (id),
+        category_id INTEGER REFERENCES categories (id),
+        PRIMARY KEY (bookmark_id, category_id)
+    )
+    """,
+]
+
+
+@pytest.fixture
+def legacy_connection(app):
+    """
+    Connection to an empty schema of the test database holding
+    :data:`LEGACY_SCHEMA`, dropped afterwards
+
+    :returns: Connection with the schema on its search path
+    :rtype: sqlalchemy.engine.Connection
+    """
+    engine = sqlalchemy.create_engine(os.environ["TEST_DATABASE_URI"])
+    connection = engine.connect()
+    connection.execute("DROP SCHEMA IF EXISTS legacy CASCADE")
+    connection.execute("CREATE SCHEMA legacy")
+    connection.execute("SET search_path TO legacy")
+    for statement in LEGACY_SCHEMA:
+        connection.execute(statement)
+
+    yield connection
+
+    connection.execute("DROP SCHEMA legacy CASCADE")
+    connection.close()
+    engine.dispose()
+
+
+def test_duplicates_are_merged_into_the_oldest(legacy_connection):
+    import models.migrations
+
+    connection = legacy_connection
+    connection.execute(
+        """
+        INSERT INTO bookmarks (id, user_id, giphy_id, favorite) VALUES
+            (1, 1, 'cats', FALSE),
+            (2, 1, 'cats', TRUE),
+            (3, 1, 'cats', FALSE),
+            (4, 2, 'cats', FALSE);
+        INSERT INTO categories (id, user_id, name) VALUES
+            (1, 1, 'funny'),
+            (2, 1, 'funny'),
+            (3, 1, 'sad');
+        INSERT INTO bookmark_xref_categories VALUES (1, 2), (2, 1), (3, 3)
+        """
+    )
+
+    statements = {
+        version: statements
+        for version, _, statements in models.migrations.MIGRATIONS
+    }
+    for version in (2, 3):
+        for statement in statements[version]:
+            connection.execute(sqlalchemy.text(statement))
+
+    assert connection.execute(
+        "SELECT id, user_id, favorite FROM bookmarks ORDER BY id"
+    ).fetchall() == [(1, 1, True), (4, 2, False)]
+    assert connection.execute(
+        "SELECT id, name FROM categories ORDER BY id"
+    ).fetchall() == [(1, "funny"), (3, "sad")]
+    assert connection.execute(
+        "SELECT bookmark_id, category_id FROM bookmark_xref_categories "
+        "ORDER BY category_id"
+    ).fetchall() == [(1, 1), (1, 3)]
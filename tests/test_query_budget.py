@@ -0,0 +1,41 @@
+# Standard imports
+import json
+
+# Third party imports
+import pytest
+
+# Application imports
+from lib.query_budget import QueryBudgetExceeded, query_budget
+
+
+# Statements each endpoint may issue no matter how many bookmarks or
+# categories it renders, a new query per row goes over
+BUDGETS = {
+    # Version for the ETag, bookmarks with their gifs, their categories, and
+    # the user's categories
+    "/view": 4,
+    # Bookmarks with their gifs and their categories
+    "/get_library": 2,
+    "/get_library?limit=5": 2,
+    # Bookmarks among the results with their categories
+    "/do_search/cats": 2,
+}
+
+
+@pytest.mark.parametrize("path", sorted(BUDGETS))
+def test_endpoint_query_budget(client, path):
+    # Warms the token and search caches, which aren't what's measured
+    client.get(path)
+
+    with query_budget(BUDGETS[path]):
+        response = client.get(path)
+
+    assert response.status_code == 200
+    if path != "/view":
+        assert not json.loads(response.data)["error"]
+
+
+def test_query_budget_exceeded(client):
+    with pytest.raises(QueryBudgetExceeded):
+        with query_budget(1):
+            client.get("/get_library")
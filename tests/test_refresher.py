@@ -0,0 +1,35 @@
+# Standard imports
+import concurrent.futures
+
+
+def test_refresh_gifs_survives_async_timeout(app, monkeypatch):
+    import clients.giphy_async
+    import config
+    import lib.refresher
+
+    def run(coroutine, timeout=None):
+        coroutine.close()
+        raise concurrent.futures.TimeoutError()
+
+    monkeypatch.setitem(config.giphy, "async_client", {"enabled": True})
+    monkeypatch.setattr(clients.giphy_async, "run", run)
+
+    assert lib.refresher.refresh_gifs(["cats0"]) == {}
+
+
+def test_refreshed_metadata_changes_the_view_etag(client):
+    import lib.refresher
+    import models.database
+
+    etag = client.get("/view").headers["ETag"]
+    assert (
+        client.get("/view", headers={"If-None-Match": etag}).status_code == 304
+    )
+
+    lib.refresher.refresh_gifs(["cats0"])
+    models.database.session.commit()
+    models.database.session.remove()
+
+    response = client.get("/view", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
@@ -0,0 +1,57 @@
+# Third party imports
+import pytest
+
+# Application imports
+from clients.scheduler import (
+    BACKGROUND,
+    INTERACTIVE,
+    QuotaExhausted,
+    Scheduler,
+)
+
+
+@pytest.mark.parametrize(
+    "rate, burst, reserve",
+    [(0, 10, 0.2), (1, 0, 0.2), (1, 1, 0.25), (1, 4, 0.8), (1, 10, -0.1)],
+)
+def test_rejects_unusable_config(rate, burst, reserve):
+    with pytest.raises(ValueError):
+        Scheduler(["key"], rate=rate, burst=burst, reserve=reserve)
+
+
+def test_background_uses_a_full_bucket_of_one():
+    scheduler = Scheduler(["key"], rate=1, burst=1, reserve=0)
+
+    assert scheduler.acquire(BACKGROUND, timeout=0) == "key"
+
+
+def test_background_leaves_the_reserve_to_interactive():
+    scheduler = Scheduler(["key"], rate=0.001, burst=4, reserve=0.5)
+
+    assert scheduler.acquire(BACKGROUND, timeout=0) == "key"
+    assert scheduler.acquire(BACKGROUND, timeout=0) == "key"
+    with pytest.raises(QuotaExhausted):
+        scheduler.acquire(BACKGROUND, timeout=0)
+    assert scheduler.acquire(INTERACTIVE, timeout=0) == "key"
+    assert scheduler.acquire(INTERACTIVE, timeout=0) == "key"
+    with pytest.raises(QuotaExhausted):
+        scheduler.acquire(INTERACTIVE, timeout=0)
+
+
+def test_spreads_requests_over_keys():
+    scheduler = Scheduler(["a", "b"], rate=0.001, burst=2)
+
+    keys = [scheduler.acquire(INTERACTIVE, timeout=0) for _ in range(4)]
+
+    assert sorted(keys) == ["a", "a", "b", "b"]
+    with pytest.raises(QuotaExhausted):
+        scheduler.acquire(INTERACTIVE, timeout=0)
+
+
+def test_throttled_key_is_skipped():
+    scheduler = Scheduler(["a", "b"], rate=1, burst=5)
+
+    scheduler.throttled("a", 60)
+
+    assert scheduler.acquire(INTERACTIVE, timeout=0) == "b"
+    assert scheduler.budget()["...a"] == 0.0
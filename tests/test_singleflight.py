@@ -0,0 +1,93 @@
+# Standard imports
+import concurrent.futures
+import threading
+import time
+
+# Third party imports
+import pytest
+
+# Application imports
+from lib.singleflight import SingleFlight
+
+
+def run_while_in_flight(flight, function, callers):
+    """
+    Starts a call that blocks until `callers` other calls for the same key
+    were made, and returns what every call got
+    """
+    started = threading.Event()
+    release = threading.Event()
+
+    def leader():
+        started.set()
+        release.wait(5)
+        return function()
+
+    with concurrent.futures.ThreadPoolExecutor(callers + 1) as executor:
+        futures = [executor.submit(flight.do, "key", leader)]
+        started.wait(5)
+        futures.extend(
+            executor.submit(flight.do, "key", function, timeout=5)
+            for _ in range(callers)
+        )
+        # Plenty of time for the callers to start waiting on the leader
+        time.sleep(0.1)
+        release.set()
+
+    return futures
+
+
+def test_concurrent_calls_share_one_result():
+    flight = SingleFlight()
+    calls = []
+
+    def function():
+        calls.append(True)
+        return "result"
+
+    futures = run_while_in_flight(flight, function, callers=3)
+
+    assert [future.result() for future in futures] == ["result"] * 4
+    assert len(calls) == 1
+    assert len(flight) == 0
+
+
+def test_concurrent_calls_share_one_exception():
+    flight = SingleFlight()
+
+    def function():
+        raise KeyError("missing")
+
+    futures = run_while_in_flight(flight, function, callers=2)
+
+    for future in futures:
+        with pytest.raises(KeyError):
+            future.result()
+    assert len(flight) == 0
+
+
+def test_waiter_gives_up_after_timeout():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def leader():
+        started.set()
+        release.wait(5)
+
+    thread = threading.Thread(target=flight.do, args=("key", leader))
+    thread.start()
+    started.wait(5)
+    try:
+        with pytest.raises(concurrent.futures.TimeoutError):
+            flight.do("key", lambda: "never", timeout=0.01)
+    finally:
+        release.set()
+        thread.join()
+
+
+def test_later_calls_run_again():
+    flight = SingleFlight()
+
+    assert flight.do("key", lambda: 1) == 1
+    assert flight.do("key", lambda: 2) == 2